@@ -0,0 +1,507 @@
+import javax.tools.FileObject;
+import javax.tools.ForwardingJavaFileManager;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileManager;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.StringWriter;
+import java.lang.management.ManagementFactory;
+import java.lang.management.ThreadMXBean;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.lang.reflect.Modifier;
+import java.net.URI;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.Arrays;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Warm JVM that compiles and runs Java programs for the CodeServer.
+ *
+ * The server starts this once (java JavaRunner.java) and keeps it alive, so a
+ * run only pays for compiling and running the user's own classes instead of
+ * JVM and javac startup. Sources are compiled in memory and every run gets a
+ * fresh class loader, so static state never leaks from one run to the next.
+ *
+ * Each daemon runs one program at a time. Messages on stdin/stdout are lists
+ * of fields, each a 4-byte big-endian length followed by that many bytes.
+ *
+ *   ready:    "ready"
+ *   request:  class name, source, program stdin, CPU time limit of the
+ *             program's threads together in nanoseconds ("0": none)
+ *   response: status ("ok", "compile_error", "exit", "cpu_limit" or
+ *             "threads_left"), exit code, stdout, stderr, then compile and
+ *             run times in nanoseconds as wall, user CPU, system CPU, then
+ *             the bytes the program wrote to stdout and stderr as
+ *             "stdout stderr"
+ *
+ * The only argument is how many bytes of each stream to keep (the server's
+ * OUTPUT_MAX_BYTES), the rest is counted and dropped.
+ *
+ * A run's threads share a ThreadGroup, and the run ends once main and the
+ * other non-daemon threads are done, as the program would in a JVM of its
+ * own. Threads can't be stopped, so a program that goes over its CPU time
+ * gets what it has sent with status "cpu_limit", and one that leaves threads
+ * running (daemons, or any after System.exit()) with status "threads_left";
+ * either way the daemon then halts, to be replaced by a fresh one.
+ *
+ * System.exit() in user code is trapped with a SecurityManager where the JVM
+ * still allows one (Java 17-23, with -Djava.security.manager=allow). On newer
+ * JVMs it really exits: a shutdown hook sends the partial output with status
+ * "exit" and the server reads the exit code from the daemon process instead.
+ *
+ * There are no automated tests for this file. To check it by hand with a
+ * JDK 17+ on PATH, start the server, run a .java file that prints more than
+ * OUTPUT_MAX_BYTES (telemetry shows output_truncated), one that reads
+ * input.txt from the workspace, one that calls System.exit(3) (exit code 3),
+ * one whose main starts a thread that prints after main returns (its output
+ * is there), one that leaves a daemon thread sleeping (the next run gets a
+ * fresh JVM) and, with RUN_CPU_TIME_LIMIT set, one that loops forever on a
+ * second thread (exit code -24).
+ */
+public class JavaRunner {
+    private static final ThreadMXBean THREADS = ManagementFactory.getThreadMXBean();
+    private static final JavaCompiler COMPILER = ToolProvider.getSystemJavaCompiler();
+    private static final StandardJavaFileManager STANDARD_FILES = COMPILER.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+    private static final long CPU_WATCH_INTERVAL_MS = 20;
+
+    private static long outputLimit = Long.MAX_VALUE;
+
+    private static DataOutputStream protocolOut;
+    private static volatile Run currentRun;
+
+    /** Keeps the first outputLimit bytes written to it and counts the rest */
+    private static final class CappedOutput extends OutputStream {
+        private final ByteArrayOutputStream kept = new ByteArrayOutputStream();
+        private long total;
+
+        @Override
+        public synchronized void write(int b) {
+            if (total < outputLimit) {
+                kept.write(b);
+            }
+            total++;
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            if (total < outputLimit) {
+                kept.write(b, off, (int) Math.min(len, outputLimit - total));
+            }
+            total += len;
+        }
+
+        void writeBytes(byte[] b) {
+            write(b, 0, b.length);
+        }
+
+        synchronized byte[] toByteArray() {
+            return kept.toByteArray();
+        }
+
+        synchronized long total() {
+            return total;
+        }
+    }
+
+    /** Output buffers and timings of the run in progress */
+    private static final class Run {
+        final CappedOutput stdout = new CappedOutput();
+        final CappedOutput stderr = new CappedOutput();
+        final long[] compileTimes = new long[3];
+        final long[] runTimes = new long[3];
+        boolean compiled;
+        boolean threadsLeft;
+        volatile int exitCode = 0;
+    }
+
+    /** Thrown from System.exit() while the SecurityManager trap is installed */
+    private static final class ExitTrapped extends SecurityException {
+        final int status;
+
+        ExitTrapped(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    /** The threads of one run: main, and the ones it starts inherit the group */
+    private static final class RunThreads extends ThreadGroup {
+        private final Run run;
+        volatile Thread exiting;  // The one that called System.exit(), once one has
+
+        RunThreads(Run run) {
+            super("run");
+            setDaemon(true);  // Before Java 19 a group only goes away once destroyed, this does it when empty
+            this.run = run;
+        }
+
+        Thread[] live() {
+            Thread[] threads = new Thread[activeCount() + 1];
+            return Arrays.copyOf(threads, enumerate(threads));
+        }
+
+        void exit(int status) {
+            run.exitCode = status;
+            exiting = Thread.currentThread();
+        }
+
+        @Override
+        public void uncaughtException(Thread thread, Throwable e) {
+            if (e instanceof ExitTrapped) {
+                exit(((ExitTrapped) e).status);
+            } else {
+                super.uncaughtException(thread, e);
+            }
+        }
+    }
+
+    private static final class SourceFile extends SimpleJavaFileObject {
+        private final String source;
+
+        SourceFile(String className, String source) {
+            super(URI.create("string:///" + className + Kind.SOURCE.extension), Kind.SOURCE);
+            this.source = source;
+        }
+
+        @Override
+        public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+            return source;
+        }
+    }
+
+    private static final class ClassFile extends SimpleJavaFileObject {
+        final ByteArrayOutputStream bytes = new ByteArrayOutputStream();
+
+        ClassFile(String className) {
+            super(URI.create("bytes:///" + className.replace('.', '/') + Kind.CLASS.extension), Kind.CLASS);
+        }
+
+        @Override
+        public OutputStream openOutputStream() {
+            return bytes;
+        }
+    }
+
+    /** Keeps javac's class output in memory instead of writing .class files */
+    private static final class MemoryFileManager extends ForwardingJavaFileManager<StandardJavaFileManager> {
+        final Map<String, ClassFile> classes = new HashMap<>();
+
+        MemoryFileManager() {
+            super(STANDARD_FILES);
+        }
+
+        @Override
+        public JavaFileObject getJavaFileForOutput(JavaFileManager.Location location, String className,
+                                                   JavaFileObject.Kind kind, FileObject sibling) {
+            ClassFile file = new ClassFile(className);
+            classes.put(className, file);
+            return file;
+        }
+    }
+
+    /** Loads one run's classes; the parent only sees the JDK, not this runner */
+    private static final class RunClassLoader extends ClassLoader {
+        private final Map<String, ClassFile> classes;
+
+        RunClassLoader(Map<String, ClassFile> classes) {
+            super(ClassLoader.getPlatformClassLoader());
+            this.classes = classes;
+        }
+
+        @Override
+        protected Class<?> findClass(String name) throws ClassNotFoundException {
+            ClassFile file = classes.get(name);
+            if (file == null) {
+                throw new ClassNotFoundException(name);
+            }
+            byte[] bytes = file.bytes.toByteArray();
+            return defineClass(name, bytes, 0, bytes.length);
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        if (args.length > 0) {
+            outputLimit = Long.parseLong(args[0]);
+        }
+        // The real stdin/stdout carry the protocol, programs get in-memory streams
+        DataInputStream protocolIn = new DataInputStream(new FileInputStream(FileDescriptor.in));
+        protocolOut = new DataOutputStream(new FileOutputStream(FileDescriptor.out));
+        installExitTrap();
+        Runtime.getRuntime().addShutdownHook(new Thread(JavaRunner::reportExit));
+
+        // Warm up javac and the reflection path before taking real work
+        execute("Warmup", "public class Warmup { public static void main(String[] a) { System.out.print(a.length); } }", new byte[0], 0);
+        currentRun = null;
+        writeFields("ready".getBytes(StandardCharsets.UTF_8));
+
+        while (true) {
+            String className;
+            String source;
+            byte[] stdin;
+            long cpuTimeLimit;
+            try {
+                className = new String(readField(protocolIn), StandardCharsets.UTF_8);
+                source = new String(readField(protocolIn), StandardCharsets.UTF_8);
+                stdin = readField(protocolIn);
+                cpuTimeLimit = Long.parseLong(new String(readField(protocolIn), StandardCharsets.UTF_8));
+            } catch (EOFException e) {
+                return;  // Server closed our stdin
+            }
+            Run run = execute(className, source, stdin, cpuTimeLimit);
+            currentRun = null;
+            if (run.threadsLeft) {
+                // They would run on into the next program (and onto the protocol's stdout)
+                sendResult("threads_left", run);
+                Runtime.getRuntime().halt(0);
+            }
+            sendResult(run.compiled ? "ok" : "compile_error", run);
+        }
+    }
+
+    private static void installExitTrap() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    if (currentRun != null) {
+                        throw new ExitTrapped(status);
+                    }
+                }
+            });
+        } catch (UnsupportedOperationException | SecurityException e) {
+            // Not allowed on this JVM, System.exit() ends the daemon (see reportExit)
+        }
+    }
+
+    private static Run execute(String className, String source, byte[] stdin, long cpuTimeLimit) {
+        Run run = new Run();
+        currentRun = run;
+        long start = System.nanoTime();
+        long cpuStart = THREADS.getCurrentThreadCpuTime();
+        long userStart = THREADS.getCurrentThreadUserTime();
+
+        MemoryFileManager files = new MemoryFileManager();
+        StringWriter diagnostics = new StringWriter();
+        run.compiled = COMPILER.getTask(diagnostics, files, null, List.of("-proc:none"), null,
+                List.of(new SourceFile(className, source))).call();
+        setTimes(run.compileTimes, start, cpuStart, userStart);
+        if (!run.compiled) {
+            run.stderr.writeBytes(diagnostics.toString().getBytes(StandardCharsets.UTF_8));
+            run.exitCode = 1;
+            return run;
+        }
+
+        Method main;
+        try {
+            main = findMain(new RunClassLoader(files.classes), className, files.classes.keySet());
+        } catch (ReflectiveOperationException e) {
+            run.stderr.writeBytes(("No runnable main method: " + e.getMessage() + "\n").getBytes(StandardCharsets.UTF_8));
+            run.exitCode = 1;
+            return run;
+        }
+
+        InputStream realIn = System.in;
+        PrintStream realOut = System.out;
+        PrintStream realErr = System.err;
+        PrintStream programOut = new PrintStream(run.stdout, true, StandardCharsets.UTF_8);
+        PrintStream programErr = new PrintStream(run.stderr, true, StandardCharsets.UTF_8);
+        System.setIn(new ByteArrayInputStream(stdin));
+        System.setOut(programOut);
+        System.setErr(programErr);
+
+        // Run main on its own thread so its CPU time is measured on its own, in a group that collects the threads it starts
+        RunThreads threads = new RunThreads(run);
+        Thread thread = new Thread(threads, () -> {
+            long runStart = System.nanoTime();
+            long runCpuStart = THREADS.getCurrentThreadCpuTime();
+            long runUserStart = THREADS.getCurrentThreadUserTime();
+            try {
+                main.invoke(null, (Object) new String[0]);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitTrapped) {
+                    threads.exit(((ExitTrapped) cause).status);
+                } else {
+                    run.exitCode = 1;
+                    programErr.print("Exception in thread \"main\" ");
+                    cause.printStackTrace(programErr);
+                }
+            } catch (IllegalAccessException e) {
+                run.exitCode = 1;
+                programErr.println(e);
+            } finally {
+                setTimes(run.runTimes, runStart, runCpuStart, runUserStart);
+            }
+        }, "main");
+        thread.setContextClassLoader(main.getDeclaringClass().getClassLoader());
+        long started = System.nanoTime();
+        thread.start();
+        try {
+            watch(threads, thread, run, started, cpuTimeLimit);
+            run.threadsLeft = threads.activeCount() > 0;
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+        } finally {
+            programOut.flush();
+            programErr.flush();
+            if (!run.threadsLeft) {
+                System.setIn(realIn);
+                System.setOut(realOut);
+                System.setErr(realErr);
+            }
+        }
+        return run;
+    }
+
+    /**
+     * Wait for a run's main and other non-daemon threads, or a trapped System.exit(),
+     * ending the daemon if the threads together go over limit nanoseconds of CPU time
+     * (0: no limit). The run times get the CPU time of the threads besides main.
+     */
+    private static void watch(RunThreads threads, Thread main, Run run, long started, long limit)
+            throws InterruptedException {
+        Map<Long, long[]> cpuTimes = new HashMap<>();  // Store {thread id: last seen CPU and user time}, finished ones too
+        while (threads.exiting == null) {
+            Thread waiting = null;
+            for (Thread thread : threads.live()) {
+                long cpu = THREADS.getThreadCpuTime(thread.getId());
+                long user = THREADS.getThreadUserTime(thread.getId());
+                if (cpu >= 0 && user >= 0) {
+                    cpuTimes.put(thread.getId(), new long[] {cpu, user});
+                }
+                if (waiting == null && !thread.isDaemon()) {
+                    waiting = thread;
+                }
+            }
+            long totalCpu = 0;
+            long totalUser = 0;
+            for (long[] times : cpuTimes.values()) {
+                totalCpu += times[0];
+                totalUser += times[1];
+            }
+            if (waiting != null && limit > 0 && totalCpu > limit) {
+                // Threads can't be stopped: report what they wrote and take the JVM down with them
+                run.runTimes[0] = System.nanoTime() - started;
+                run.runTimes[1] = totalUser;
+                run.runTimes[2] = totalCpu - totalUser;
+                currentRun = null;  // Or the exit trap would turn halt() into an exception
+                sendResult("cpu_limit", run);
+                Runtime.getRuntime().halt(1);
+            }
+            if (waiting == null) {
+                break;
+            }
+            waiting.join(CPU_WATCH_INTERVAL_MS);
+        }
+        if (threads.exiting != null) {
+            threads.exiting.join();  // It's on its way out, the others are left running
+        }
+        if (main.isAlive()) {
+            run.runTimes[0] = System.nanoTime() - started;  // Another thread called System.exit() first
+        } else {
+            cpuTimes.remove(main.getId());  // Measured exactly by main itself
+        }
+        for (long[] times : cpuTimes.values()) {
+            run.runTimes[1] += times[1];
+            run.runTimes[2] += times[0] - times[1];
+        }
+    }
+
+    private static Method findMain(ClassLoader loader, String className, Iterable<String> classNames)
+            throws ReflectiveOperationException {
+        try {
+            return mainOf(loader.loadClass(className));
+        } catch (ReflectiveOperationException e) {
+            // File name and class name differ, use the first class that has a main
+            for (String name : classNames) {
+                try {
+                    return mainOf(loader.loadClass(name));
+                } catch (ReflectiveOperationException ignored) {
+                }
+            }
+            throw e;
+        }
+    }
+
+    private static Method mainOf(Class<?> cls) throws NoSuchMethodException {
+        Method main = cls.getMethod("main", String[].class);
+        if (!Modifier.isStatic(main.getModifiers())) {
+            throw new NoSuchMethodException(cls.getName() + ".main is not static");
+        }
+        main.setAccessible(true);
+        return main;
+    }
+
+    private static void setTimes(long[] times, long start, long cpuStart, long userStart) {
+        long cpu = THREADS.getCurrentThreadCpuTime() - cpuStart;
+        long user = THREADS.getCurrentThreadUserTime() - userStart;
+        times[0] = System.nanoTime() - start;
+        times[1] = user;
+        times[2] = cpu - user;
+    }
+
+    /** Shutdown hook: user code called System.exit() and the JVM is going down */
+    private static void reportExit() {
+        Run run = currentRun;
+        if (run != null) {
+            System.out.flush();
+            System.err.flush();
+            sendResult("exit", run);
+        }
+    }
+
+    private static synchronized void sendResult(String status, Run run) {
+        try {
+            writeFields(
+                    status.getBytes(StandardCharsets.UTF_8),
+                    Integer.toString(run.exitCode).getBytes(StandardCharsets.UTF_8),
+                    run.stdout.toByteArray(),
+                    run.stderr.toByteArray(),
+                    times(run.compileTimes),
+                    times(run.runTimes),
+                    (run.stdout.total() + " " + run.stderr.total()).getBytes(StandardCharsets.UTF_8));
+        } catch (IOException e) {
+            // Server went away, nothing left to report to
+        }
+    }
+
+    private static byte[] times(long[] times) {
+        return (times[0] + " " + times[1] + " " + times[2]).getBytes(StandardCharsets.UTF_8);
+    }
+
+    private static byte[] readField(DataInputStream in) throws IOException {
+        byte[] field = new byte[in.readInt()];
+        in.readFully(field);
+        return field;
+    }
+
+    private static void writeFields(byte[]... fields) throws IOException {
+        for (byte[] field : fields) {
+            protocolOut.writeInt(field.length);
+            protocolOut.write(field);
+        }
+        protocolOut.flush();
+    }
+}
@@ -0,0 +1,145 @@
+"""Content-addressed store for build outputs (binaries, code objects)
+
+Artifacts are files directly in the store's root, named by a hash of
+whatever they were built from plus a suffix ("<hash>.out", "<hash>.pyc"),
+so identical inputs share one artifact and two clients building the same
+file can never overwrite each other's output. Subdirectories (such as
+precompiled headers) are left alone.
+"""
+import os
+import tempfile
+from collections import OrderedDict
+
+TMPFS_ROOT = "/dev/shm"
+
+
+def tmpfs_dir(name, need_exec=True):
+    """A directory called name on /dev/shm, or None if there's no usable tmpfs
+
+    Binaries are run straight out of the store, so by default a tmpfs
+    mounted noexec doesn't count.
+    """
+    if not hasattr(os, "ST_NOEXEC") or not os.path.isdir(TMPFS_ROOT):
+        return None
+    if (need_exec and os.statvfs(TMPFS_ROOT).f_flag & os.ST_NOEXEC) or not os.access(TMPFS_ROOT, os.W_OK):
+        return None
+    return os.path.join(TMPFS_ROOT, f"{name}-{os.getuid()}")
+
+
+class ArtifactStore:
+    """Size-bounded store of build outputs with pinning and LRU eviction
+
+    Builders write to temp_path() and publish() the result, which is an
+    atomic rename, so nobody ever sees half an artifact. A run pins the
+    artifact it uses with acquire()/release(), before publishing it if it
+    builds it; eviction only removes unpinned artifacts, least recently
+    used first, once the store grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)  # Binaries run from here whatever the run's cwd
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # Store {name: size in bytes}, least recently used first
+        self.refs = {}  # Store {name: runs currently using it}
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def sweep(self):
+        """Startup cleanup: remove temp files a crash left behind, index the rest and evict down to size"""
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        removed = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+                removed += 1
+                continue
+            stat = entry.stat()
+            found.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+        self.entries.clear()
+        self.total_bytes = 0
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total_bytes += size
+        self.evict()
+        print(f"Artifact store {self.root}: {len(self.entries)} artifacts, "
+              f"{self.total_bytes // 1024} KB, {removed} stale temp files removed")
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def lookup(self, name):
+        """Path of a stored artifact, marking it as just used, or None if it isn't stored"""
+        if name not in self.entries and not self.adopt(name):
+            return None
+        try:
+            os.utime(self.path(name))  # So the next startup sweep knows it was used
+        except FileNotFoundError:
+            self.total_bytes -= self.entries.pop(name)  # Deleted behind our back
+            return None
+        self.entries.move_to_end(name)
+        return self.path(name)
+
+    def adopt(self, name):
+        """Index an artifact another process published into root, returning whether it exists"""
+        if name in self.entries:
+            return True
+        try:
+            size = os.path.getsize(self.path(name))
+        except OSError:
+            return False
+        self.entries[name] = size
+        self.total_bytes += size
+        self.evict()
+        return True
+
+    def temp_path(self):
+        """A new empty file in root to build into before publish()"""
+        fd, path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        return path
+
+    def publish(self, temp_path, name):
+        """Atomically move a finished temp file into the store under name"""
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, self.path(name))
+        self.total_bytes += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+        self.evict()
+        return self.path(name)
+
+    def acquire(self, name):
+        """Pin an artifact so eviction leaves it alone until release()"""
+        self.refs[name] = self.refs.get(name, 0) + 1
+
+    def release(self, name):
+        self.refs[name] -= 1
+        if not self.refs[name]:
+            del self.refs[name]
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used, unpinned artifacts until the store fits in max_bytes"""
+        for name in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if name in self.refs:
+                continue
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= self.entries.pop(name)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "artifacts": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "pinned": len(self.refs),
+            "evictions": self.evictions
+        }
@@ -0,0 +1,403 @@
+"""Execution workers: processes, on this host or others, that runs can be sent to
+
+Workers (see worker.py) connect to the broker over a Unix socket or TCP
+and both sides speak JSON, one message per line:
+
+    worker -> broker  {"type": "register", "name": ..., "slots": n, "extensions": [".py", ...], "token": ...}
+    broker -> worker  {"type": "registered", "worker": id, "heartbeat_interval": seconds}
+    worker -> broker  {"type": "heartbeat", "load": 1-minute load average per core}
+    broker -> worker  {"type": "run", "job": id, "filename": ..., "source": ..., "input": ...,
+                       "sources": {path relative to the source: base64 data},
+                       "files": {name: base64 data}, "options": run_file request}
+    broker -> worker  {"type": "cancel", "job": id}
+    worker -> broker  {"type": "result", "job": id, "response": run_file response without "action"}
+
+A worker that disconnects, or isn't heard from for BROKER_HEARTBEAT_TIMEOUT,
+is dropped and the runs it had fail with WorkerLost, for whoever sent
+them to resubmit. A message longer than BROKER_MESSAGE_MAX_BYTES is
+skipped, failing the run it was about, and the connection goes on;
+workers cut the output in their results to fit (see result_message).
+
+Runs of the same build go to the same node when they can, so they find
+it in that node's build cache: nodes are ranked per build by rendezvous
+hashing of the build's cache key with the node's name, and a run goes to
+the highest ranked node that isn't over its share of the load.
+
+The server (CodeServer.place_run) keeps pty runs, whose terminal is the
+client's connection, and runs that need more code around them than can
+be sent (see job_sources). A run whose worker dies is resubmitted, and
+runs on the server once it has been lost BROKER_RESUBMIT_LIMIT times.
+Workers send output back whole, up to OUTPUT_MAX_BYTES a stream (less if
+it doesn't fit in a message), and the server keeps what is too long for
+the response in a run log.
+"""
+import asyncio
+import contextlib
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+import time
+
+BROKER_HEARTBEAT_INTERVAL = 2.0  # Seconds between a worker's heartbeats
+BROKER_HEARTBEAT_TIMEOUT = 6.0  # A worker not heard from for this long is taken for dead
+BROKER_MESSAGE_MAX_BYTES = 128 * 1024 * 1024  # Longest line either side reads, results cut their output to fit
+BROKER_LOAD_FACTOR = 1.25  # A build's home node takes at most this times its fair share of running jobs, then it spills
+LOCAL_NODE = "server"  # Name this host ranks under in rendezvous hashing
+RESULT_STREAMS = ("result", "error")  # Fields of a run_file response holding a run's output
+MESSAGE_JOB_RE = re.compile(rb'^\{"type": "\w+", "job": (\d+)')
+
+
+class WorkerLost(Exception):
+    """The worker a run was sent to went away before answering"""
+
+
+class MessageTooLong(Exception):
+    """A message over BROKER_MESSAGE_MAX_BYTES was skipped; job is the run it was about, if that could be told"""
+
+    def __init__(self, job):
+        super().__init__(f"message over {BROKER_MESSAGE_MAX_BYTES} bytes skipped")
+        self.job = job
+
+
+def parse_address(address):
+    """("tcp", (host, port)) for "HOST:PORT", otherwise ("unix", path)"""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and "/" not in address:
+        return "tcp", (host, int(port))
+    return "unix", address
+
+
+async def open_connection(address):
+    """(reader, writer) connected to a broker address, see parse_address"""
+    kind, where = parse_address(address)
+    if kind == "tcp":
+        return await asyncio.open_connection(*where, limit=BROKER_MESSAGE_MAX_BYTES)
+    return await asyncio.open_unix_connection(where, limit=BROKER_MESSAGE_MAX_BYTES)
+
+
+async def read_message(reader):
+    """Next line from reader, b"" at EOF
+
+    A line longer than the reader's limit is read through and dropped,
+    then MessageTooLong is raised with the job id from its start.
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        head = await reader.readexactly(e.consumed)
+    while True:
+        try:
+            await reader.readuntil(b"\n")
+            break
+        except asyncio.IncompleteReadError:
+            break
+        except asyncio.LimitOverrunError as e:
+            await reader.readexactly(e.consumed)
+    match = MESSAGE_JOB_RE.match(head)
+    raise MessageTooLong(int(match.group(1)) if match else None)
+
+
+def result_message(job_id, response):
+    """The result message for a run_file response as a line that fits in BROKER_MESSAGE_MAX_BYTES
+
+    Output can take up to 12 bytes a character once JSON-escaped, so
+    a response with more than that cuts its output streams, naming
+    them in "output_cut".
+    """
+    message = {"type": "result", "job": job_id, "response": response}
+    line = json.dumps(message).encode() + b"\n"
+    while len(line) > BROKER_MESSAGE_MAX_BYTES:
+        streams = [field for field in RESULT_STREAMS if response.get(field)]
+        if not streams:
+            response = {"status": "error", "message": "Run response too long to send back"}
+            return json.dumps({"type": "result", "job": job_id, "response": response}).encode() + b"\n"
+        scale = BROKER_MESSAGE_MAX_BYTES / len(line) * 0.9
+        response = {**response, "output_cut": sorted(set(response.get("output_cut", ())) | set(streams))}
+        for field in streams:
+            response[field] = response[field][:int(len(response[field]) * scale)]
+        message["response"] = response
+        line = json.dumps(message).encode() + b"\n"
+    return line
+
+
+def rendezvous_score(key, name, slots):
+    """Weighted rendezvous hash of a node for key, the highest scoring node is key's home
+
+    Nodes are weighted by slots, so a node with twice the slots is home
+    to about twice the builds. Adding or removing a node only moves the
+    builds whose home it is or becomes.
+    """
+    digest = hashlib.sha256(f"{key}\0{name}".encode()).digest()
+    unit = (int.from_bytes(digest[:8], "big") + 0.5) / 2 ** 64
+    return slots / -math.log(unit)
+
+
+def load_per_core():
+    """1-minute load average divided by the number of cores, or None where there's no load average"""
+    if not hasattr(os, "getloadavg"):
+        return None
+    return round(os.getloadavg()[0] / (os.cpu_count() or 1), 3)
+
+
+class WorkerConnection:
+    """One node runs are placed on: a registered worker, or (id 0, no writer) this host"""
+
+    def __init__(self, worker_id, name, slots, extensions, writer):
+        self.id = worker_id
+        self.name = name
+        self.slots = slots
+        self.extensions = extensions  # None: runs everything
+        self.writer = writer
+        self.running = 0  # Runs placed on it that haven't finished
+        self.load = None  # Load per core it last reported
+        self.last_seen = time.monotonic()
+        self.jobs = {}  # Store {job id: future of its response}
+        self.completed = 0
+        self.builds = 0  # Runs that needed a build...
+        self.cache_hits = 0  # ...and found it in the node's cache
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "slots": self.slots,
+            "running": self.running,
+            "load": self.load,
+            "completed": self.completed,
+            "builds": self.builds,
+            "cache_hits": self.cache_hits,
+            "last_seen": round(time.monotonic() - self.last_seen, 3)
+        }
+
+
+class Broker:
+    """Accepts execution workers on address and places runs on them or here
+
+    This host counts as a node with local_slots slots that runs every
+    extension. placement() sends a build to its home node (see
+    rendezvous_score) unless that node is over BROKER_LOAD_FACTOR times
+    its fair share, then to the next in the build's ranking; runs with no
+    build key go to the node with the smallest share of its slots in use,
+    then the lowest reported load. on_change() is called whenever a
+    worker joins or leaves, so whoever bounds concurrency can follow
+    capacity(). With address None nothing listens and every run stays
+    here. Over TCP, workers must register with token.
+    """
+
+    def __init__(self, address, local_slots, token=None, on_change=None):
+        self.address = address
+        self.local = WorkerConnection(0, LOCAL_NODE, local_slots, None, None)
+        self.token = token
+        self.on_change = on_change
+        self.workers = {}  # Store {worker id: WorkerConnection}
+        self.worker_ids = itertools.count(1)
+        self.job_ids = itertools.count(1)
+        self.server = None
+        self.monitor_task = None
+        self.remote_runs = 0
+        self.local_runs = 0
+        self.home_runs = 0  # Runs placed on their build's home node...
+        self.spilled_runs = 0  # ...or further down its ranking, because home was too busy
+        self.workers_lost = 0
+        self.runs_lost = 0  # Runs that failed with WorkerLost
+
+    async def start(self):
+        if self.address is None:
+            return
+        kind, where = parse_address(self.address)
+        if kind == "tcp":
+            if not self.token:
+                raise ValueError("Execution workers over TCP need a token")
+            self.server = await asyncio.start_server(self.handle_worker, *where, limit=BROKER_MESSAGE_MAX_BYTES)
+        else:
+            self.server = await asyncio.start_unix_server(self.handle_worker, where, limit=BROKER_MESSAGE_MAX_BYTES)
+            os.chmod(where, 0o600)  # Only our own user's workers
+        self.monitor_task = asyncio.create_task(self.monitor())
+        print(f"Accepting execution workers on {self.address}")
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.monitor_task.cancel()
+        self.server.close()
+        for worker in list(self.workers.values()):
+            self.drop(worker, "server shutting down")
+
+    def capacity(self):
+        """Runs all nodes together can take at once"""
+        return self.local.slots + sum(worker.slots for worker in self.workers.values())
+
+    async def handle_worker(self, reader, writer):
+        """Register a worker and read its heartbeats and results until it goes away"""
+        worker = None
+        reason = "disconnected"
+        try:
+            hello = json.loads(await read_message(reader) or "null")
+            if not isinstance(hello, dict) or hello.get("type") != "register" or not isinstance(hello.get("slots"), int):
+                return
+            if self.token and hello.get("token") != self.token:
+                writer.write(json.dumps({"type": "rejected", "message": "Wrong token"}).encode() + b"\n")
+                return
+            worker = WorkerConnection(next(self.worker_ids), str(hello.get("name")), max(1, hello["slots"]),
+                                      set(hello.get("extensions") or ()), writer)
+            self.workers[worker.id] = worker
+            worker.send({"type": "registered", "worker": worker.id, "heartbeat_interval": BROKER_HEARTBEAT_INTERVAL})
+            print(f"Worker {worker.name} registered: {worker.slots} slots, {', '.join(sorted(worker.extensions))}")
+            if self.on_change:
+                self.on_change()
+
+            while True:
+                try:
+                    line = await read_message(reader)
+                except MessageTooLong as e:
+                    print(f"Worker {worker.name}: {e}")
+                    future = worker.jobs.get(e.job)
+                    if future is not None and not future.done():
+                        future.set_result({"status": "error", "message": "Run response too long to send back"})
+                    continue
+                if not line:
+                    break
+                message = json.loads(line)
+                worker.last_seen = time.monotonic()
+                if message.get("type") == "heartbeat":
+                    worker.load = message.get("load")
+                elif message.get("type") == "result":
+                    future = worker.jobs.get(message.get("job"))
+                    if future is not None and not future.done():
+                        future.set_result(message["response"])
+        except (ConnectionError, ValueError, KeyError) as e:
+            reason = f"protocol error: {e}" if not isinstance(e, ConnectionError) else "connection lost"
+        except asyncio.CancelledError:
+            reason = "server shutting down"  # Nothing awaits this task, so there's no one to tell
+        finally:
+            if worker is not None:
+                self.drop(worker, reason)
+            writer.close()
+
+    async def monitor(self):
+        """Drop workers that have stopped sending heartbeats"""
+        while True:
+            await asyncio.sleep(BROKER_HEARTBEAT_INTERVAL)
+            deadline = time.monotonic() - BROKER_HEARTBEAT_TIMEOUT
+            for worker in list(self.workers.values()):
+                if worker.last_seen < deadline:
+                    self.drop(worker, "missed heartbeats")
+
+    def drop(self, worker, reason):
+        """Forget a worker, failing the runs it had with WorkerLost"""
+        if self.workers.pop(worker.id, None) is None:
+            return
+        self.workers_lost += reason != "server shutting down"
+        print(f"Worker {worker.name} dropped ({reason}) with {len(worker.jobs)} runs")
+        for future in worker.jobs.values():
+            if not future.done():
+                future.set_exception(WorkerLost(f"worker {worker.name} {reason}"))
+        worker.writer.close()
+        if self.on_change:
+            self.on_change()
+
+    @contextlib.contextmanager
+    def placement(self, extension=None, key=None):
+        """Hold a slot on the node a run should go to: a WorkerConnection, or None for here
+
+        extension None keeps the run here (e.g. it needs this server's
+        terminal). key is the cache key of what the run builds. If no
+        node has a free slot the run goes here anyway.
+        """
+        self.local.load = load_per_core()
+        nodes = [self.local]
+        if extension is not None:
+            nodes += [worker for worker in self.workers.values() if extension in worker.extensions]
+        node = self.home_node(nodes, key) if key is not None and len(nodes) > 1 else None
+        if node is None:
+            free = [node for node in nodes if node.running < node.slots] or [self.local]
+            node = min(free, key=lambda node: (node.running / node.slots, node.load or 0.0, node.id))
+        node.running += 1
+        if node is self.local:
+            self.local_runs += 1
+        else:
+            self.remote_runs += 1
+        try:
+            yield None if node is self.local else node
+        finally:
+            node.running -= 1
+
+    def home_node(self, nodes, key):
+        """The highest ranked of nodes for key with room under its load cap, or None if none has
+
+        A node's cap is BROKER_LOAD_FACTOR times its share (by slots) of
+        the running jobs, this one included, and never more than its
+        slots: consistent hashing with bounded loads, so a hot build
+        spreads over its next-ranked nodes instead of queueing on one.
+        """
+        total_slots = sum(node.slots for node in nodes)
+        total_running = sum(node.running for node in nodes) + 1
+        ranked = sorted(nodes, key=lambda node: rendezvous_score(key, node.name, node.slots), reverse=True)
+        for rank, node in enumerate(ranked):
+            cap = min(node.slots, math.ceil(BROKER_LOAD_FACTOR * total_running * node.slots / total_slots))
+            if node.running < cap:
+                if rank == 0:
+                    self.home_runs += 1
+                else:
+                    self.spilled_runs += 1
+                return node
+        return None
+
+    def record_build(self, worker, response):
+        """Count whether a run found its build in the cache of the node it ran on (worker None: here)"""
+        telemetry = response.get("telemetry") or {}
+        if "compile_cached" not in telemetry:
+            return
+        node = worker or self.local
+        node.builds += 1
+        node.cache_hits += bool(telemetry["compile_cached"])
+
+    async def run(self, worker, job):
+        """Send a run to worker and wait for its response; raises WorkerLost if the worker goes away first"""
+        if worker.id not in self.workers:
+            raise WorkerLost(f"worker {worker.name} is gone")
+        job_id = next(self.job_ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.jobs[job_id] = future
+        try:
+            worker.send({"type": "run", "job": job_id, **job})
+            await worker.writer.drain()
+            response = await future
+            worker.completed += 1
+            return response
+        except WorkerLost:
+            self.runs_lost += 1
+            raise
+        except ConnectionError as e:
+            self.runs_lost += 1
+            raise WorkerLost(f"worker {worker.name} connection lost: {e}") from e
+        except asyncio.CancelledError:
+            if worker.id in self.workers and not future.done():
+                worker.send({"type": "cancel", "job": job_id})  # Client gone, don't leave it running there
+            raise
+        finally:
+            worker.jobs.pop(job_id, None)
+
+    def stats(self):
+        nodes = [self.local, *self.workers.values()]
+        builds = sum(node.builds for node in nodes)
+        return {
+            "address": self.address,
+            "capacity": self.capacity(),
+            "local": self.local.stats(),
+            "workers": [worker.stats() for worker in self.workers.values()],
+            "local_runs": self.local_runs,
+            "remote_runs": self.remote_runs,
+            "home_runs": self.home_runs,
+            "spilled_runs": self.spilled_runs,
+            "cache_hit_rate": round(sum(node.cache_hits for node in nodes) / builds, 3) if builds else None,
+            "workers_lost": self.workers_lost,
+            "runs_lost": self.runs_lost
+        }
@@ -6,14 +6,20 @@ import sys
 import curses
 from enum import Enum
 
+PAGE_LINES = 50  # Lines of a run's logged output shown at a time
+
 class Mode(Enum):
     NORMAL = 1
     INSERT = 2
 
 class TextEditor:
-    def __init__(self, content="", filename=""):
+    def __init__(self, content="", filename="", diagnostics=None):
         self.content = content.split('\n')
         self.filename = filename
+        self.diagnostics = {}  # Store {line index: [diagnostic]} from the server's check of the last save
+        for diagnostic in diagnostics or []:
+            if diagnostic.get("line"):
+                self.diagnostics.setdefault(diagnostic["line"] - 1, []).append(diagnostic)
         self.mode = Mode.NORMAL
         self.cursor_x = 0
         self.cursor_y = 0
@@ -31,6 +37,8 @@ class TextEditor:
         curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLUE)  # Status line
         curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_WHITE)  # Command line
         curses.init_pair(3, curses.COLOR_GREEN, -1)  # Message
+        curses.init_pair(4, curses.COLOR_RED, -1)  # Line with an error
+        curses.init_pair(5, curses.COLOR_YELLOW, -1)  # Line with a warning
         
         # Ensure content is not empty
         if not self.content:
@@ -50,11 +58,13 @@ class TextEditor:
                     line = self.content[line_num]
                     if len(line) > width - 1:
                         line = line[:width - 1]
-                    stdscr.addstr(i, 0, line)
+                    stdscr.addstr(i, 0, line, self._diagnostic_attr(line_num))
                     
             # Status line
             status = f" {self.filename} "
             status += f"{'[+]' if self.modified else ''}".ljust(10)
+            if self.diagnostics:
+                status += f"{sum(len(found) for found in self.diagnostics.values())} issues "
             mode_str = f" {self.mode.name} MODE "
             cursor_pos = f" Ln {self.cursor_y + 1}, Col {self.cursor_x + 1} "
             
@@ -68,7 +78,10 @@ class TextEditor:
             stdscr.addstr(height - 2, width - len(cursor_pos), cursor_pos)
             stdscr.attroff(curses.color_pair(1))
             
-            # Message line
+            # Message line, showing the diagnostic under the cursor if there's nothing else to say
+            if not self.message and not self.command_buffer and self.cursor_y in self.diagnostics:
+                diagnostic = self.diagnostics[self.cursor_y][0]
+                self.message = f"{diagnostic['severity']}: {diagnostic['message']}"
             if self.message:
                 stdscr.attron(curses.color_pair(3))
                 stdscr.addstr(height - 1, 0, self.message[:width-1])
@@ -96,6 +109,15 @@ class TextEditor:
             
         return self.content, self.modified
         
+    def _diagnostic_attr(self, line_num):
+        """Color for a line the server reported errors or warnings on"""
+        found = self.diagnostics.get(line_num)
+        if not found:
+            return curses.A_NORMAL
+        if any(diagnostic["severity"] == "error" for diagnostic in found):
+            return curses.color_pair(4)
+        return curses.color_pair(5)
+        
     def process_key(self, key, height, width):
         """Process a keypress"""
         display_height = height - 2  # Adjust for status and message lines
@@ -262,6 +284,7 @@ class CodeClient:
         self.server_uri = server_uri
         self.websocket = None
         self.running = True
+        self.diagnostics = {}  # Store {filename: diagnostics the server pushed for its last save}
         
     async def connect(self):
         """Connect to the WebSocket server"""
@@ -277,14 +300,33 @@ class CodeClient:
         if self.websocket:
             await self.websocket.close()
             
+    async def receive(self):
+        """Receive the next response, handling any events the server pushed first"""
+        while True:
+            message = json.loads(await self.websocket.recv())
+            if "event" not in message:
+                return message
+            self.handle_event(message)
+            
+    def handle_event(self, event):
+        """Handle a message the server sent on its own, not as a response"""
+        if event["event"] == "diagnostics":
+            self.diagnostics[event["filename"]] = event["diagnostics"]
+        elif event["event"] == "run_output":
+            print(event["data"], end="", flush=True)
+        elif event["event"] == "run_progress":
+            if event["phase"] == "queued":
+                print(f"Queued at position {event['position']}, starting in about {event['start_in']:.1f}s")
+            else:
+                print(f"{event['phase'].capitalize()}...")
+            
     async def list_files(self):
         """Get list of files from server with lock info"""
         await self.websocket.send(json.dumps({
             "action": "list_files"
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
         
     async def check_file_lock(self, filename):
         """Check if a file is locked"""
@@ -293,8 +335,7 @@ class CodeClient:
             "filename": filename
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
         
     async def release_file_lock(self, filename):
         """Release lock on a file"""
@@ -303,8 +344,7 @@ class CodeClient:
             "filename": filename
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
         
     async def get_file(self, filename, acquire_lock=False):
         """Get file content from server"""
@@ -314,8 +354,7 @@ class CodeClient:
             "acquire_lock": acquire_lock
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
         
     async def save_file(self, filename, content):
         """Save file content to server"""
@@ -325,8 +364,7 @@ class CodeClient:
             "content": content
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
         
     async def create_file(self, filename, file_type):
         """Create a new file on the server"""
@@ -336,20 +374,80 @@ class CodeClient:
             "type": file_type
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
+        
+    async def list_interpreters(self):
+        """Get the Python interpreters the server can run .py files with"""
+        await self.websocket.send(json.dumps({
+            "action": "list_interpreters"
+        }))
+        
+        return await self.receive()
+        
+    async def upload_input(self, content):
+        """Store an input dataset on the server, returning its input_id in the response"""
+        await self.websocket.send(json.dumps({
+            "action": "upload_input",
+            "data": content
+        }))
+        
+        return await self.receive()
         
-    async def run_file(self, filename, input_data=""):
-        """Run a file on the server"""
+    async def get_run_output(self, log_id, stream="stdout", **run_range):
+        """Get part of a run's logged output: offset=/length= bytes or line=/lines= lines"""
+        await self.websocket.send(json.dumps({
+            "action": "get_run_output",
+            "log_id": log_id,
+            "stream": stream,
+            **run_range
+        }))
+        
+        return await self.receive()
+        
+    async def run_file(self, filename, input_data="", **options):
+        """Run a file on the server
+
+        Extra keyword arguments (e.g. benchmark={"iterations": 10}, or
+        input_id=... to use an uploaded dataset as input) are sent as run
+        options.
+        """
         await self.websocket.send(json.dumps({
             "action": "run_file",
             "filename": filename,
-            "input": input_data
+            "input": input_data,
+            **options
         }))
         
-        response = await self.websocket.recv()
-        return json.loads(response)
+        return await self.receive()
         
+    async def run_interactive(self, filename, **options):
+        """Run a file on a terminal on the server, sending lines typed on stdin as its input
+
+        The program's output arrives as "run_output" events while it runs.
+        Returns the run_file response.
+        """
+        loop = asyncio.get_running_loop()
+        stdin = sys.stdin.fileno()
+        
+        def send_line():
+            line = sys.stdin.readline()
+            if not line:
+                loop.remove_reader(stdin)
+            message = {"action": "run_input", "data": line} if line else {"action": "run_input", "eof": True}
+            asyncio.ensure_future(self.websocket.send(json.dumps(message)))
+            
+        await self.websocket.send(json.dumps({
+            "action": "run_file",
+            "filename": filename,
+            "pty": True,
+            **options
+        }))
+        loop.add_reader(stdin, send_line)
+        try:
+            return await self.receive()
+        finally:
+            loop.remove_reader(stdin)
+            
     async def main_menu(self):
         """Display the main menu and handle user input"""
         while self.running:
@@ -452,13 +550,19 @@ class CodeClient:
         print("\nSelect file type:")
         print("  1. Python (.py)")
         print("  2. C (.c)")
+        print("  3. C++ (.cpp)")
+        print("  4. Java (.java)")
         
-        choice = input("Enter choice (1-2): ").strip()
+        choice = input("Enter choice (1-4): ").strip()
         
         if choice == '1':
             file_type = "py"
         elif choice == '2':
             file_type = "c"
+        elif choice == '3':
+            file_type = "cpp"
+        elif choice == '4':
+            file_type = "java"
         else:
             print("Invalid choice. Using Python as default.")
             file_type = "py"
@@ -487,7 +591,7 @@ class CodeClient:
         content = response["content"]
         
         # Run the editor
-        editor = TextEditor(content, filename)
+        editor = TextEditor(content, filename, self.diagnostics.get(filename))
         try:
             # Setup curses
             result = curses.wrapper(editor.run)
@@ -517,36 +621,163 @@ class CodeClient:
         os.system('cls' if os.name == 'nt' else 'clear')
         print(f"=== Running {filename} ===\n")
         
-        # Ask for input if needed
-        print("Enter input for the program line by line (end with 'EOF'):")
+        # Interactive runs get a terminal on the server and take input as the program asks for it
+        interactive = input("Run interactively, typing input as the program asks for it? (y/N): ").strip().lower() == "y"
         input_data = ""
+        options = {}
         lines = []
-        while True:
-            line = input()
-            if line.strip() == "EOF":  # Use EOF marker to end input
-                break
-            lines.append(line)
+        
+        # Otherwise ask for all the input up front
+        if not interactive:
+            print("Enter input for the program line by line (end with 'EOF', or '@path' to send a local file):")
+            while True:
+                line = input()
+                if line.strip() == "EOF":  # Use EOF marker to end input
+                    break
+                if not lines and line.startswith("@"):
+                    # Upload the file once; the server pipes it into the program from disk
+                    try:
+                        with open(os.path.expanduser(line[1:].strip())) as f:
+                            upload = await self.upload_input(f.read())
+                    except OSError as e:
+                        print(f"Error reading {line[1:].strip()}: {e}")
+                        continue
+                    if upload["status"] != "success":
+                        print(f"Error: {upload.get('message', 'Unknown error')}")
+                        continue
+                    options["input_id"] = upload["input_id"]
+                    break
+                lines.append(line)
         
         if lines:
             input_data = '\n'.join(lines)
             
+        # Let the user pick a Python interpreter if there's more than one
+        if filename.endswith(".py"):
+            interpreters = (await self.list_interpreters()).get("interpreters", [])
+            if len(interpreters) > 1:
+                names = ", ".join(interpreter["name"] for interpreter in interpreters)
+                interpreter = input(f"Interpreter ({names}; Enter for default): ").strip()
+                if interpreter:
+                    options["interpreter"] = interpreter
+                    
         # Run the file
-        print("\nExecuting file...")
-        response = await self.run_file(filename, input_data)
+        if interactive:
+            print("\nExecuting file (type input as the program asks for it)...\n")
+            response = await self.run_interactive(filename, **options)
+        else:
+            print("\nExecuting file...")
+            response = await self.run_file(filename, input_data, **options)
         
         if response["status"] == "success":
-            print("\n=== Output ===")
-            print(response.get("result", ""))
+            if not interactive:  # Interactive output was printed as it came
+                print("\n=== Output ===")
+                print(response.get("result", ""))
             
             if response.get("error"):
                 print("\n=== Errors ===")
                 print(response.get("error"))
                 
             print(f"\nExited with code: {response.get('exit_code', 0)}")
+            self.print_telemetry(response.get("telemetry"))
+            self.print_benchmark(response.get("benchmark"))
+            self.print_profile(response.get("profile"))
+            self.print_memprofile(response.get("memprofile"))
+            await self.page_run_output(response.get("output_log"))
         else:
             print(f"Error: {response.get('message', 'Unknown error')}")
             
         input("\nPress Enter to continue...")
+        
+    def print_telemetry(self, telemetry):
+        """Print the compile/execute resource usage reported by the server"""
+        if not telemetry:
+            return
+        if telemetry.get("interpreter"):
+            print(f"Interpreter: {telemetry['interpreter']}")
+        for phase in ("compile", "execute"):
+            usage = telemetry.get(phase)
+            if not usage:
+                continue
+            line = f"{phase.capitalize()}: {usage['wall_time']:.3f}s wall"
+            if usage.get("user_time") is not None:
+                line += f", {usage['user_time']:.3f}s user, {usage['sys_time']:.3f}s sys"
+            if usage.get("max_rss_kb") is not None:
+                line += f", {usage['max_rss_kb']} KB max RSS"
+            if usage.get("memory_peak_kb") is not None:
+                line += f", {usage['memory_peak_kb']} KB peak memory"
+            print(line)
+        execute_usage = telemetry.get("execute") or {}
+        if execute_usage.get("oom_killed"):
+            print("Killed: the run went over its memory limit")
+        if execute_usage.get("output_truncated"):
+            print(f"Output truncated: the program wrote {execute_usage['output_bytes']} bytes")
+            
+    async def page_run_output(self, output_log):
+        """Offer to page through the full output of a run whose response only had the start of it"""
+        if not output_log:
+            return
+        for stream, logged in output_log["streams"].items():
+            note = "" if logged["complete"] else ", cut short"
+            answer = input(f"\nFull {stream} ({logged['bytes']} bytes{note}) is on the server for "
+                           f"{output_log['expires_in'] // 60} minutes. Page through it? (y/N): ")
+            if answer.strip().lower() != "y":
+                continue
+            line = 0
+            while True:
+                page = await self.get_run_output(output_log["id"], stream, line=line, lines=PAGE_LINES)
+                if page["status"] != "success":
+                    print(f"Error: {page.get('message', 'Unknown error')}")
+                    break
+                print(page["data"], end="")
+                if page["next_line"] == line:
+                    print("\n(This line is longer than the server sends at once, stopping here)")
+                    break
+                line = page["next_line"]
+                if line >= page["total_lines"]:
+                    break
+                if input(f"\n-- line {line} of {page['total_lines']}, Enter for more, q to stop -- ").strip() == "q":
+                    break
+                    
+    def print_benchmark(self, benchmark):
+        """Print the timing statistics of a benchmark run"""
+        if not benchmark:
+            return
+        pinned = ""
+        if benchmark.get("cpu") is not None:
+            pinned = f", {'exclusive ' if benchmark.get('exclusive_cpu') else ''}core {benchmark['cpu']}"
+        print(f"\n=== Benchmark ({benchmark['iterations']} iterations, {benchmark['warmup']} warmup{pinned}) ===")
+        for label in ("wall_time", "cpu_time"):
+            stats = benchmark.get(label)
+            if stats:
+                print(f"{label}: " + ", ".join(f"{k} {v:.6f}s" for k, v in stats.items()))
+                
+    def print_profile(self, profile):
+        """Print the function profile attached to a profiled run"""
+        if not profile:
+            return
+        print(f"\n=== Profile ({profile['tool']}) ===")
+        if profile.get("error"):
+            print(profile["error"])
+        elif profile["tool"] == "gprof":
+            print(profile["flat_profile"])
+        else:
+            print(f"{'cumtime':>10} {'tottime':>10} {'calls':>8}  function")
+            for row in profile["functions"]:
+                print(f"{row['cumulative_time']:>10.6f} {row['total_time']:>10.6f} {row['calls']:>8}  "
+                      f"{row['file']}:{row['line']}({row['function']})")
+                      
+    def print_memprofile(self, memprofile):
+        """Print the tracemalloc report attached to a memprofile run"""
+        if not memprofile:
+            return
+        print("\n=== Memory profile ===")
+        if memprofile.get("error"):
+            print(memprofile["error"])
+            return
+        print(f"Peak traced memory: {memprofile['peak_kb']} KB (at exit: {memprofile['final_kb']} KB)")
+        for site in memprofile["top_sites"]:
+            print(f"{site['size_kb']:>10.1f} KB {site['count']:>8} blocks  {site['file']}:{site['line']}  {site['code']}")
 
 async def main():
     server_uri = "ws://localhost:8765"
@@ -0,0 +1,319 @@
+"""Holding runs to memory and CPU limits, and measuring what they used
+
+With the cgroup backend every run gets a transient cgroup v2 group of
+its own, created under NAME in the process's own group when the run
+starts and removed when it is over. memory.max and cpu.max then hold
+the run as a whole (every process it starts, and the page cache it
+fills) to the limits, cpu.stat and memory.peak say what it used, and
+whatever it left running is killed with it. That needs the cpu and
+memory controllers delegated to the process's group, which the process
+moves out of into NAME/main so they can be enabled below it.
+
+Without cgroups the rlimit backend sets the limits on each process
+instead: RLIMIT_AS for memory, nothing for cpu.max's share of the
+cores. The CPU time limit is always RLIMIT_CPU, cgroups have no such
+limit.
+"""
+import os
+import secrets
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: no rlimits
+
+CGROUP_CONTROLLERS = ("cpu", "memory")
+CGROUP_CPU_PERIOD = 100000  # cpu.max period in microseconds, the quota is a share of it
+
+
+def cgroup_dir():
+    """Directory of this process's group in the cgroup v2 hierarchy, or None if there is none"""
+    mount = None
+    with open("/proc/self/mounts") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 2 and fields[2] == "cgroup2":
+                mount = fields[1]
+                break
+    if mount is None:
+        return None
+    with open("/proc/self/cgroup") as f:
+        for line in f:
+            hierarchy, _, path = line.rstrip("\n").split(":", 2)
+            if hierarchy == "0":
+                return os.path.normpath(os.path.join(mount, path.lstrip("/")))
+    return None
+
+
+def write_file(path, data):
+    """Write data to a cgroup file, with nothing but syscalls so preexec_fns can use it"""
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+def read_keyed(path):
+    """{key: int} of a flat keyed cgroup file like cpu.stat"""
+    return {key: int(value) for key, value in (line.split() for line in read_file(path).splitlines())}
+
+
+def enable_controllers(path):
+    """Turn CGROUP_CONTROLLERS on for path's children"""
+    enabled = read_file(os.path.join(path, "cgroup.subtree_control")).split()
+    missing = [controller for controller in CGROUP_CONTROLLERS if controller not in enabled]
+    if missing:
+        write_file(os.path.join(path, "cgroup.subtree_control"), " ".join(f"+{name}" for name in missing).encode())
+
+
+class Rlimits:
+    """The limits of one run, as rlimits on each of its processes
+
+    preexec() is for the run's processes started fresh, add() for ones
+    that were already running; usage() adds to a process's telemetry
+    what rusage can't tell; close() once the run is over.
+    """
+
+    def __init__(self, rlimits):
+        self.rlimits = rlimits  # [(resource.RLIMIT_*, (soft, hard))]
+
+    def preexec(self):
+        return self.join if self.rlimits else None
+
+    def join(self):
+        """Put the calling process, a child about to exec, under the limits"""
+        for limit, values in self.rlimits:
+            resource.setrlimit(limit, values)
+
+    def add(self, pid):
+        for limit, values in self.rlimits:
+            resource.prlimit(pid, limit, values)
+
+    def usage(self):
+        return {}
+
+    def close(self):
+        """Call once the run's process has exited: returns whether it left others running (which are killed)"""
+        return False
+
+
+class Cgroup(Rlimits):
+    """The limits of one run, as a cgroup v2 group its processes are put in"""
+
+    def __init__(self, path, rlimits, memory_max=None, cpu_max=None):
+        super().__init__(rlimits)
+        self.path = path
+        self.left_behind = None  # Set by close()
+        os.mkdir(path)
+        try:
+            if memory_max is not None:
+                write_file(os.path.join(path, "memory.max"), str(memory_max).encode())
+                write_file(os.path.join(path, "memory.oom.group"), b"1")  # An OOM kill takes the whole run
+                if os.path.exists(os.path.join(path, "memory.swap.max")):
+                    write_file(os.path.join(path, "memory.swap.max"), b"0")  # Or it only slows down
+            if cpu_max is not None:
+                quota = max(1000, int(cpu_max * CGROUP_CPU_PERIOD))
+                write_file(os.path.join(path, "cpu.max"), f"{quota} {CGROUP_CPU_PERIOD}".encode())
+        except BaseException:
+            os.rmdir(path)
+            raise
+
+    def preexec(self):
+        return self.join
+
+    def join(self):
+        super().join()
+        write_file(os.path.join(self.path, "cgroup.procs"), b"0")
+
+    def add(self, pid):
+        """Move a running process in; memory it had already touched stays charged where it was"""
+        super().add(pid)
+        write_file(os.path.join(self.path, "cgroup.procs"), str(pid).encode())
+
+    def usage(self):
+        """CPU time of every process the run started, and its peak memory including page cache
+
+        memory_peak_kb is None on kernels without memory.peak (before 5.19).
+        """
+        cpu = read_keyed(os.path.join(self.path, "cpu.stat"))
+        usage = {"user_time": round(cpu["user_usec"] / 1e6, 6), "sys_time": round(cpu["system_usec"] / 1e6, 6)}
+        try:
+            usage["memory_peak_kb"] = int(read_file(os.path.join(self.path, "memory.peak"))) // 1024
+            usage["oom_killed"] = read_keyed(os.path.join(self.path, "memory.events")).get("oom_kill", 0) > 0
+        except FileNotFoundError:
+            usage["memory_peak_kb"] = None  # No memory controller here (or too old a kernel)
+            usage["oom_killed"] = None
+        return usage
+
+    def close(self):
+        if self.left_behind is None:
+            self.left_behind = read_keyed(os.path.join(self.path, "cgroup.events")).get("populated", 0) > 0
+            if self.left_behind:
+                kill_cgroup(self.path)
+        return self.left_behind
+
+
+def kill_cgroup(path):
+    """SIGKILL everything in a group (and below it)"""
+    try:
+        write_file(os.path.join(path, "cgroup.kill"), b"1")
+    except FileNotFoundError:
+        # Before Linux 5.14: one by one, racing anything that forks
+        for pid in read_file(os.path.join(path, "cgroup.procs")).split():
+            try:
+                os.kill(int(pid), 9)
+            except ProcessLookupError:
+                pass
+
+
+class RunLimits:
+    """Which backend holds runs to their limits, and the limits
+
+    configure() picks the backend: "cgroup", "rlimit", "auto" (cgroup
+    if this host can, else rlimit) or None for neither. start() hands
+    out a run's Cgroup or Rlimits (None if there's nothing to do) and
+    finish() takes it back. Groups that were still being emptied when
+    their run finished are removed on a later start().
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.root = None  # Group the runs' groups are created in, with the cgroup backend
+        self.memory_limit = None
+        self.cpu_limit = None
+        self.cpu_time_limit = None
+        self.draining = []  # Groups of finished runs not removed yet, leftovers killed in them still exiting
+        self.runs = 0
+        self.left_behind = 0  # Runs that left processes running, killed when they finished
+        self.oom_kills = 0
+
+    def configure(self, backend, name, memory_limit=None, cpu_limit=None, cpu_time_limit=None):
+        """Set the backend up, falling back to rlimits if cgroups can't be used"""
+        self.__init__()
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.cpu_time_limit = cpu_time_limit
+        if backend in ("cgroup", "auto"):
+            try:
+                self.root = self.setup_cgroup(name)
+                self.backend = "cgroup"
+                print(f"Runs get cgroups under {self.root}")
+                return
+            except OSError as e:
+                print(f"Can't use cgroups for runs ({e}), using rlimits")
+            backend = "rlimit"
+        if backend == "rlimit" and resource is not None:
+            self.backend = "rlimit"
+
+    def setup_cgroup(self, name):
+        """Create NAME in this process's group, move the process into NAME/main, and remove stale run groups
+
+        If that fails the process is moved back and what was created is
+        removed, so falling back to rlimits leaves nothing changed.
+        """
+        base = cgroup_dir()
+        if base is None:
+            raise OSError("no cgroup v2 hierarchy mounted")
+        available = read_file(os.path.join(base, "cgroup.controllers")).split()
+        missing = [controller for controller in CGROUP_CONTROLLERS if controller not in available]
+        if missing:
+            raise OSError(f"{', '.join(missing)} controller not delegated to {base}")
+        # A group with processes in it can't have controllers enabled for its children (EBUSY), so
+        # this process moves out of base, and base must have no others unless they're enabled already
+        enabled = read_file(os.path.join(base, "cgroup.subtree_control")).split()
+        others = [pid for pid in read_file(os.path.join(base, "cgroup.procs")).split() if int(pid) != os.getpid()]
+        if others and not all(controller in enabled for controller in CGROUP_CONTROLLERS):
+            raise OSError(f"{base} has other processes in it, controllers can't be enabled below it")
+        root = os.path.join(base, name)
+        created = [path for path in (root, os.path.join(root, "main")) if not os.path.isdir(path)]
+        os.makedirs(os.path.join(root, "main"), exist_ok=True)
+        try:
+            write_file(os.path.join(root, "main", "cgroup.procs"), str(os.getpid()).encode())
+            enable_controllers(base)
+            enable_controllers(root)
+        except OSError:
+            try:
+                write_file(os.path.join(base, "cgroup.procs"), str(os.getpid()).encode())
+                for path in reversed(created):
+                    os.rmdir(path)
+            except OSError as e:
+                print(f"Can't undo moving into {root}: {e}")
+            raise
+        for entry in os.scandir(root):
+            if entry.is_dir() and entry.name != "main":
+                kill_cgroup(entry.path)  # Runs of a server that didn't live to finish them
+                self.draining.append(entry.path)
+        return root
+
+    def rlimits(self, memory=True, cpu_time=True):
+        limits = []
+        if self.cpu_time_limit is not None and cpu_time:
+            limits.append((resource.RLIMIT_CPU, (self.cpu_time_limit, self.cpu_time_limit + 1)))  # SIGXCPU, then SIGKILL
+        if self.memory_limit is not None and memory:
+            limits.append((resource.RLIMIT_AS, (self.memory_limit, self.memory_limit)))
+        return limits
+
+    def start(self, memory=True, cpu_time=True):
+        """Limits for a run about to start, None if the run goes as it is
+
+        A process that takes many runs one after another (a warm JVM)
+        holds each to the memory and CPU time limits itself: it starts
+        with memory=False and cpu_time=False and only gets the CPU share.
+        """
+        if self.backend is None:
+            return None
+        if self.backend == "cgroup":
+            self.remove_drained()
+            try:
+                return Cgroup(os.path.join(self.root, secrets.token_hex(8)), self.rlimits(False, cpu_time),
+                              self.memory_limit if memory else None, self.cpu_limit)
+            except OSError as e:
+                print(f"Can't create a cgroup for a run ({e}), it only gets rlimits")
+        rlimits = self.rlimits(memory, cpu_time)
+        return Rlimits(rlimits) if rlimits else None
+
+    def finish(self, run_limits, usage=None):
+        """Close a run's limits once its process has exited, counting what happened"""
+        self.runs += 1
+        if usage is not None and usage.get("oom_killed"):
+            self.oom_kills += 1
+        try:
+            if run_limits.close():
+                self.left_behind += 1
+        except OSError as e:
+            print(f"Can't clean up the cgroup of a run: {e}")
+        if isinstance(run_limits, Cgroup):
+            self.draining.append(run_limits.path)
+            self.remove_drained()
+
+    def remove_drained(self):
+        draining = []
+        for path in self.draining:
+            try:
+                os.rmdir(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                draining.append(path)  # Killed processes still on their way out
+        self.draining = draining
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "root": self.root,
+            "memory_limit": self.memory_limit,
+            "cpu_limit": self.cpu_limit,
+            "cpu_time_limit": self.cpu_time_limit,
+            "runs": self.runs,
+            "left_behind": self.left_behind,
+            "oom_kills": self.oom_kills
+        }
+
+
+LIMITS = RunLimits()  # Runs go unlimited until configure()d
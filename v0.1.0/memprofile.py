@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Run a Python script under tracemalloc and write a memory report as JSON
+
+Usage: memprofile.py REPORT_PATH INTERVAL TOP FRAMES SCRIPT [ARGS...]
+
+The server starts user programs through this when run_file is called with
+memprofile. A sampler thread records (current, peak) traced memory every
+INTERVAL seconds, which is cheap. A full snapshot is only taken when traced
+memory has reached a new high since the last one, so the allocation sites
+reported are the ones live near the peak rather than at exit. The script
+runs in a __main__ module that is kept until the last snapshot, so a run
+shorter than INTERVAL still has its globals in it.
+"""
+import builtins
+import json
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+MAX_SAMPLES = 1000  # Keep the report bounded for long-running programs
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.peak_snapshot = None
+        self.snapshot_high = 0
+        self.start_time = time.perf_counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record traced memory, snapshotting if it has reached a new high"""
+        current, peak = tracemalloc.get_traced_memory()
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append({
+                "time": round(time.perf_counter() - self.start_time, 6),
+                "current_kb": current // 1024,
+                "peak_kb": peak // 1024
+            })
+        if current > self.snapshot_high:
+            self.snapshot_high = current
+            self.peak_snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def top_sites(snapshot, top, frames, script):
+    """Largest allocation sites of a snapshot with a frame in the program's own files
+
+    That leaves out this wrapper's allocations and the libraries' (the
+    modules they set up when imported), unless the program's code is
+    among the frames traced above them.
+    """
+    program_dir = os.path.dirname(script)
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(True, os.path.join(os.path.abspath(program_dir), "*"), all_frames=True),
+        tracemalloc.Filter(True, os.path.join(program_dir, "*") if program_dir else script, all_frames=True),
+    ])
+    key_type = "traceback" if frames > 1 else "lineno"
+    sites = []
+    for stat in snapshot.statistics(key_type)[:top]:
+        frame = stat.traceback[-1] if frames > 1 else stat.traceback[0]
+        sites.append({
+            "file": frame.filename,
+            "line": frame.lineno,
+            "code": linecache.getline(frame.filename, frame.lineno).strip(),
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+            "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback] if frames > 1 else None
+        })
+    return sites
+
+
+def main():
+    report_path, interval, top, frames, script = sys.argv[1:6]
+    interval, top, frames = float(interval), int(top), int(frames)
+    sys.argv = sys.argv[5:]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))  # As if the script was run directly
+
+    main_module = types.ModuleType("__main__")
+    main_module.__dict__.update(__file__=script, __builtins__=builtins, __cached__=None)
+    sys.modules["__main__"] = main_module
+    with open(script, "rb") as f:
+        code = compile(f.read(), script, "exec")
+
+    sampler = Sampler(interval)
+    sampler.start()  # Before tracing, so the thread's own setup isn't in the report
+    tracemalloc.start(frames)
+    try:
+        exec(code, main_module.__dict__)
+    finally:
+        sampler.stop()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = sampler.peak_snapshot or tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        report = {
+            "peak_kb": peak // 1024,
+            "final_kb": current // 1024,
+            "interval": interval,
+            "samples": sampler.samples,
+            "top_sites": top_sites(snapshot, top, frames, script)
+        }
+        with open(report_path, "w") as f:
+            json.dump(report, f)
+
+
+if __name__ == "__main__":
+    main()
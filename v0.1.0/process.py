@@ -0,0 +1,715 @@
+"""Spawning user programs and measuring what they cost"""
+import array
+import asyncio
+import contextlib
+import errno
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import weakref
+
+from limits import LIMITS
+
+try:
+    import pty
+    import termios
+except ImportError:
+    pty = None  # Windows: no pseudo-terminals
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: no rusage either
+
+OUTPUT_MAX_BYTES = 16 * 1024 * 1024  # Output kept per stream of a run, the rest is read and dropped
+PTY_READ_SIZE = 65536
+PTY_EOF = b"\x04"  # Ctrl-D: end of input for a program reading the terminal in canonical mode
+
+
+def usage_stats(wall_time, rusage=None):
+    """Build the telemetry dict for one process from its wall time and rusage
+
+    max_rss_kb is None when it can't be told from the RSS the child
+    inherited from this process.
+    """
+    if rusage is None:
+        # No rusage on this platform, wall time is all we can report
+        return {"wall_time": round(wall_time, 6), "user_time": None, "sys_time": None, "max_rss_kb": None}
+    # ru_maxrss is a high-water mark that survives exec: a child's starts at
+    # our RSS when it forked, so it is only the child's own once it is past
+    # our peak. Below that it's None, cgroups' memory_peak_kb has it then
+    max_rss = rusage.ru_maxrss
+    if max_rss <= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+        max_rss = None
+    elif sys.platform == "darwin":
+        max_rss //= 1024  # macOS reports bytes, Linux reports kilobytes
+    return {
+        "wall_time": round(wall_time, 6),
+        "user_time": round(rusage.ru_utime, 6),
+        "sys_time": round(rusage.ru_stime, 6),
+        "max_rss_kb": max_rss
+    }
+
+
+def cpu_time(*usages):
+    """User plus system seconds of usages, skipping None ones; None if none or not all of them measured it"""
+    measured = [usage for usage in usages if usage is not None]
+    if not measured or any(usage["user_time"] is None for usage in measured):
+        return None
+    return round(sum(usage["user_time"] + usage["sys_time"] for usage in measured), 6)
+
+
+def add_usage(total, usage):
+    """Accumulate one process's usage into a running total (None starts a new total)"""
+    if total is None:
+        return dict(usage)
+    total = dict(total)
+    for key in ("wall_time", "user_time", "sys_time"):
+        if total[key] is not None and usage[key] is not None:
+            total[key] = round(total[key] + usage[key], 6)
+    if usage["max_rss_kb"] is not None:
+        total["max_rss_kb"] = max(total["max_rss_kb"] or 0, usage["max_rss_kb"])
+    if usage.get("memory_peak_kb") is not None:
+        total["memory_peak_kb"] = max(total.get("memory_peak_kb") or 0, usage["memory_peak_kb"])
+    if usage.get("oom_killed"):
+        total["oom_killed"] = True
+    return total
+
+
+def summarize_samples(samples):
+    """min/median/mean/p95/stddev of a list of timings, in seconds"""
+    ordered = sorted(samples)
+    p95_index = max(0, math.ceil(0.95 * len(ordered)) - 1)  # Nearest-rank percentile
+    return {
+        "min": round(ordered[0], 6),
+        "median": round(statistics.median(ordered), 6),
+        "mean": round(statistics.fmean(ordered), 6),
+        "p95": round(ordered[p95_index], 6),
+        "stddev": round(statistics.stdev(ordered), 6) if len(ordered) > 1 else 0.0
+    }
+
+
+def pick_benchmark_cpu():
+    """Pick the core pinned benchmark runs use, or None if pinning is unsupported"""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    return max(CORES.run_cores() or os.sched_getaffinity(0))
+
+
+class CorePartition:
+    """How the cores the server may use are split between itself and the programs it runs
+
+    configure() sets the first loop_cores cores aside for the server:
+    pin_loop() puts the event loop's thread there, along with the
+    executor threads it starts later. Every child is started on the rest,
+    the run cores, unless it is pinned to a core of its own. Up to
+    exclusive_cores run cores can be taken by one benchmark each with
+    exclusive(): no other child is started there until it is given back,
+    and the children on the run cores at the time are moved off it.
+    Without sched_setaffinity, or with too few cores to split, nothing
+    is pinned.
+    """
+
+    def __init__(self):
+        self.loop_cores = frozenset()
+        self.cores = None  # Run cores, None if not partitioned
+        self.taken = set()  # Run cores an exclusive() holds
+        self.exclusive_cores = 0
+        self.exclusive_slots = None  # asyncio.Semaphore of exclusive_cores
+        self.children = weakref.WeakSet()  # Popens started on the run cores, moved when taken changes
+        self.exclusive_runs = 0
+
+    def configure(self, loop_cores, exclusive_cores):
+        self.__init__()
+        if not hasattr(os, "sched_setaffinity"):
+            return
+        available = sorted(os.sched_getaffinity(0))
+        loop_cores = max(0, loop_cores) if len(available) > loop_cores else 0
+        run_cores = available[loop_cores:]
+        self.exclusive_cores = max(0, min(exclusive_cores, len(run_cores) - 1))  # Leave one to share
+        if not loop_cores and not self.exclusive_cores:
+            return
+        self.loop_cores = frozenset(available[:loop_cores])
+        self.cores = frozenset(run_cores)
+        self.exclusive_slots = asyncio.Semaphore(self.exclusive_cores) if self.exclusive_cores else None
+
+    def pin_loop(self):
+        """Pin the calling thread, which should be the event loop's, to the loop cores"""
+        if self.loop_cores:
+            os.sched_setaffinity(0, self.loop_cores)  # Linux: just this thread, and the threads it starts
+            print(f"Event loop on cores {sorted(self.loop_cores)}, runs on {sorted(self.cores)}")
+
+    def run_cores(self):
+        """Cores a child not pinned to one of its own is started on, None for any"""
+        return None if self.cores is None else self.cores - self.taken
+
+    def run_core_count(self):
+        return len(self.cores) if self.cores is not None else os.cpu_count() or 1
+
+    def preexec(self, cpu=None):
+        """preexec_fn putting a child on cpu if given, else on the run cores (None if there's nothing to do)"""
+        cores = {cpu} if cpu is not None else self.run_cores()
+        if cores is None:
+            return None
+        return lambda: os.sched_setaffinity(0, cores)
+
+    def started(self, process, cpu=None):
+        """Remember a child started on the run cores, to move it if one is taken"""
+        if cpu is None and self.cores is not None:
+            self.children.add(process)
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        """A run core no other child is on while this is held, or None if none can be set aside
+
+        Waits for one if exclusive_cores are all taken.
+        """
+        if self.exclusive_slots is None:
+            yield None
+            return
+        async with self.exclusive_slots:
+            core = max(self.cores - self.taken)
+            self.taken.add(core)
+            self.exclusive_runs += 1
+            self.move_children()
+            try:
+                yield core
+            finally:
+                self.taken.discard(core)
+                self.move_children()
+
+    def move_children(self):
+        """Put the children started on the run cores back on exactly the run cores that aren't taken"""
+        cores = self.run_cores()
+        for process in list(self.children):
+            if process.returncode is not None:
+                continue  # Reaped, the pid may be someone else's by now
+            try:
+                threads = [int(tid) for tid in os.listdir(f"/proc/{process.pid}/task")]
+            except OSError:
+                threads = [process.pid]
+            for tid in threads:
+                try:
+                    os.sched_setaffinity(tid, cores)
+                except OSError:
+                    pass  # Exited meanwhile
+
+    def stats(self):
+        return {
+            "loop_cores": sorted(self.loop_cores),
+            "run_cores": sorted(self.cores) if self.cores is not None else None,
+            "exclusive_cores": self.exclusive_cores,
+            "exclusive_taken": sorted(self.taken),
+            "exclusive_runs": self.exclusive_runs
+        }
+
+
+CORES = CorePartition()  # Unpartitioned until the server configure()s it
+
+
+async def _read_pipe(pipe, limit=OUTPUT_MAX_BYTES, log=None):
+    """Read a child's pipe to EOF without blocking the event loop, returning (first limit bytes, total bytes)
+
+    Everything past limit is read and dropped, so the child never blocks
+    on a full pipe and server memory stays bounded. If there is more than
+    limit and log (a runlogs.LogStream) is given, all of it is written
+    there as well.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    chunks = []
+    total = 0
+    try:
+        while True:
+            chunk = await reader.read(PTY_READ_SIZE)
+            if not chunk:
+                return b"".join(chunks), total
+            offset, total = total, total + len(chunk)
+            _keep_output(chunks, chunk, offset, limit, log)
+    finally:
+        transport.close()
+
+
+def _keep_output(chunks, chunk, offset, limit, log=None):
+    """Add the part of chunk (output from byte offset on) within the first limit bytes to chunks
+
+    Once the output goes past limit, log gets what chunks already hold
+    and everything after it.
+    """
+    if offset < limit:
+        chunks.append(chunk[:limit - offset])
+    if log is not None and offset + len(chunk) > limit:
+        if offset <= limit:
+            log.write(b"".join(chunks))
+        log.write(chunk[max(0, limit - offset):])
+
+
+def output_stats(usage, total_bytes, kept_bytes):
+    """Add how much a process wrote, and whether some of it was dropped, to its usage"""
+    usage["output_bytes"] = total_bytes
+    usage["output_truncated"] = total_bytes > kept_bytes
+    return usage
+
+
+async def _write_pipe(pipe, data):
+    """Write data to a child's stdin and close it"""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.connect_write_pipe(asyncio.Protocol, pipe)
+    transport.write(data)
+    transport.close()
+
+
+async def _wait4(pid):
+    """Reap a child with os.wait4 and return (status, rusage)
+
+    Waits on a pidfd where the kernel supports it so no thread is tied up,
+    otherwise falls back to a blocking wait4 in the default executor.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        _, status, rusage = await loop.run_in_executor(None, os.wait4, pid, 0)
+        return status, rusage
+
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage
+
+
+def is_file(input_data):
+    """Whether run input is an open file rather than bytes"""
+    return hasattr(input_data, "fileno")
+
+
+async def run_process(cmd, input_data=None, cwd=None, capture_output=True, cpu=None, env=None, log=None,
+                      limited=False):
+    """Run cmd to completion and return (returncode, stdout, stderr, usage)
+
+    The child is reaped with os.wait4 instead of asyncio's child watcher so
+    its rusage (CPU time, peak RSS) is still available once it has exited.
+    With capture_output=False the output goes to /dev/null and b"" is
+    returned for both streams. cpu pins the child to that core. Each
+    stream is cut at OUTPUT_MAX_BYTES; with a log (runlogs.RunLog) it is
+    cut at log.inline_bytes instead, and written to the log whole.
+    limited runs it under LIMITS, for user programs: in a cgroup of its
+    own, the usage then comes from the group and counts what the child
+    started too.
+
+    input_data is bytes, or a binary file that becomes the child's stdin
+    as is (read from the start), so nothing is copied through the server.
+    """
+    output = subprocess.PIPE if capture_output else subprocess.DEVNULL
+    start = time.perf_counter()
+    if is_file(input_data):
+        input_data.seek(0)
+    if not hasattr(os, "wait4"):
+        # Windows: no rusage, pinning or output limit, let asyncio manage the child
+        if is_file(input_data):
+            input_data = input_data.read()
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input_data else asyncio.subprocess.DEVNULL,
+            stdout=output,
+            stderr=output,
+            cwd=cwd,
+            env=env
+        )
+        stdout, stderr = await process.communicate(input_data)
+        stdout, stderr = stdout or b"", stderr or b""
+        total = len(stdout) + len(stderr)
+        if log is not None:
+            stdout, stderr = log.spill("stdout", stdout), log.spill("stderr", stderr)
+        usage = usage_stats(time.perf_counter() - start)
+        return process.returncode, stdout, stderr, output_stats(usage, total, len(stdout) + len(stderr))
+
+    run_limits = LIMITS.start() if limited else None
+    usage = None
+    try:
+        stdin = input_data if is_file(input_data) else subprocess.PIPE if input_data else subprocess.DEVNULL
+        process = _popen(cmd, stdin, output, cwd, env, cpu, run_limits=run_limits)
+        returncode, stdout, stderr, rusage, total = await _communicate(process, input_data, capture_output, log,
+                                                                       run_limits)
+        usage = output_stats(usage_stats(time.perf_counter() - start, rusage), total, len(stdout) + len(stderr))
+        if run_limits is not None:
+            usage.update(run_limits.usage())
+    finally:
+        if run_limits is not None:
+            LIMITS.finish(run_limits, usage)
+    return returncode, stdout, stderr, usage
+
+
+def _close_limits(run_limits):
+    try:
+        run_limits.close()
+    except OSError:
+        pass  # LIMITS.finish() tries again and says so
+
+
+def _preexec(*setups):
+    """One preexec_fn running every setup that isn't None, or None if they all are"""
+    setups = [setup for setup in setups if setup is not None]
+    if not setups:
+        return None
+    if len(setups) == 1:
+        return setups[0]
+    return lambda: [setup() for setup in setups]
+
+
+def _popen(cmd, stdin, output, cwd=None, env=None, cpu=None, pass_fds=(), run_limits=None):
+    """Start cmd with subprocess.Popen, pinned to cpu if given, else on CORES' run cores, under run_limits if given"""
+    process = subprocess.Popen(
+        cmd,
+        stdin=stdin,
+        stdout=output,
+        stderr=output,
+        cwd=cwd,
+        env=env,
+        preexec_fn=_preexec(CORES.preexec(cpu), run_limits and run_limits.preexec()),
+        pass_fds=pass_fds
+    )
+    CORES.started(process, cpu)
+    return process
+
+
+async def _communicate(process, input_data, capture_output, log=None, run_limits=None):
+    """Feed a Popen child its stdin, collect its output and reap it
+
+    Returns (returncode, stdout, stderr, rusage, total output bytes),
+    with each stream cut at OUTPUT_MAX_BYTES, or spilled to log past
+    log.inline_bytes. Kills the child if cancelled before it exits.
+    run_limits is closed as soon as the child exits, so anything in its
+    cgroup that is still holding the pipes open doesn't keep us reading.
+    """
+    wait_task = asyncio.ensure_future(_wait4(process.pid))
+    if run_limits is not None:
+        wait_task.add_done_callback(lambda _: _close_limits(run_limits))
+    try:
+        io_tasks = []
+        if capture_output and log is not None:
+            io_tasks = [_read_pipe(process.stdout, log.inline_bytes, log.stream("stdout")),
+                        _read_pipe(process.stderr, log.inline_bytes, log.stream("stderr"))]
+        elif capture_output:
+            io_tasks = [_read_pipe(process.stdout), _read_pipe(process.stderr)]
+        if process.stdin is not None:
+            io_tasks.append(_write_pipe(process.stdin, input_data or b""))
+        (status, rusage), *outputs = await asyncio.gather(wait_task, *io_tasks)
+    except BaseException:
+        # Cancelled (client gone, server shutting down): don't leave the child behind
+        if not wait_task.done():
+            wait_task.cancel()
+            process.kill()
+            process.wait()
+        raise
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    (stdout, stdout_total), (stderr, stderr_total) = outputs[:2] if capture_output else ((b"", 0), (b"", 0))
+    return process.returncode, stdout, stderr, rusage, stdout_total + stderr_total
+
+
+class WarmProcess:
+    """A started child that waits on a control socket before running anything
+
+    The child is told its control fd as the last argument. Once it is up it
+    sends b"ready"; when given a request line it answers with the CPU time it
+    has used so far as "user sys" seconds and then runs the request with the
+    stdin/stdout/stderr it was started with, unless the request came with a
+    file descriptor (SCM_RIGHTS) to use as stdin instead. See pywarm.py.
+    """
+
+    def __init__(self, process, control):
+        self.process = process
+        self.control = control
+
+    @classmethod
+    async def start(cls, cmd, env=None):
+        control, child_control = socket.socketpair()
+        try:
+            process = _popen([*cmd, str(child_control.fileno())], subprocess.PIPE, subprocess.PIPE,
+                             env=env, pass_fds=(child_control.fileno(),))
+        except BaseException:
+            control.close()
+            raise
+        finally:
+            child_control.close()
+        control.setblocking(False)
+        warm = cls(process, control)
+        try:
+            greeting = await asyncio.get_running_loop().sock_recv(control, 16)
+        except BaseException:
+            warm.kill()
+            raise
+        if greeting != b"ready":
+            warm.kill()
+            raise RuntimeError(f"{cmd[0]} exited before it was ready")
+        return warm
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    async def run(self, request, input_data=None, log=None, limited=False):
+        """Send request and wait for the child to finish, returning (returncode, stdout, stderr, usage)
+
+        usage starts counting when the request is sent: wall time from
+        then, CPU time minus what the child had used before it, so what
+        was spent warming up doesn't show up in telemetry. input_data is
+        bytes or a binary file, as for run_process; a file's descriptor is
+        passed along with the request for the child to read from directly.
+        Output past log.inline_bytes goes to log, and limited puts the
+        child under LIMITS before it gets the request, as for run_process.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        run_limits = LIMITS.start() if limited else None
+        usage = None
+        try:
+            try:
+                if run_limits is not None:
+                    run_limits.add(self.process.pid)
+                if is_file(input_data):
+                    input_data.seek(0)
+                    # A request line fits in the socket buffer, this doesn't block
+                    self.control.sendmsg([request.encode() + b"\n"], [
+                        (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [input_data.fileno()]))
+                    ])
+                    input_data = None
+                else:
+                    await loop.sock_sendall(self.control, request.encode() + b"\n")
+                baseline = await loop.sock_recv(self.control, 64)
+                base_user, base_sys = (float(value) for value in baseline.decode().split())
+            except BaseException:
+                self.kill()
+                raise
+            finally:
+                self.control.close()
+            returncode, stdout, stderr, rusage, total = await _communicate(self.process, input_data, True, log,
+                                                                           run_limits)
+            usage = output_stats(usage_stats(time.perf_counter() - start, rusage), total, len(stdout) + len(stderr))
+            usage["user_time"] = round(max(0.0, usage["user_time"] - base_user), 6)
+            usage["sys_time"] = round(max(0.0, usage["sys_time"] - base_sys), 6)
+            if run_limits is not None:
+                usage.update(run_limits.usage())  # Counted from when it joined the group, no baseline to take off
+        finally:
+            if run_limits is not None:
+                LIMITS.finish(run_limits, usage)
+        return returncode, stdout, stderr, usage
+
+    def kill(self):
+        self.control.close()
+        if self.alive:
+            self.process.kill()
+            self.process.wait()
+
+
+class WarmPool:
+    """Up to size WarmProcesses started ahead of time from the same cmd
+
+    run() takes a waiting process (or starts one if none is ready) and
+    starts a replacement once the run is over, so refilling doesn't
+    compete with the run for CPU.
+    """
+
+    def __init__(self, cmd, size, env=None):
+        self.cmd = cmd
+        self.size = size
+        self.env = env
+        self.idle = []  # Started WarmProcesses, oldest first
+        self.starting = 0
+
+    async def fill(self):
+        """Start processes until size are idle or starting"""
+        while len(self.idle) + self.starting < self.size:
+            self.starting += 1
+            try:
+                warm = await WarmProcess.start(self.cmd, self.env)
+            except Exception as e:
+                print(f"Could not start {' '.join(self.cmd)}: {e}")
+                return
+            finally:
+                self.starting -= 1
+            self.idle.append(warm)
+
+    async def acquire(self):
+        while self.idle:
+            warm = self.idle.pop(0)
+            if warm.alive:
+                return warm
+            warm.kill()
+        return await WarmProcess.start(self.cmd, self.env)
+
+    async def run(self, request, input_data=None, log=None, limited=False):
+        """Run request on a warm process, see WarmProcess.run"""
+        warm = await self.acquire()
+        try:
+            return await warm.run(request, input_data, log, limited)
+        finally:
+            asyncio.ensure_future(self.fill())
+
+    def stop(self):
+        for warm in self.idle:
+            warm.kill()
+        self.idle.clear()
+
+
+class PtyProcess:
+    """A child whose stdin, stdout and stderr are a pseudo-terminal
+
+    Programs see a terminal, so libc and Python line-buffer their output
+    instead of holding it until exit. Reading and writing the master side
+    is driven by the event loop's reader/writer callbacks: nothing polls.
+    Echo and newline translation are off, so output is exactly what the
+    program writes.
+    """
+
+    def __init__(self, process, master):
+        self.process = process
+        self.master = master
+        self.pending = b""  # Input the terminal couldn't take yet
+        self.writing = False  # Whether a writer callback is waiting to flush pending
+
+    @classmethod
+    def start(cls, cmd, cwd=None, env=None, run_limits=None):
+        master, slave = pty.openpty()
+        try:
+            attrs = termios.tcgetattr(slave)
+            attrs[1] &= ~termios.ONLCR  # Keep "\n" line endings, like output read from a pipe
+            attrs[3] &= ~termios.ECHO
+            termios.tcsetattr(slave, termios.TCSANOW, attrs)
+            process = subprocess.Popen(cmd, stdin=slave, stdout=slave, stderr=slave, cwd=cwd, env=env,
+                                       start_new_session=True,
+                                       preexec_fn=_preexec(CORES.preexec(), run_limits and run_limits.preexec()))
+            CORES.started(process)
+        except BaseException:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        os.set_blocking(master, False)
+        return cls(process, master)
+
+    async def read(self):
+        """Next chunk of output, or b"" once the program and everything it started have closed the terminal"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return os.read(self.master, PTY_READ_SIZE)
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                if e.errno == errno.EIO:
+                    return b""  # Linux reports a closed slave side as EIO
+                raise
+            readable = loop.create_future()
+            loop.add_reader(self.master, lambda: readable.done() or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(self.master)
+
+    def write(self, data):
+        """Queue input for the program; whatever doesn't fit now is written when the terminal has room"""
+        self.pending += data
+        self.flush()
+
+    def flush(self):
+        try:
+            written = os.write(self.master, self.pending) if self.pending else 0
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            written = len(self.pending)  # Program's gone, nobody will read it
+        self.pending = self.pending[written:]
+        loop = asyncio.get_running_loop()
+        if self.pending and not self.writing:
+            loop.add_writer(self.master, self.flush)
+            self.writing = True
+        elif not self.pending and self.writing:
+            loop.remove_writer(self.master)
+            self.writing = False
+
+    def close(self):
+        if self.writing:
+            asyncio.get_running_loop().remove_writer(self.master)
+            self.writing = False
+        os.close(self.master)
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+async def run_pty(cmd, terminal, input_data=None, cwd=None, env=None, log=None, limited=False):
+    """Run cmd on a pseudo-terminal and return (returncode, output, usage)
+
+    terminal is attach()ed to the PtyProcess so it can write input as it
+    arrives, awaited with terminal.output(chunk) for each chunk of output
+    as it is produced and with terminal.flush() once there is no more.
+    Reading waits while terminal.output() does, which is how a slow
+    client slows the program down. input_data (bytes) is typed in first.
+    Only the first OUTPUT_MAX_BYTES of output are kept for the result,
+    or log.inline_bytes with the whole output going to log's "stdout"
+    once it's longer than that. limited is as for run_process.
+    """
+    start = time.perf_counter()
+    run_limits = LIMITS.start() if limited else None
+    try:
+        process = PtyProcess.start(cmd, cwd, env, run_limits)
+    except BaseException:
+        if run_limits is not None:
+            LIMITS.finish(run_limits)
+        raise
+    usage = None
+    try:
+        returncode, output, usage = await _run_on_pty(process, terminal, input_data, log, start, run_limits)
+        if run_limits is not None:
+            usage.update(run_limits.usage())
+    finally:
+        if run_limits is not None:
+            LIMITS.finish(run_limits, usage)
+    return returncode, output, usage
+
+
+async def _run_on_pty(process, terminal, input_data, log, start, run_limits):
+    wait_task = asyncio.ensure_future(_wait4(process.process.pid))
+    if run_limits is not None:
+        wait_task.add_done_callback(lambda _: _close_limits(run_limits))
+    limit, log_stream = (log.inline_bytes, log.stream("stdout")) if log is not None else (OUTPUT_MAX_BYTES, None)
+    chunks = []
+    total = 0
+    try:
+        terminal.attach(process)
+        if input_data:
+            process.write(input_data)
+        while True:
+            chunk = await process.read()
+            if not chunk:
+                break
+            offset, total = total, total + len(chunk)
+            _keep_output(chunks, chunk, offset, limit, log_stream)
+            await terminal.output(chunk)
+        await terminal.flush()
+        status, rusage = await wait_task
+    except BaseException:
+        if not wait_task.done():
+            wait_task.cancel()
+            process.kill()
+        raise
+    finally:
+        terminal.attach(None)
+        process.close()
+    process.process.returncode = os.waitstatus_to_exitcode(status)
+    usage = output_stats(usage_stats(time.perf_counter() - start, rusage), total, min(total, limit))
+    return process.process.returncode, b"".join(chunks), usage
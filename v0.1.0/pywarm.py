@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Pre-started Python interpreter that runs one script when told to
+
+Usage: pywarm.py CONTROL_FD
+
+The server keeps a few of these waiting per interpreter so a run doesn't
+pay for interpreter startup. Once up it sends b"ready" on the CONTROL_FD
+socket and blocks until the server sends a request, one line of JSON:
+
+    {"script": path, "code": marshalled code cache path, "salt": key salt,
+     "cwd": working directory}
+
+code, salt and cwd are optional. If a file descriptor comes along with the
+request (SCM_RIGHTS), it replaces stdin. It answers with the CPU time used so far
+("user sys" seconds), which the server subtracts from the process's
+rusage, then runs the script as __main__ with the stdin/stdout/stderr it
+was started with. The code object comes from the code file if it exists;
+otherwise the script is compiled and, if the source still hashes to the
+code file's name (sha256 of salt, NUL, source), marshalled there for the
+next run.
+
+Kept to syntax every supported interpreter (CPython 3.6+, PyPy 3) accepts.
+"""
+import array
+import hashlib
+import json
+import marshal
+import os
+import resource
+import socket
+import sys
+import traceback
+import types
+from importlib.util import MAGIC_NUMBER
+
+
+def read_request(control):
+    """(request line, file descriptors passed with it), or (None, []) if the server went away"""
+    request = b""
+    fds = array.array("i")
+    while not request.endswith(b"\n"):
+        chunk, ancdata, _, _ = control.recvmsg(4096, socket.CMSG_SPACE(fds.itemsize))
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+        if not chunk:
+            return None, list(fds)
+        request += chunk
+    return request[:-1].decode(), list(fds)
+
+
+def load_code(script, code_path=None, salt=None):
+    """Code object for script, from the code cache when a previous run left it there"""
+    if code_path:
+        try:
+            with open(code_path, "rb") as f:
+                data = f.read()
+            if data[:len(MAGIC_NUMBER)] == MAGIC_NUMBER:
+                return marshal.loads(data[len(MAGIC_NUMBER):])
+        except (OSError, EOFError, ValueError, TypeError):
+            pass  # Missing or unreadable, compile instead
+    with open(script, "rb") as f:
+        source = f.read()
+    code = compile(source, script, "exec", dont_inherit=True)
+    if code_path and salt is not None:
+        digest = hashlib.sha256(salt.encode() + b"\0" + source).hexdigest()
+        if os.path.basename(code_path) == digest + ".pyc":
+            tmp_path = "{}.{}.tmp".format(code_path, os.getpid())
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(MAGIC_NUMBER + marshal.dumps(code))
+                os.replace(tmp_path, code_path)
+            except OSError:
+                pass  # Cache is best effort
+    return code
+
+
+def run_script(script, code_path=None, salt=None):
+    """Run script as __main__ the way `python script` would"""
+    main_module = types.ModuleType("__main__")
+    main_module.__file__ = script
+    sys.modules["__main__"] = main_module
+    sys.argv = [script]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    try:
+        code = load_code(script, code_path, salt)
+        exec(code, main_module.__dict__)
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # Leave this file's frames out of the traceback, as if run directly
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename == __file__:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        sys.exit(1)
+
+
+def main():
+    control = socket.socket(fileno=int(sys.argv[1]))
+    control.sendall(b"ready")
+    request, fds = read_request(control)
+    if request is None:
+        return
+    request = json.loads(request)
+    if fds:
+        os.dup2(fds[0], 0)
+        os.close(fds[0])
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    control.sendall("{} {}".format(usage.ru_utime, usage.ru_stime).encode())
+    control.close()
+    if request.get("cwd"):
+        os.chdir(request["cwd"])
+    run_script(request["script"], request.get("code"), request.get("salt"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Spilled output of runs, kept on disk for a while for ranged reads
+
+A run that writes more than a response should carry gets the whole of
+each such stream written to a log file as it is read: "<log id>.stdout"
+and "<log id>.stderr" directly in the store's root. The response keeps
+the first inline_bytes and names the log, which can then be read back a
+page at a time by byte or line range. Logs expire ttl seconds after the
+run finished, and the oldest go first once the store grows past max_bytes.
+"""
+import mmap
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+RUN_LOG_STREAM_MAX_BYTES = 256 * 1024 * 1024  # Output past this isn't logged either, it's only counted
+RUN_LOG_LINE_STRIDE = 1024  # Line ranges are found from an index of every this many lines' offsets
+RUN_LOG_STREAMS = ("stdout", "stderr")
+
+
+class LogStream:
+    """One stream of a run being written to its log file
+
+    Nothing touches the disk until the first write, so streams that never
+    spill never create a file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.size = 0  # Bytes written to the file
+        self.complete = True  # False once something had to be left out for RUN_LOG_STREAM_MAX_BYTES
+
+    def write(self, data):
+        if self.file is None:
+            self.file = open(self.path, "wb")
+        room = RUN_LOG_STREAM_MAX_BYTES - self.size
+        if len(data) > room:
+            data = data[:room]
+            self.complete = False
+        # Page cache writes of a read's worth of output; not worth an executor round trip each
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class RunLog:
+    """The log of one run in progress, from RunLogStore.create()
+
+    Whoever reads the run's output keeps inline_bytes of each stream in
+    memory and writes the whole stream to stream(name) once it is longer
+    than that (see process._read_pipe).
+    """
+
+    def __init__(self, log_id, root, inline_bytes):
+        self.id = log_id
+        self.root = root
+        self.inline_bytes = inline_bytes
+        self.streams = {}
+
+    def stream(self, name):
+        if name not in self.streams:
+            self.streams[name] = LogStream(os.path.join(self.root, f"{self.id}.{name}"))
+        return self.streams[name]
+
+    def spill(self, name, data):
+        """Log output that was read in full, returning the part to keep inline"""
+        if len(data) <= self.inline_bytes:
+            return data
+        self.stream(name).write(data)
+        return data[:self.inline_bytes]
+
+
+class RunLogStore:
+    """Run logs under root, expired by age and total size
+
+    The index only holds finished logs: create() hands out a RunLog,
+    finish() closes it and, if anything was spilled, adds it. Reading
+    is lookup() on the event loop, which owns the index, then
+    read_bytes() or read_lines() in an executor: they mmap the file and
+    block.
+    """
+
+    def __init__(self, root, ttl, max_bytes, inline_bytes):
+        self.root = os.path.abspath(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.inline_bytes = inline_bytes  # Output of a stream kept in the response before it spills
+        self.entries = OrderedDict()  # Store {log id: (finish time, {stream: size in bytes})}, oldest first
+        self.line_index = {}  # Store {(log id, stream): (line count, offsets of every RUN_LOG_LINE_STRIDE-th line)}
+        self.total_bytes = 0
+        self.expirations = 0
+
+    def sweep(self):
+        """Startup cleanup: index the logs earlier runs left and drop the expired ones"""
+        os.makedirs(self.root, exist_ok=True)
+        found = {}
+        for entry in os.scandir(self.root):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            log_id, _, stream = entry.name.partition(".")
+            stat = entry.stat()
+            if not stat.st_size:
+                os.remove(entry.path)  # Opened by a run the server didn't live to finish, nothing to read
+                continue
+            finished, sizes = found.setdefault(log_id, (stat.st_mtime, {}))
+            found[log_id] = (max(finished, stat.st_mtime), sizes)
+            sizes[stream] = stat.st_size
+        self.entries.clear()
+        self.total_bytes = 0
+        for log_id, (finished, sizes) in sorted(found.items(), key=lambda item: item[1][0]):
+            self.entries[log_id] = (finished, sizes)
+            self.total_bytes += sum(sizes.values())
+        self.expire()
+        print(f"Run log store {self.root}: {len(self.entries)} logs, {self.total_bytes // 1024} KB")
+
+    def create(self):
+        return RunLog(secrets.token_hex(16), self.root, self.inline_bytes)
+
+    def finish(self, log, keep=True):
+        """Close a run's log, returning what the response should say about it, or None if nothing spilled
+
+        keep=False throws it away, for runs that failed.
+        """
+        sizes = {}
+        for name, stream in log.streams.items():
+            stream.close()
+            if stream.file is not None:
+                sizes[name] = stream.size
+        if not sizes:
+            return None
+        if not keep:
+            self.remove_files(log.id, sizes)
+            return None
+        self.entries[log.id] = (time.time(), sizes)
+        self.total_bytes += sum(sizes.values())
+        self.expire()
+        return {
+            "id": log.id,
+            "streams": {name: {"bytes": size, "complete": log.streams[name].complete} for name, size in sizes.items()},
+            "expires_in": self.ttl
+        }
+
+    def remove_files(self, log_id, sizes):
+        for name in sizes:
+            try:
+                os.remove(os.path.join(self.root, f"{log_id}.{name}"))
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        """Drop logs older than ttl, then the oldest until the store fits in max_bytes"""
+        deadline = time.time() - self.ttl
+        for log_id, (finished, sizes) in list(self.entries.items()):
+            if finished >= deadline and self.total_bytes <= self.max_bytes:
+                break
+            del self.entries[log_id]
+            for name in sizes:
+                self.line_index.pop((log_id, name), None)
+            self.remove_files(log_id, sizes)
+            self.total_bytes -= sum(sizes.values())
+            self.expirations += 1
+
+    def lookup(self, log_id, stream):
+        """Path and size of a finished log's stream, or None if there's no such log (any more)"""
+        self.expire()
+        entry = self.entries.get(log_id)
+        if entry is None or stream not in entry[1]:
+            return None
+        return os.path.join(self.root, f"{log_id}.{stream}"), entry[1][stream]
+
+    def read_lines(self, log_id, stream, path, size, first, count, max_bytes):
+        """Lines first to first + count (0-based) of a stream lookup() found, cut at max_bytes
+
+        Returns (data, byte offset of line first, next line to ask for,
+        total lines), or None if the log expired in the meantime. next
+        line is where data stopped: after the last whole line in it, or
+        first + count. Blocking; the log's line index is built by the
+        first read that needs it.
+        """
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                key = (log_id, stream)
+                index = self.line_index.get(key) or index_lines(data)
+                if log_id in self.entries:
+                    self.line_index[key] = index  # Unless it expired while we were indexing it
+                total, offsets = index
+                first = min(first, total)
+                start = line_offset(data, offsets, first)
+                end = min(line_offset(data, offsets, min(first + count, total)), start + max_bytes)
+                chunk = data[start:end]
+        except FileNotFoundError:
+            return None
+        complete_lines = chunk.count(b"\n")
+        if end == size and chunk and not chunk.endswith(b"\n"):
+            complete_lines += 1  # Last line of the log, with no newline after it
+        return chunk, start, first + complete_lines, total
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "logs": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "expirations": self.expirations
+        }
+
+
+def read_bytes(path, offset, length):
+    """length bytes from offset of a log file, or None if it expired in the meantime (blocking)"""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data[offset:offset + length]
+    except FileNotFoundError:
+        return None
+
+
+def index_lines(data):
+    """(line count, offset of every RUN_LOG_LINE_STRIDE-th line's start) of an mmapped log"""
+    offsets = [0]
+    lines = 0
+    position = 0
+    size = len(data)
+    while position < size:
+        newline = data.find(b"\n", position)
+        position = size if newline < 0 else newline + 1
+        lines += 1
+        if lines % RUN_LOG_LINE_STRIDE == 0:
+            offsets.append(position)
+    return lines, offsets
+
+
+def line_offset(data, offsets, line):
+    """Byte offset where line starts (the log's size past the last line)"""
+    position = offsets[line // RUN_LOG_LINE_STRIDE]
+    for _ in range(line % RUN_LOG_LINE_STRIDE):
+        newline = data.find(b"\n", position)
+        if newline < 0:
+            return len(data)
+        position = newline + 1
+    return position
@@ -0,0 +1,1180 @@
+"""Language runners: how each file type is built and run
+
+CodeServer looks files up here by extension for run_file, create_file and
+list_files. Adding a language (or a faster toolchain for an existing one)
+means writing a Runner and passing it to register_runner(). Anything a
+runner keeps warm between runs is its own business, set up in start() and
+torn down in stop().
+"""
+import asyncio
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import pstats
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import traceback
+import warnings
+from collections import OrderedDict
+
+try:
+    from pyflakes import api as pyflakes_api
+except ImportError:
+    pyflakes_api = None  # Save-time Python diagnostics fall back to compile()
+
+from limits import LIMITS
+from process import (
+    CORES, OUTPUT_MAX_BYTES, WarmPool, _preexec, add_usage, output_stats, pick_benchmark_cpu, pty, run_process,
+    run_pty, summarize_samples
+)
+from scratch import ScratchSpace
+
+RUN_MODES = ("benchmark", "profile", "memprofile", "pty")  # Optional run_file modes, at most one per run
+TERMINAL_MODES = frozenset({"pty"} if pty else ())  # Modes that need pseudo-terminal support
+BENCHMARK_DEFAULT_ITERATIONS = 10
+BENCHMARK_DEFAULT_WARMUP = 1
+BENCHMARK_MAX_ITERATIONS = 100  # Upper bound for both iterations and warmup
+PROFILE_DEFAULT_TOP = 20  # Functions returned by a profiled run
+PROFILE_MAX_TOP = 200
+MEMPROFILE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memprofile.py")
+MEMPROFILE_DEFAULT_INTERVAL = 0.1  # Seconds between traced-memory samples
+MEMPROFILE_MIN_INTERVAL = 0.01
+MEMPROFILE_MAX_FRAMES = 10
+PRECHECK_CACHE_SIZE = 1024  # Syntax check results remembered per runner, by content hash
+PCH_HEADER = "bits/stdc++.h"  # Only worth precompiling the header almost every C++ solution includes
+GCC_DIAGNOSTIC_RE = re.compile(r"^(.*?):(\d+):(\d+): (fatal error|error|warning): (.*)$", re.MULTILINE)
+LOCAL_INCLUDE_RE = re.compile(rb'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+PYWARM_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pywarm.py")
+PYTHON_POOL_SIZE = 2  # Pre-started processes kept per Python interpreter
+PYTHON_COMMAND_RE = re.compile(r"^(python|pypy)(\d+(\.\d+)?)?$")  # Executables on PATH probed as interpreters
+PYTHON_PROBE = "import platform, sys; print(platform.python_implementation(), '%d.%d.%d' % sys.version_info[:3], sys.executable)"
+JAVA_RUNNER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "JavaRunner.java")
+JAVA_POOL_SIZE = 2  # Warm JVMs kept for .java files, each runs one program at a time
+JAVA_WORK_ROOT = ScratchSpace.default_root("codeserver-jvm")  # Each warm JVM's working directory is created in here
+
+C_TEMPLATE = '#include <stdio.h>\n\nint main() {\n    printf("Hello, World!\\n");\n    return 0;\n}\n'
+CPP_TEMPLATE = '#include <bits/stdc++.h>\nusing namespace std;\n\nint main() {\n    cout << "Hello, World!" << endl;\n    return 0;\n}\n'
+
+RUNNERS = {}  # Store {extension: Runner}
+
+
+def register_runner(runner):
+    """Make a runner handle its extension, replacing any previous one"""
+    RUNNERS[runner.extension] = runner
+
+
+def get_runner(extension):
+    return RUNNERS.get(extension)
+
+
+def runner_for_type(file_type):
+    """The runner create_file uses for a "type" such as "py" or "cpp\""""
+    for runner in RUNNERS.values():
+        if runner.file_type == file_type:
+            return runner
+    return None
+
+
+def file_hash(file_path, salt=""):
+    """SHA-256 of a file's content, with salt mixed in to namespace it"""
+    digest = hashlib.sha256(salt.encode() + b"\0")
+    with open(file_path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def local_includes(file_path):
+    """[(path, content)] of a source file and the local headers it includes, itself first
+
+    Follows #include "..." relative to the including file; headers that
+    don't exist (system ones included with quotes) are skipped.
+    """
+    files = []
+    pending = [os.path.abspath(file_path)]
+    seen = set()
+    while pending:
+        path = os.path.normpath(pending.pop())
+        if path in seen or not os.path.isfile(path):
+            continue
+        seen.add(path)
+        with open(path, "rb") as f:
+            content = f.read()
+        files.append((path, content))
+        for include in LOCAL_INCLUDE_RE.findall(content):
+            pending.append(os.path.join(os.path.dirname(path), include.decode(errors="replace")))
+    return files
+
+
+def source_hash(file_path, compiler_id):
+    """Hash of a source file, the local headers it includes and the compiler
+
+    Editing a header in the workspace invalidates the binaries built from it.
+    """
+    digest = hashlib.sha256(compiler_id.encode())
+    for path, content in local_includes(file_path):
+        digest.update(path.encode() + b"\0" + content + b"\0")
+    return digest.hexdigest()
+
+
+def read_cprofile_stats(path, top):
+    """Top functions by cumulative time from a cProfile output file"""
+    stats = pstats.Stats(path).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{
+        "function": func,
+        "file": file,
+        "line": line,
+        "calls": calls,
+        "primitive_calls": primitive_calls,
+        "total_time": round(total_time, 6),
+        "cumulative_time": round(cumulative_time, 6)
+    } for (file, line, func), (primitive_calls, calls, total_time, cumulative_time, _) in rows]
+
+
+def parse_gprof_flat_profile(text, top):
+    """Parse the rows of a `gprof -b -p` flat profile
+
+    Functions that were sampled but never counted by mcount have no call
+    columns, so those come back as None.
+    """
+    functions = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            numbers = [float(field) for field in fields[:3]]
+        except ValueError:
+            continue  # Header lines
+        row = {"percent_time": numbers[0], "cumulative_seconds": numbers[1], "self_seconds": numbers[2]}
+        rest = fields[3:]
+        if len(rest) >= 4 and rest[0].isdigit():
+            row["calls"] = int(rest[0])
+            row["self_ms_per_call"] = float(rest[1])
+            row["total_ms_per_call"] = float(rest[2])
+            rest = rest[3:]
+        else:
+            row["calls"] = row["self_ms_per_call"] = row["total_ms_per_call"] = None
+        row["function"] = " ".join(rest)
+        functions.append(row)
+    return functions[:top]
+
+
+def cache_put(cache, key, value, limit=PRECHECK_CACHE_SIZE):
+    """Store into an OrderedDict used as an LRU cache, evicting the oldest entries"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def precheck_error(message, usage=None, cached=False):
+    """run_file error response for a file that failed its precheck"""
+    return {
+        "status": "error",
+        "message": message,
+        "telemetry": {"compile": usage, "compile_cached": cached, "execute": None}
+    }
+
+
+def python_syntax_error(file_path):
+    """Python's own SyntaxError report for a file, or None if it compiles"""
+    with open(file_path, "rb") as f:
+        source = f.read()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # SyntaxWarnings are the run's business
+        try:
+            compile(source, file_path, "exec", dont_inherit=True)
+        except (SyntaxError, ValueError) as e:
+            return "".join(traceback.format_exception_only(type(e), e))
+    return None
+
+
+class DiagnosticsReporter:
+    """pyflakes reporter that collects findings instead of printing them"""
+
+    def __init__(self):
+        self.diagnostics = []
+
+    def unexpectedError(self, filename, msg):
+        self.diagnostics.append({"line": None, "column": None, "severity": "error", "message": str(msg)})
+
+    def syntaxError(self, filename, msg, lineno, offset, text):
+        self.diagnostics.append({"line": lineno, "column": offset, "severity": "error", "message": msg})
+
+    def flake(self, message):
+        self.diagnostics.append({
+            "line": message.lineno,
+            "column": message.col + 1,
+            "severity": "warning",
+            "message": message.message % message.message_args
+        })
+
+
+def python_diagnostics(file_path):
+    """(tool, diagnostics) for a Python file: pyflakes if installed, else just compile()"""
+    if pyflakes_api is not None:
+        reporter = DiagnosticsReporter()
+        pyflakes_api.checkPath(file_path, reporter)
+        return "pyflakes", reporter.diagnostics
+    with open(file_path, "rb") as f:
+        source = f.read()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            compile(source, file_path, "exec", dont_inherit=True)
+        except SyntaxError as e:
+            return "compile", [{"line": e.lineno, "column": e.offset, "severity": "error", "message": e.msg}]
+        except ValueError as e:
+            return "compile", [{"line": None, "column": None, "severity": "error", "message": str(e)}]
+    return "compile", []
+
+
+def gcc_diagnostics(text, file_path):
+    """Errors and warnings GCC reported against file_path (notes and other files' are dropped)"""
+    return [{
+        "line": int(line),
+        "column": int(column),
+        "severity": "error" if severity == "fatal error" else severity,
+        "message": message
+    } for path, line, column, severity, message in GCC_DIAGNOSTIC_RE.findall(text) if path == file_path]
+
+
+def profile_top(options):
+    """Number of functions/sites a profile should return from its run options"""
+    if isinstance(options, dict) and isinstance(options.get("top"), int):
+        return max(1, min(options["top"], PROFILE_MAX_TOP))
+    return PROFILE_DEFAULT_TOP
+
+
+class Runner:
+    """A file type the server knows how to run
+
+    Subclasses set extension (plus file_type and template() if create_file
+    should offer it) and implement run().
+    """
+    extension = None
+    file_type = None  # create_file "type", None if files can't be created from a template
+    modes = frozenset()  # Which of RUN_MODES this runner supports
+
+    def template(self, filename):
+        """Initial content for a new file"""
+        return ""
+
+    async def cache_key(self, file_path, options=None):
+        """Key identifying what this runner would build from file_path
+
+        options is the run_file request, for runners whose output depends
+        on more than the file (e.g. which interpreter runs it).
+        """
+        return file_hash(file_path, self.extension)
+
+    async def precheck(self, file_path, options):
+        """Cheap check for files that can't possibly run, before run()
+
+        Must not start the program. Returns an error response like run()'s
+        (see precheck_error) or None to go ahead with the run.
+        """
+        return None
+
+    async def diagnostics(self, file_path):
+        """(tool, diagnostics) for a saved file, or None if there's no checker
+
+        Each diagnostic is {"line", "column", "severity", "message"}, with
+        severity "error" or "warning". Called in the background after
+        save_file; results are cached by cache_key().
+        """
+        return None
+
+    def stats(self):
+        """Runner-specific counters for get_metrics, or None"""
+        return None
+
+    async def available(self):
+        """Whether the toolchain this runner needs is installed"""
+        return True
+
+    async def start(self):
+        """Start whatever the runner keeps warm, called once at server start"""
+
+    async def stop(self):
+        """Tear down warm state at server shutdown"""
+
+    async def run(self, file_path, input_data, options, cwd=None, on_phase=None, terminal=None, log=None):
+        """Build and run file_path with input_data on stdin
+
+        input_data is a string, or a binary file (an uploaded input) that
+        can be handed to the program as its stdin. options is the run_file
+        request and cwd the directory the program runs in (the server's own
+        if None). on_phase, if given, is awaited with "compiling" and
+        "running" as the run gets to those steps. terminal is what pty runs
+        stream their output to and take input from (see run_pty). log, a
+        runlogs.RunLog, gets the whole of any output stream longer than
+        log.inline_bytes, which is all result/error then hold. Returns
+        the run_file response without its "action": status plus result/
+        error/exit_code/telemetry on success, or status and message on error.
+        """
+        raise NotImplementedError
+
+
+class Build:
+    """What a CommandRunner's compile step produced"""
+
+    def __init__(self, cmd=None, env=None, usage=None, cached=False, error=None, pool=None, request=None,
+                 details=None, release=None, cwd=None):
+        self.cmd = cmd  # Command line that runs the program
+        self.env = env
+        self.usage = usage  # Compile telemetry, None if nothing was compiled
+        self.cached = cached  # True if the build cache already had the result
+        self.error = error  # Compiler diagnostics if the build failed
+        self.pool = pool  # WarmPool to run on instead of starting cmd, if the runner has one
+        self.request = request  # What to send the pool's process, a dict
+        self.details = details or {}  # Extra telemetry fields, e.g. {"interpreter": "pypy3.10"}
+        self.release = release  # Called once the run is over, e.g. to unpin its artifact
+        self.cwd = cwd  # Directory the program runs in
+
+
+class CommandRunner(Runner):
+    """Runner for programs that are started as a fresh process per run
+
+    Subclasses implement build(), and collect_profile() if they support
+    the profile mode. Benchmarking and pty runs come for free.
+    """
+    modes = frozenset({"benchmark"}) | TERMINAL_MODES
+
+    async def build(self, file_path, options, work_dir):
+        """Compile if needed and return a Build
+
+        work_dir is a scratch directory for profile/memprofile runs, whose
+        output the collect step reads back after the run.
+        """
+        raise NotImplementedError
+
+    async def execute(self, build, input_data, capture_output=True, cpu=None, log=None):
+        """Run a build once under the run limits, returning (returncode, stdout, stderr, usage)"""
+        return await run_process(build.cmd, input_data, build.cwd, capture_output, cpu, build.env, log, limited=True)
+
+    async def collect_profile(self, build, work_dir, options):
+        raise NotImplementedError
+
+    async def run(self, file_path, input_data, options, cwd=None, on_phase=None, terminal=None, log=None):
+        work_dir = None
+        build = None
+        if options.get("profile") or options.get("memprofile"):
+            work_dir = tempfile.mkdtemp(prefix="profile-")
+        try:
+            if on_phase:
+                await on_phase("compiling")
+            build = await self.build(file_path, options, work_dir)
+            build.cwd = cwd
+            telemetry = {"compile": build.usage, "compile_cached": build.cached, "execute": None, **build.details}
+            if build.error is not None:
+                return {
+                    "status": "error",
+                    "message": f"Compilation error: {build.error}",
+                    "telemetry": telemetry
+                }
+
+            stdin = input_data.encode() if isinstance(input_data, str) else input_data
+            if on_phase:
+                await on_phase("running")
+            if options.get("benchmark"):
+                return await self.benchmark(build, stdin, options["benchmark"], telemetry, log)
+            if options.get("pty"):
+                return await self.run_on_terminal(build, stdin, terminal, telemetry, log)
+
+            returncode, stdout, stderr, telemetry["execute"] = await self.execute(build, stdin, log=log)
+            response = {
+                "status": "success",
+                "result": stdout.decode(errors="replace"),  # Output may have been cut mid-character
+                "error": stderr.decode(errors="replace"),
+                "exit_code": returncode,
+                "telemetry": telemetry
+            }
+            if options.get("profile"):
+                response["profile"] = await self.collect_profile(build, work_dir, options["profile"])
+            elif options.get("memprofile"):
+                response["memprofile"] = self.collect_memprofile(work_dir)
+            return response
+        finally:
+            if build is not None and build.release:
+                build.release()
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def run_on_terminal(self, build, input_data, terminal, telemetry, log=None):
+        """Run a build once on a pseudo-terminal, streaming its output to terminal
+
+        Always a fresh process, warm pools' processes are started on pipes.
+        stdout and stderr share the terminal, so it all comes back as result.
+        """
+        if not isinstance(input_data, (bytes, type(None))):
+            return {"status": "error", "message": "Uploaded inputs can't be typed into a terminal, send the input instead"}
+        returncode, output, telemetry["execute"] = await run_pty(build.cmd, terminal, input_data, build.cwd, build.env, log,
+                                                                 limited=True)
+        return {
+            "status": "success",
+            "result": output.decode(errors="replace"),
+            "error": "",
+            "exit_code": returncode,
+            "telemetry": telemetry
+        }
+
+    def collect_memprofile(self, work_dir):
+        """Load the report memprofile.py wrote into work_dir"""
+        report_path = os.path.join(work_dir, "memprofile.json")
+        if not os.path.exists(report_path):
+            return {"error": "No memory report written (was the process killed?)"}
+        with open(report_path) as f:
+            return json.load(f)
+
+    async def benchmark(self, build, input_data, options, telemetry, log=None):
+        """Run a build repeatedly and return wall/CPU time statistics
+
+        options is either true (use the defaults) or a dict with iterations,
+        warmup, pin_cpu and exclusive_cpu: pin to a core nothing else runs
+        on for the whole benchmark (waiting for one if they're all taken),
+        or just pin if no core can be set aside. Only the first execution's
+        output is kept (and logged), later ones write to /dev/null.
+        """
+        if not isinstance(options, dict):
+            options = {}
+        try:
+            iterations = int(options.get("iterations", BENCHMARK_DEFAULT_ITERATIONS))
+            warmup = int(options.get("warmup", BENCHMARK_DEFAULT_WARMUP))
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Benchmark iterations and warmup must be integers"}
+        iterations = max(1, min(iterations, BENCHMARK_MAX_ITERATIONS))
+        warmup = max(0, min(warmup, BENCHMARK_MAX_ITERATIONS))
+
+        wall_times = []
+        cpu_times = []
+        total_usage = None
+        async with CORES.exclusive() if options.get("exclusive_cpu") else contextlib.nullcontext() as exclusive_cpu:
+            cpu = exclusive_cpu
+            if cpu is None and (options.get("pin_cpu") or options.get("exclusive_cpu")):
+                cpu = pick_benchmark_cpu()
+            for i in range(warmup + iterations):
+                returncode, stdout, stderr, usage = await self.execute(build, input_data, capture_output=(i == 0),
+                                                                       cpu=cpu, log=log if i == 0 else None)
+                if i == 0:
+                    result, error, exit_code = (stdout.decode(errors="replace"), stderr.decode(errors="replace"),
+                                                returncode)
+                    telemetry["execute"] = usage
+                total_usage = add_usage(total_usage, usage)
+                if i >= warmup:
+                    wall_times.append(usage["wall_time"])
+                    if usage["user_time"] is not None:
+                        cpu_times.append(usage["user_time"] + usage["sys_time"])
+
+        return {
+            "status": "success",
+            "result": result,
+            "error": error,
+            "exit_code": exit_code,
+            "telemetry": telemetry,
+            "benchmark": {
+                "iterations": iterations,
+                "warmup": warmup,
+                "cpu": cpu,
+                "exclusive_cpu": exclusive_cpu is not None,
+                "wall_time": summarize_samples(wall_times),
+                "cpu_time": summarize_samples(cpu_times) if cpu_times else None,
+                "total": total_usage
+            }
+        }
+
+
+class PythonInterpreter:
+    """One Python installation found on PATH, with its own warm pool"""
+
+    def __init__(self, name, implementation, version, path, pool_size=PYTHON_POOL_SIZE):
+        self.name = name  # e.g. "cpython3.11", "pypy3.10"
+        self.implementation = implementation  # platform.python_implementation()
+        self.version = version
+        self.path = path  # The interpreter's sys.executable
+        self.pool = WarmPool([path, PYWARM_SCRIPT], pool_size) if hasattr(os, "wait4") else None
+
+    def describe(self):
+        return {"name": self.name, "implementation": self.implementation, "version": self.version, "path": self.path}
+
+
+async def probe_interpreter(command):
+    """(implementation, version, sys.executable) of a Python command, or None if it isn't a usable Python 3"""
+    try:
+        returncode, stdout, _, _ = await run_process([command, "-c", PYTHON_PROBE])
+    except OSError:
+        return None
+    fields = stdout.decode(errors="replace").split(" ", 2)
+    if returncode != 0 or len(fields) != 3 or not fields[1].startswith("3."):
+        return None
+    implementation, version, executable = fields
+    return implementation, version, executable.strip()
+
+
+def shebang_interpreter(file_path):
+    """Command named by a file's #! line ("pypy3" for #!/usr/bin/env pypy3), or None"""
+    with open(file_path, "rb") as f:
+        first_line = f.readline(256).decode(errors="replace")
+    if not first_line.startswith("#!"):
+        return None
+    words = first_line[2:].split()
+    if words and os.path.basename(words[0]) == "env":
+        words = [word for word in words[1:] if not word.startswith("-")]
+    return os.path.basename(words[0]) if words else None
+
+
+class PythonRunner(CommandRunner):
+    """.py files, on any of the Python interpreters found on PATH
+
+    A run picks its interpreter with the "interpreter" run option, else the
+    file's #! line, else whatever `python` (or `python3`) is. Names are
+    either what list_interpreters reports ("pypy3.10") or a command on
+    PATH ("pypy3", "python3.12"). Plain runs go to the interpreter's warm
+    pool of pywarm.py processes; benchmark and profiling runs start a
+    fresh process each time so refilling the pool can't skew them.
+
+    With an ArtifactStore, warm runs also skip compiling the script:
+    pywarm.py marshals the code object it compiled into the store, named
+    by a hash of the source, interpreter and path, and loads it from there
+    next time.
+    """
+    extension = ".py"
+    file_type = "py"
+    modes = frozenset({"benchmark", "profile", "memprofile"}) | TERMINAL_MODES
+
+    def __init__(self, store=None, pool_size=PYTHON_POOL_SIZE):
+        self.store = store
+        self.code_cache_runs = 0  # Warm runs that could use the code cache
+        self.code_cache_hits = 0  # ... and found the script already compiled
+        self.pool_size = pool_size
+        self.interpreters = {}  # Store {name: PythonInterpreter}
+        self.aliases = {}  # Store {command or name: interpreter name}
+        self.default = None  # Name of the interpreter used when a run doesn't pick one
+        self.discovery = None  # Task running discover()
+        self.syntax_errors = OrderedDict()  # Store {cache key: SyntaxError report or None}
+
+    def template(self, filename):
+        return 'print("Hello, World!")\n'
+
+    async def start(self):
+        # Probing every python* on PATH takes a while, don't hold up the server for it
+        self.discovery = asyncio.create_task(self.discover())
+        self.discovery.add_done_callback(lambda task: task.cancelled() or task.exception() or self.warm_default())
+
+    def warm_default(self):
+        default = self.interpreters[self.default]
+        if default.pool:
+            asyncio.create_task(default.pool.fill())
+
+    async def discovered(self):
+        """Wait until the interpreters on PATH are known"""
+        if self.discovery is None:
+            self.discovery = asyncio.ensure_future(self.discover())
+        await asyncio.shield(self.discovery)
+
+    async def stop(self):
+        for interpreter in self.interpreters.values():
+            if interpreter.pool:
+                interpreter.pool.stop()
+
+    async def discover(self):
+        """Find the Python interpreters on PATH
+
+        Every python*/pypy* executable is probed; commands that turn out
+        to be the same installation (same sys.executable) share one entry.
+        The first installation of a minor version on PATH is named e.g.
+        "cpython3.11", later ones get the full version ("cpython3.11.2").
+        A command name refers to the one earlier on PATH, as in a shell.
+        """
+        commands = []
+        for directory in os.environ.get("PATH", "").split(os.pathsep):
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                if PYTHON_COMMAND_RE.match(name) and os.access(path, os.X_OK):
+                    commands.append((name, path))
+        commands.append((os.path.basename(sys.executable), sys.executable))  # The server's own, always usable
+
+        probes = await asyncio.gather(*(probe_interpreter(path) for _, path in commands))
+        by_executable = {}
+        for (command, _), probe in zip(commands, probes):
+            if probe is None:
+                continue
+            implementation, version, executable = probe
+            key = os.path.realpath(executable)
+            if key not in by_executable:
+                name = f"{implementation.lower()}{'.'.join(version.split('.')[:2])}"
+                if name in self.interpreters:
+                    name = f"{implementation.lower()}{version}"  # Another install of the same minor version
+                if name in self.interpreters:
+                    continue
+                self.interpreters[name] = PythonInterpreter(name, implementation, version, executable, self.pool_size)
+                self.aliases[name] = name
+                by_executable[key] = self.interpreters[name]
+            self.aliases.setdefault(command, by_executable[key].name)
+        self.default = self.aliases.get("python") or self.aliases.get("python3") or next(iter(self.interpreters))
+        print("Python interpreters: " + ", ".join(
+            f"{name} ({interpreter.path})" for name, interpreter in self.interpreters.items()
+        ))
+
+    async def list_interpreters(self):
+        await self.discovered()
+        return [interpreter.describe() for interpreter in self.interpreters.values()], self.default
+
+    async def interpreter_for(self, file_path, options):
+        """The PythonInterpreter a run of file_path uses, see the class docstring
+
+        Raises ValueError for an interpreter that isn't installed.
+        """
+        await self.discovered()
+        requested = options.get("interpreter") or shebang_interpreter(file_path)
+        if not requested:
+            return self.interpreters[self.default]
+        if not isinstance(requested, str) or requested not in self.aliases:
+            raise ValueError(f"Unknown Python interpreter {requested!r} (available: {', '.join(self.interpreters)})")
+        return self.interpreters[self.aliases[requested]]
+
+    async def cache_key(self, file_path, options=None):
+        interpreter = await self.interpreter_for(file_path, options or {})
+        return file_hash(file_path, f"{self.extension} {interpreter.name} {interpreter.path}")
+
+    def stats(self):
+        if not self.code_cache_runs:
+            return None
+        return {"code_cache": {
+            "runs": self.code_cache_runs,
+            "skipped_compile": self.code_cache_hits,
+            "skipped_fraction": round(self.code_cache_hits / self.code_cache_runs, 4)
+        }}
+
+    async def precheck(self, file_path, options):
+        """Compile the file in the server's own interpreter to catch syntax errors
+
+        Only done when the run's interpreter speaks the same Python version
+        as the server, otherwise the grammar may differ and the run itself
+        has to tell.
+        """
+        interpreter = await self.interpreter_for(file_path, options)
+        if interpreter.version.split(".")[:2] != [str(part) for part in sys.version_info[:2]]:
+            return None
+        key = await self.cache_key(file_path, options)
+        cached = key in self.syntax_errors
+        if cached:
+            error = self.syntax_errors[key]
+            self.syntax_errors.move_to_end(key)
+        else:
+            loop = asyncio.get_running_loop()
+            error = await loop.run_in_executor(None, python_syntax_error, file_path)  # compile() of a big file takes a while
+            cache_put(self.syntax_errors, key, error)
+        if error is None:
+            return None
+        return precheck_error(f"Syntax error:\n{error}", cached=cached)
+
+    async def diagnostics(self, file_path):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, python_diagnostics, file_path)
+
+    async def build(self, file_path, options, work_dir):
+        interpreter = await self.interpreter_for(file_path, options)
+        details = {"interpreter": interpreter.name}
+        file_path = os.path.abspath(file_path)  # The run's cwd is a scratch directory
+        if options.get("memprofile"):
+            if interpreter.implementation != "CPython":
+                raise ValueError(f"memprofile needs tracemalloc, which {interpreter.name} doesn't have")
+            cmd = [interpreter.path, MEMPROFILE_SCRIPT, os.path.join(work_dir, "memprofile.json"),
+                   *self.memprofile_args(options["memprofile"]), file_path]
+        elif options.get("profile"):
+            cmd = [interpreter.path, "-m", "cProfile", "-o", os.path.join(work_dir, "cprofile.out"), file_path]
+        elif options.get("benchmark") or options.get("pty"):
+            cmd = [interpreter.path, file_path]  # Fresh processes, which the pool and code cache don't serve
+        elif interpreter.pool is not None:
+            return self.warm_build(interpreter, file_path, details)
+        else:
+            cmd = [interpreter.path, file_path]
+        return Build(cmd, details=details)
+
+    def warm_build(self, interpreter, file_path, details):
+        """Build for a run on interpreter's warm pool, using the code cache if there is one
+
+        The code object's file name is the script path, so that is part of
+        the key too. pywarm.py only writes the cache file if the source it
+        compiled still hashes to this key.
+        """
+        cmd = [interpreter.path, file_path]
+        if not self.store:
+            return Build(cmd, pool=interpreter.pool, request={"script": file_path}, details=details)
+
+        salt = f"{self.extension} {interpreter.name} {interpreter.path} {file_path}"
+        name = f"{file_hash(file_path, salt)}.pyc"
+        self.store.acquire(name)
+        cached = self.store.lookup(name) is not None
+        self.code_cache_runs += 1
+        self.code_cache_hits += cached
+
+        def release():
+            self.store.adopt(name)  # pywarm.py publishes it on a miss
+            self.store.release(name)
+
+        request = {"script": file_path, "code": self.store.path(name), "salt": salt}
+        return Build(cmd, cached=cached, pool=interpreter.pool, request=request,
+                     details=details, release=release)
+
+    async def execute(self, build, input_data, capture_output=True, cpu=None, log=None):
+        if build.pool is None:
+            return await super().execute(build, input_data, capture_output, cpu, log)
+        request = {**build.request, "cwd": build.cwd} if build.cwd else build.request
+        return await build.pool.run(json.dumps(request), input_data, log, limited=True)
+
+    def memprofile_args(self, options):
+        """INTERVAL TOP FRAMES arguments for memprofile.py from run options
+
+        options is either true or a dict with interval (seconds between
+        samples), top (allocation sites to return) and frames (traceback
+        depth recorded per allocation; more frames cost more overhead).
+        """
+        if not isinstance(options, dict):
+            options = {}
+        interval = options.get("interval", MEMPROFILE_DEFAULT_INTERVAL)
+        if not isinstance(interval, (int, float)):
+            interval = MEMPROFILE_DEFAULT_INTERVAL
+        frames = options.get("frames", 1)
+        if not isinstance(frames, int):
+            frames = 1
+        return [
+            str(max(interval, MEMPROFILE_MIN_INTERVAL)),
+            str(profile_top(options)),
+            str(max(1, min(frames, MEMPROFILE_MAX_FRAMES)))
+        ]
+
+    async def collect_profile(self, build, work_dir, options):
+        stats_path = os.path.join(work_dir, "cprofile.out")
+        if not os.path.exists(stats_path):
+            return {"tool": "cProfile", "error": "No profile written (did the program exit early?)"}
+        loop = asyncio.get_running_loop()
+        functions = await loop.run_in_executor(None, read_cprofile_stats, stats_path, profile_top(options))
+        return {"tool": "cProfile", "sort": "cumulative", "functions": functions}
+
+
+class NativeRunner(CommandRunner):
+    """C/C++ through a GCC-compatible compiler and the shared build cache
+
+    All NativeRunners put binaries in the same ArtifactStore, named by a hash of the source, its local headers and the compiler path,
+    version and flags, so an unchanged file is never compiled twice. C++
+    sources that include PCH_HEADER get it precompiled once per compiler
+    and flag set.
+    """
+    modes = frozenset({"benchmark", "profile"}) | TERMINAL_MODES
+    compiler_ids = {}  # Store {compiler: "path version"}, shared by all native runners
+    pch_flags = {}  # Store {pch key: extra compiler flags}
+    pch_locks = {}  # Store {pch key: asyncio.Lock} so a header is only built once
+
+    def __init__(self, extension, file_type, compile_cmd, store, template="", syntax_check=False):
+        self.extension = extension
+        self.file_type = file_type
+        self.compile_cmd = compile_cmd
+        self.store = store
+        self.pch_dir = os.path.join(store.root, "pch")
+        self._template = template
+        self.syntax_check = syntax_check  # Run -fsyntax-only before building, see precheck()
+        self.syntax_errors = OrderedDict()  # Store {cache key: compiler diagnostics or None}
+
+    def template(self, filename):
+        return self._template
+
+    async def available(self):
+        return shutil.which(self.compile_cmd[0]) is not None
+
+    async def start(self):
+        os.makedirs(self.pch_dir, exist_ok=True)
+
+    async def compiler_id(self):
+        """Path and version of the compiler, used in build cache keys"""
+        compiler = self.compile_cmd[0]
+        if compiler not in self.compiler_ids:
+            returncode, stdout, _, _ = await run_process([compiler, "-dumpfullversion", "-dumpversion"])
+            version = stdout.decode().strip() if returncode == 0 else "unknown"
+            self.compiler_ids[compiler] = f"{shutil.which(compiler) or compiler} {version}"
+        return self.compiler_ids[compiler]
+
+    async def cache_key(self, file_path, options=None):
+        return source_hash(file_path, " ".join([await self.compiler_id(), *self.compile_cmd[1:]]))
+
+    async def precheck(self, file_path, options):
+        """-fsyntax-only pass over a source the build cache doesn't have yet
+
+        Much cheaper than a full build for C, so a typo is reported without
+        paying for code generation and linking. For C++ the front end is
+        most of the build, so registering with syntax_check=False avoids
+        checking twice on the way to a successful build.
+        """
+        if not self.syntax_check:
+            return None
+        key = await self.cache_key(file_path)
+        if self.store.lookup(f"{key}.out"):
+            return None
+        if key in self.syntax_errors:
+            self.syntax_errors.move_to_end(key)
+            error = self.syntax_errors[key]
+            return None if error is None else precheck_error(f"Compilation error: {error}", cached=True)
+        returncode, _, stderr, usage = await run_process([*self.compile_cmd, "-fsyntax-only", file_path])
+        error = stderr.decode() if returncode != 0 else None
+        cache_put(self.syntax_errors, key, error)
+        return None if error is None else precheck_error(f"Compilation error: {error}", usage)
+
+    async def diagnostics(self, file_path):
+        cmd = [*self.compile_cmd, *await self.extra_flags(file_path), "-fsyntax-only", "-Wall", file_path]
+        _, _, stderr, _ = await run_process(cmd)
+        return os.path.basename(self.compile_cmd[0]), gcc_diagnostics(stderr.decode(errors="replace"), file_path)
+
+    async def extra_flags(self, file_path):
+        """Precompiled header flags if a C++ source includes PCH_HEADER"""
+        if self.extension == ".cpp":
+            with open(file_path, "rb") as f:
+                if PCH_HEADER.encode() in f.read():
+                    return await self.precompiled_header_flags()
+        return []
+
+    async def precompiled_header_flags(self):
+        """Flags that make compile_cmd pick up a precompiled PCH_HEADER
+
+        The .gch is built on first use for each compiler + flag set and put in
+        its own directory under pch_dir. Passing that directory with -I makes
+        g++ find the .gch before the real header. If the flags don't match the
+        ones it was built with, g++ silently falls back to the header. Returns
+        [] when the header can't be precompiled.
+        """
+        compile_cmd = self.compile_cmd
+        key = hashlib.sha256(" ".join([await self.compiler_id(), *compile_cmd[1:]]).encode()).hexdigest()[:16]
+        if key in self.pch_flags:
+            return self.pch_flags[key]
+
+        async with self.pch_locks.setdefault(key, asyncio.Lock()):
+            if key in self.pch_flags:
+                return self.pch_flags[key]
+            pch_dir = os.path.join(self.pch_dir, key)
+            gch_path = os.path.join(pch_dir, PCH_HEADER + ".gch")
+            if not os.path.exists(gch_path):
+                # Ask the preprocessor where the real header lives
+                returncode, stdout, _, _ = await run_process(
+                    [*compile_cmd, "-M", "-x", "c++", "-"], f"#include <{PCH_HEADER}>\n".encode()
+                )
+                header = next((token for token in stdout.decode().split() if token.endswith("/" + PCH_HEADER)), None)
+                if returncode != 0 or header is None:
+                    self.pch_flags[key] = []
+                    return []
+                os.makedirs(os.path.dirname(gch_path), exist_ok=True)
+                tmp_path = f"{gch_path}.tmp"
+                returncode, _, stderr, usage = await run_process([*compile_cmd, "-x", "c++-header", header, "-o", tmp_path])
+                if returncode != 0:
+                    print(f"Failed to precompile {PCH_HEADER}: {stderr.decode()}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    self.pch_flags[key] = []
+                    return []
+                os.replace(tmp_path, gch_path)
+                print(f"Precompiled {PCH_HEADER} for {' '.join(compile_cmd)} in {usage['wall_time']:.2f}s")
+            self.pch_flags[key] = ["-I", pch_dir]
+            return self.pch_flags[key]
+
+    async def build(self, file_path, options, work_dir):
+        if options.get("profile"):
+            # Instrumented build, bypasses the cache; gmon.out lands in work_dir
+            binary = os.path.join(work_dir, "program")
+            returncode, _, stderr, usage = await run_process([*self.compile_cmd, "-pg", file_path, "-o", binary])
+            env = {**os.environ, "GMON_OUT_PREFIX": os.path.join(work_dir, "gmon.out")}
+            return Build([binary], env, usage, error=stderr.decode() if returncode != 0 else None)
+
+        name = f"{await self.cache_key(file_path)}.out"
+        self.store.acquire(name)  # Until the run is over
+        release = lambda: self.store.release(name)
+        try:
+            binary = self.store.lookup(name)
+            if binary:
+                return Build([binary], cached=True, release=release)
+
+            # Build under a temporary name so a concurrent run never sees half a binary
+            extra_flags = await self.extra_flags(file_path)
+            tmp_binary = self.store.temp_path()
+            try:
+                returncode, _, stderr, usage = await run_process(
+                    [*self.compile_cmd, *extra_flags, file_path, "-o", tmp_binary]
+                )
+            except BaseException:
+                os.remove(tmp_binary)
+                raise
+            if returncode != 0:
+                os.remove(tmp_binary)
+                release()
+                return Build(usage=usage, error=stderr.decode())
+            return Build([self.store.publish(tmp_binary, name)], usage=usage, release=release)
+        except BaseException:
+            release()
+            raise
+
+    async def collect_profile(self, build, work_dir, options):
+        # glibc appends the pid to GMON_OUT_PREFIX
+        gmon_files = glob.glob(os.path.join(work_dir, "gmon.out*"))
+        if not gmon_files:
+            return {"tool": "gprof", "error": "No gmon.out written (gprof needs the program to exit normally)"}
+        returncode, stdout, stderr, _ = await run_process(["gprof", "-b", "-p", build.cmd[0], gmon_files[0]])
+        if returncode != 0:
+            return {"tool": "gprof", "error": stderr.decode()}
+        flat_profile = stdout.decode()
+        return {
+            "tool": "gprof",
+            "functions": parse_gprof_flat_profile(flat_profile, profile_top(options)),
+            "flat_profile": flat_profile
+        }
+
+
+def _frame(*fields):
+    """Encode fields for the JavaRunner protocol: 4-byte length, then the bytes"""
+    return b"".join(len(field).to_bytes(4, "big") + field for field in fields)
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)  # Another filesystem
+
+
+def _java_usage(field):
+    """Telemetry dict from a JavaRunner "wall user sys" nanoseconds field"""
+    wall, user, sys_time = (int(value) / 1e9 for value in field.decode().split())
+    return {"wall_time": round(wall, 6), "user_time": round(user, 6), "sys_time": round(sys_time, 6), "max_rss_kb": None}
+
+
+class JavaDaemon:
+    """A warm JVM running JavaRunner.java, see that file for the protocol
+
+    Each runs in a working directory of its own, which enter() fills with
+    what a run's scratch directory holds before the run, on CORES' run
+    cores and under LIMITS' CPU share for as long as it lives; JavaRunner holds each run
+    to the CPU time limit and -Xmx to the memory limit.
+    """
+
+    def __init__(self, process, cwd, run_limits):
+        self.process = process
+        self.cwd = cwd
+        self.run_limits = run_limits
+        self.killed = False
+
+    @classmethod
+    async def start(cls, java_cmd):
+        os.makedirs(JAVA_WORK_ROOT, exist_ok=True)
+        cwd = tempfile.mkdtemp(prefix="jvm-", dir=JAVA_WORK_ROOT)
+        run_limits = LIMITS.start(memory=False, cpu_time=False)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *java_cmd, JAVA_RUNNER_SOURCE, str(OUTPUT_MAX_BYTES),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                cwd=cwd,
+                preexec_fn=_preexec(CORES.preexec(), run_limits and run_limits.preexec())
+            )
+        except BaseException:
+            if run_limits is not None:
+                LIMITS.finish(run_limits)
+            shutil.rmtree(cwd, ignore_errors=True)
+            raise
+        CORES.started(process)
+        daemon = cls(process, cwd, run_limits)
+        try:
+            ready = await daemon.read_field()
+        except asyncio.IncompleteReadError:
+            await process.wait()
+            daemon.close()
+            raise RuntimeError(f"Java runner exited during startup with code {process.returncode}")
+        if ready != b"ready":
+            daemon.kill()
+            raise RuntimeError("Java runner sent an unexpected greeting")
+        return daemon
+
+    @property
+    def alive(self):
+        return self.process.returncode is None and not self.killed
+
+    async def read_field(self):
+        length = int.from_bytes(await self.process.stdout.readexactly(4), "big")
+        return await self.process.stdout.readexactly(length)
+
+    def enter(self, cwd):
+        """Empty the JVM's working directory and link (or copy) cwd's files into it; cwd None just empties it"""
+        for entry in os.scandir(self.cwd):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+        if cwd is not None:
+            shutil.copytree(cwd, self.cwd, symlinks=True, copy_function=_link_or_copy, dirs_exist_ok=True)
+
+    async def run(self, class_name, source, input_data):
+        """Compile and run one program, returning (status, exit_code, stdout, stderr, compile_usage, execute_usage)
+
+        status is "ok" or "compile_error". Raises RuntimeError if the JVM
+        died without answering. Each stream is cut at OUTPUT_MAX_BYTES by
+        JavaRunner; a run over LIMITS' CPU time ends like one killed by
+        SIGXCPU, and one that leaves threads running ends normally, each
+        taking the JVM with it.
+        """
+        cpu_time_limit = int(LIMITS.cpu_time_limit * 1e9) if LIMITS.backend and LIMITS.cpu_time_limit else 0
+        self.process.stdin.write(_frame(class_name.encode(), source, input_data, str(cpu_time_limit).encode()))
+        await self.process.stdin.drain()
+        try:
+            fields = [await self.read_field() for _ in range(7)]
+        except asyncio.IncompleteReadError:
+            await self.process.wait()
+            raise RuntimeError(f"Java runner died with code {self.process.returncode}")
+        status, exit_code, stdout, stderr, compile_times, run_times, output_bytes = fields
+        exit_code = int(exit_code)
+        if status in (b"exit", b"cpu_limit", b"threads_left"):
+            # System.exit() couldn't be trapped, the run went over its CPU time or left threads, and the JVM is going down
+            await self.process.wait()
+            if status != b"threads_left":
+                exit_code = self.process.returncode if status == b"exit" else -signal.SIGXCPU
+            status = b"ok"
+        compile_usage = _java_usage(compile_times)
+        execute_usage = None
+        if status == b"ok":
+            total = sum(int(value) for value in output_bytes.split())
+            execute_usage = output_stats(_java_usage(run_times), total, len(stdout) + len(stderr))
+        return status.decode(), exit_code, stdout, stderr, compile_usage, execute_usage
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+            self.killed = True
+        self.close()
+
+    def close(self):
+        """Release what the JVM held once it is gone: its group and its working directory"""
+        if self.run_limits is not None:
+            LIMITS.finish(self.run_limits)
+            self.run_limits = None
+        if self.cwd is not None:
+            shutil.rmtree(self.cwd, ignore_errors=True)
+            self.cwd = None
+
+
+class JvmRunner(Runner):
+    """.java files, compiled and run inside a pool of warm JavaDaemons"""
+    extension = ".java"
+    file_type = "java"
+
+    def __init__(self, pool_size=JAVA_POOL_SIZE):
+        self.pool_size = pool_size
+        self.java_cmd = None  # JVM command line for JavaRunner.java, set by java_command()
+        self.idle = asyncio.Queue()  # Warm JavaDaemons waiting for a run
+        self.daemons = []  # Every live JavaDaemon, idle or busy
+        self.starting = 0  # JavaDaemons being started
+
+    def template(self, filename):
+        class_name = os.path.splitext(os.path.basename(filename))[0]
+        return (f'public class {class_name} {{\n    public static void main(String[] args) {{\n'
+                f'        System.out.println("Hello, World!");\n    }}\n}}\n')
+
+    async def available(self):
+        return shutil.which("java") is not None and await self.java_command() is not None
+
+    async def start(self):
+        # Have a JVM warm before the first .java run arrives
+        if shutil.which("java"):
+            asyncio.create_task(self.add_daemon())
+
+    async def stop(self):
+        for daemon in self.daemons:
+            daemon.kill()
+
+    async def java_command(self):
+        """JVM command line for JavaRunner.java, or None without a Java 17+ JDK"""
+        if self.java_cmd is None:
+            returncode, _, stderr, _ = await run_process(["java", "-version"])
+            match = re.search(r'version "(\d+)', stderr.decode())
+            major = int(match.group(1)) if returncode == 0 and match else 0
+            if major < 17:
+                self.java_cmd = []
+            else:
+                self.java_cmd = ["java", "-XX:+UseSerialGC", "-Xshare:auto"]
+                if LIMITS.backend and LIMITS.memory_limit:
+                    self.java_cmd.append(f"-Xmx{LIMITS.memory_limit}")  # RLIMIT_AS would stop the JVM starting
+                if major < 24:
+                    # Lets JavaRunner trap System.exit(), see its docstring
+                    self.java_cmd.append("-Djava.security.manager=allow")
+        return self.java_cmd or None
+
+    async def add_daemon(self):
+        """Start one more warm JVM and put it in the idle pool"""
+        self.starting += 1
+        try:
+            java_cmd = await self.java_command()
+            if java_cmd is None:
+                raise RuntimeError("Running .java files needs a Java 17+ JDK")
+            daemon = await JavaDaemon.start(java_cmd)
+        except Exception as e:
+            print(f"Could not start Java runner: {e}")
+            return
+        finally:
+            self.starting -= 1
+        self.daemons.append(daemon)
+        self.idle.put_nowait(daemon)
+
+    async def acquire(self):
+        """Take an idle JVM, starting one if the pool isn't full yet"""
+        if self.idle.empty() and len(self.daemons) + self.starting < self.pool_size:
+            await self.add_daemon()
+        if not self.daemons and not self.starting:
+            raise RuntimeError("Running .java files needs a Java 17+ JDK")
+        return await self.idle.get()
+
+    def release(self, daemon):
+        """Return a JVM to the pool, or replace it if it died during the run"""
+        if daemon.alive:
+            self.idle.put_nowait(daemon)
+        else:
+            daemon.close()
+            self.daemons.remove(daemon)
+            asyncio.create_task(self.add_daemon())
+
+    async def run(self, file_path, input_data, options, cwd=None, on_phase=None, terminal=None, log=None):
+        # Classes run inside a shared JVM, whose working directory gets cwd's files instead of being cwd
+        with open(file_path, "rb") as f:
+            source = f.read()
+        stdin = input_data.encode() if isinstance(input_data, str) else input_data.read()  # Framed to the JVM
+        if on_phase:
+            await on_phase("running")  # The JVM compiles and runs in one go
+        daemon = await self.acquire()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, daemon.enter, cwd)
+            status, exit_code, stdout, stderr, compile_usage, execute_usage = await daemon.run(
+                os.path.splitext(os.path.basename(file_path))[0], source, stdin
+            )
+        except BaseException:
+            # Died, or we were cancelled mid-run and can't trust its state
+            daemon.kill()
+            raise
+        finally:
+            self.release(daemon)
+
+        telemetry = {"compile": compile_usage, "compile_cached": False, "execute": execute_usage}
+        if status == "compile_error":
+            return {"status": "error", "message": f"Compilation error: {stderr.decode()}", "telemetry": telemetry}
+        if log is not None:
+            stdout, stderr = log.spill("stdout", stdout), log.spill("stderr", stderr)
+        return {
+            "status": "success",
+            "result": stdout.decode(errors="replace"),
+            "error": stderr.decode(errors="replace"),
+            "exit_code": exit_code,
+            "telemetry": telemetry
+        }
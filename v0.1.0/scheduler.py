@@ -0,0 +1,346 @@
+"""Bounded run execution, shortest expected job first
+
+Only so many runs execute at once; the rest wait in a queue. With FIFO
+one 30-second simulation holds up every 50 ms run queued behind it, so
+the queue is ordered by how long each job is expected to take instead,
+from an exponentially weighted average of how long the same file took
+on the same runner before.
+
+Runs are also queued per client, so one client sending run_file in a loop
+can't take every slot: clients get turns (weighted round-robin), each
+with a token bucket of CPU seconds that its runs are charged for, and a
+cap on how many jobs it may have queued. The server handles a
+connection's run_file requests one at a time, so that cap never rejects
+its runs, only the background checks it has going at once.
+
+Every run has a priority class. Interactive runs ("run what I just
+typed") go ahead of batch runs (bulk grading), which go ahead of
+background work (checks of saved files nobody is waiting on), and some
+slots are kept free of anything but interactive runs. Background work
+never takes the last free slot, except a single slot nothing else is
+waiting for.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict, deque
+
+SCHEDULING_POLICIES = ("sjf", "fifo")
+PRIORITY_CLASSES = ("interactive", "batch", "background")  # Highest first
+INTERACTIVE_RESERVED_SLOTS = 1  # Slots other classes leave free for interactive runs (always at least one usable)
+RUN_ESTIMATE_ALPHA = 0.3  # Weight of the latest duration in a job's moving average
+RUN_ESTIMATE_DEFAULT = 1.0  # Seconds expected of a job type never seen before
+RUN_ESTIMATES_LIMIT = 4096  # Jobs whose durations are remembered, least recently run dropped first
+QUEUE_AGING_RATE = 1.0  # Expected seconds a job gains on newer jobs per second it waits
+QUEUE_WAIT_SAMPLES = 1000  # Recent queue waits kept for the percentiles in stats()
+CLIENT_QUEUE_LIMIT = 8  # Jobs of a class one client may have waiting at once, more are rejected
+CLIENT_BURST_SECONDS = 30.0  # CPU seconds a client can use in one go before it is throttled
+CLIENT_REFILL_RATE = 1.0  # CPU seconds a client earns back per second (times its weight)
+QUEUE_PROGRESS_INTERVAL = 1.0  # Seconds between on_queued calls for a waiting job
+
+
+class QueueFull(Exception):
+    """A client already has CLIENT_QUEUE_LIMIT runs waiting"""
+
+
+def percentiles(samples):
+    """count/p50/p90/p99/max of a list of durations, in seconds (nearest rank)"""
+    if not samples:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+    rank = lambda p: ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+    return {
+        "count": len(ordered),
+        "p50": round(rank(0.5), 6),
+        "p90": round(rank(0.9), 6),
+        "p99": round(rank(0.99), 6),
+        "max": round(ordered[-1], 6)
+    }
+
+
+class ClassQueue:
+    """Waiting jobs of one priority class, fair-shared between clients"""
+
+    def __init__(self, name):
+        self.name = name
+        self.clients = {}  # Store {client: ClientQueue}
+        self.running = 0
+        self.rejections = 0
+        self.waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+
+    def client_queue(self, client, weight):
+        queue = self.clients.get(client)
+        if queue is None:
+            queue = self.clients[client] = ClientQueue(client, weight)
+        queue.weight = weight
+        return queue
+
+    def queued(self):
+        return sum(queue.queued() for queue in self.clients.values())
+
+    def next_client(self):
+        """ClientQueue to start a job from next, or None if nothing is waiting
+
+        Weighted round-robin over the clients with jobs waiting: in each
+        round every client starts up to weight jobs, and within a round
+        the client whose next job comes first in queue order goes first,
+        so shortest-expected-first still holds across clients. Clients
+        that have used up their tokens are skipped while others haven't
+        (if all have, the one least in debt goes, so slots never sit idle).
+        """
+        now = time.monotonic()
+        ready = []
+        for queue in list(self.clients.values()):
+            queue.refill(now)
+            if queue.queued():
+                ready.append(queue)
+            elif queue.idle:
+                del self.clients[queue.client]
+        if not ready:
+            return None
+        eligible = [queue for queue in ready if queue.tokens > 0] or [max(ready, key=lambda queue: queue.tokens)]
+        in_round = [queue for queue in eligible if queue.served < queue.weight]
+        if not in_round:
+            # Everyone waiting has had their share, start a new round
+            for queue in self.clients.values():
+                queue.served = 0
+            in_round = eligible
+        queue = min(in_round, key=lambda queue: queue.waiting[0][:2])
+        queue.served += 1
+        return queue
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queued": self.queued(),
+            "queue_wait": percentiles(self.waits),
+            "clients": len(self.clients),
+            "throttled_clients": sum(queue.tokens <= 0 for queue in self.clients.values()),
+            "rejections": self.rejections
+        }
+
+
+class ClientQueue:
+    """One client's waiting jobs and token bucket"""
+
+    def __init__(self, client, weight=1):
+        self.client = client
+        self.weight = weight  # Jobs started per round-robin round, and refill rate multiplier
+        self.served = 0  # Jobs started this round
+        self.waiting = []  # Heap of (priority, sequence, future resolved when the job may run, estimate)
+        self.running = 0
+        self.tokens = CLIENT_BURST_SECONDS  # CPU seconds left, negative while throttled
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(CLIENT_BURST_SECONDS, self.tokens + (now - self.updated) * CLIENT_REFILL_RATE * self.weight)
+        self.updated = now
+
+    def queued(self):
+        """Number of jobs still waiting, dropping cancelled ones"""
+        self.waiting = [entry for entry in self.waiting if not entry[2].done()]
+        heapq.heapify(self.waiting)
+        return len(self.waiting)
+
+    @property
+    def idle(self):
+        """Nothing queued or running and a full bucket: nothing worth remembering"""
+        return not self.waiting and not self.running and self.tokens >= CLIENT_BURST_SECONDS
+
+
+class RunScheduler:
+    """Lets at most slots jobs run at once, queueing the rest
+
+    With the "sjf" policy a queued job's place is its enqueue time plus
+    its expected duration divided by QUEUE_AGING_RATE: shorter jobs go
+    first, but every second spent waiting counts against the job's
+    estimate, so a long job waits at most about estimate / rate before
+    newly queued short jobs stop overtaking it. "fifo" orders by enqueue
+    time only, for comparison.
+
+    A job is identified by key (what exactly runs, e.g. file hash and
+    runner) and group (e.g. the runner). Jobs with no history of their
+    own are estimated from their group's.
+
+    That order applies within each client's queue, clients share their
+    class fairly (see ClassQueue.next_client) and classes are served in
+    PRIORITY_CLASSES order. Batch and background jobs use idle slots but
+    never the last INTERACTIVE_RESERVED_SLOTS of them, and background
+    jobs never the last free one either unless it is the only one.
+    """
+
+    def __init__(self, slots, policy="sjf"):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy {policy!r}")
+        self.slots = slots
+        self.policy = policy
+        self.reserved = max(0, min(INTERACTIVE_RESERVED_SLOTS, slots - 1))
+        self.running = 0
+        self.classes = {name: ClassQueue(name) for name in PRIORITY_CLASSES}
+        self.sequence = itertools.count()
+        self.active = {}  # Store {sequence: (start time, estimate)} of running jobs
+        self.estimates = OrderedDict()  # Store {key: average run seconds}, least recently run first
+        self.group_estimates = {}  # Store {group: average run seconds}
+        self.waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+
+    def resize(self, slots):
+        """Change how many jobs may run at once, starting queued jobs if there are more slots
+
+        With fewer, running jobs finish as usual and nothing new starts
+        until the count is under the new limit.
+        """
+        self.slots = slots
+        self.reserved = max(0, min(INTERACTIVE_RESERVED_SLOTS, slots - 1))
+        self.dispatch()
+
+    def estimate(self, key, group):
+        """Expected run time of a job, in seconds"""
+        if key in self.estimates:
+            return self.estimates[key]
+        return self.group_estimates.get(group, RUN_ESTIMATE_DEFAULT)
+
+    def record(self, key, group, seconds):
+        """Fold one finished job's duration into its averages"""
+        previous = self.estimates.pop(key, None)
+        self.estimates[key] = seconds if previous is None else previous + RUN_ESTIMATE_ALPHA * (seconds - previous)
+        while len(self.estimates) > RUN_ESTIMATES_LIMIT:
+            self.estimates.popitem(last=False)
+        previous = self.group_estimates.get(group)
+        self.group_estimates[group] = seconds if previous is None else previous + RUN_ESTIMATE_ALPHA * (seconds - previous)
+
+    def can_start(self, priority_class):
+        """Whether a job of priority_class may take a slot right now"""
+        if self.running >= self.slots:
+            return False
+        if priority_class == PRIORITY_CLASSES[0]:
+            return True
+        if priority_class == PRIORITY_CLASSES[-1] and self.slots > 1 and self.running >= self.slots - 1:
+            return False  # One stays free for interactive runs, unless it's the only one and sits idle
+        return self.running - self.classes[PRIORITY_CLASSES[0]].running < self.slots - self.reserved
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key, group, client=None, weight=1, priority_class=PRIORITY_CLASSES[0], on_queued=None):
+        """Wait for a free slot, hold it for the body and record how long the body took
+
+        The body gets a dict to set "cpu_time" in, the CPU seconds the job
+        used, which is charged to client's token bucket; without it the
+        time the slot was held is charged instead. Raises
+        QueueFull if the client already has CLIENT_QUEUE_LIMIT jobs of
+        this class waiting, ValueError for an unknown priority_class.
+        If the job has to wait, on_queued(position, start_in) is awaited
+        when it is queued and every QUEUE_PROGRESS_INTERVAL seconds until
+        it starts (see queue_position).
+        """
+        if priority_class not in self.classes:
+            raise ValueError(f"Unknown priority class {priority_class!r} (one of {', '.join(PRIORITY_CLASSES)})")
+        enqueued = time.monotonic()
+        class_queue = self.classes[priority_class]
+        queue = class_queue.client_queue(client, weight)
+        ahead = PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority_class) + 1]
+        if self.can_start(priority_class) and not any(self.classes[name].queued() for name in ahead):
+            self.take(class_queue, queue)
+        else:
+            if queue.queued() >= CLIENT_QUEUE_LIMIT:
+                class_queue.rejections += 1
+                raise QueueFull(f"Too many {priority_class} runs queued (at most {CLIENT_QUEUE_LIMIT} per client)")
+            estimate = self.estimate(key, group)
+            priority = enqueued
+            if self.policy == "sjf":
+                priority += estimate / QUEUE_AGING_RATE
+            ready = asyncio.get_running_loop().create_future()
+            heapq.heappush(queue.waiting, (priority, next(self.sequence), ready, estimate))
+            try:
+                while not ready.done():
+                    if on_queued is not None:
+                        await on_queued(*self.queue_position(ready))
+                    await asyncio.wait({ready}, timeout=QUEUE_PROGRESS_INTERVAL if on_queued else None)
+            except BaseException:
+                if ready.done() and not ready.cancelled():
+                    self.release(class_queue, queue)  # Given the slot just as we were cancelled
+                ready.cancel()
+                raise
+        wait = time.monotonic() - enqueued
+        self.waits.append(wait)
+        class_queue.waits.append(wait)
+
+        started = time.monotonic()
+        job = next(self.sequence)
+        self.active[job] = (started, self.estimate(key, group))
+        usage = {}
+        try:
+            yield usage
+        finally:
+            now = time.monotonic()
+            del self.active[job]
+            queue.refill(now)
+            cpu_time = usage.get("cpu_time")
+            queue.tokens -= now - started if cpu_time is None else cpu_time
+            self.release(class_queue, queue)
+        self.record(key, group, now - started)
+
+    def take(self, class_queue, queue):
+        """Count a job as running from the moment it is given its slot
+
+        queue (its ClientQueue) too, so next_client never forgets a client
+        whose job was handed a slot but hasn't resumed yet, nor its debt.
+        """
+        self.running += 1
+        class_queue.running += 1
+        queue.running += 1
+
+    def release(self, class_queue, queue):
+        """Free a finished job's slot and start whatever queued jobs may now run"""
+        self.running -= 1
+        class_queue.running -= 1
+        queue.running -= 1
+        self.dispatch()
+
+    def dispatch(self):
+        """Give free slots to queued jobs, highest class first"""
+        for name in PRIORITY_CLASSES:
+            class_queue = self.classes[name]
+            while self.can_start(name):
+                queue = class_queue.next_client()
+                if queue is None:
+                    break
+                ready = heapq.heappop(queue.waiting)[2]
+                self.take(class_queue, queue)
+                ready.set_result(None)
+            if class_queue.queued():
+                return  # Lower classes wait until this one is served
+
+    def queue_position(self, ready):
+        """(position, start_in) of the waiting job whose future is ready
+
+        position counts from 1 and includes every queued job of a higher
+        class and every job of the same class that is further up its
+        client's order. start_in is the expected seconds of work ahead
+        (those jobs plus what running jobs have left) spread over all
+        slots. Both are estimates: fair sharing between clients can
+        reorder a class's jobs.
+        """
+        now = time.monotonic()
+        waiting = [(rank, entry) for rank, name in enumerate(PRIORITY_CLASSES)
+                   for queue in self.classes[name].clients.values() for entry in queue.waiting
+                   if not entry[2].done()]
+        rank, own = next((rank, entry) for rank, entry in waiting if entry[2] is ready)
+        ahead = [entry for other_rank, entry in waiting
+                 if other_rank < rank or (other_rank == rank and entry[:2] < own[:2])]
+        work = sum(entry[3] for entry in ahead)
+        work += sum(max(0.0, estimate - (now - started)) for started, estimate in self.active.values())
+        return len(ahead) + 1, round(work / self.slots, 3)
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "slots": self.slots,
+            "reserved_interactive_slots": self.reserved,
+            "running": self.running,
+            "queued": sum(class_queue.queued() for class_queue in self.classes.values()),
+            "queue_wait": percentiles(self.waits),
+            "tracked_jobs": len(self.estimates),
+            "classes": {name: class_queue.stats() for name, class_queue in self.classes.items()}
+        }
@@ -0,0 +1,88 @@
+"""Per-run scratch directories that programs run in
+
+Every run gets a fresh, empty-but-seeded working directory under one root,
+on a memory-backed filesystem when there is one. Whatever the program
+writes there is thrown away with the whole directory once the run is over,
+so nothing it does piles up in the workspace or on disk.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+
+from artifacts import tmpfs_dir
+
+SCRATCH_SEED_MAX_BYTES = 4 * 1024 * 1024  # Larger workspace files aren't copied into scratch directories
+SCRATCH_SEED_TOTAL_MAX_BYTES = 16 * 1024 * 1024  # Seeded per directory at most, smallest files first
+
+
+class ScratchSpace:
+    """Creates and removes the scratch directories of runs under root
+
+    Each directory is seeded with copies of the data files next to the
+    program (input.txt and friends: anything in seed_dir that isn't
+    hidden, isn't source code and is small enough), so programs that open
+    files by relative path still find them. Copies, not links: a program
+    writing to one must not change the workspace's.
+    """
+
+    def __init__(self, root, seed_dir=None, source_extensions=()):
+        self.root = root
+        self.seed_dir = seed_dir
+        self.source_extensions = source_extensions  # Files with these extensions are never seeded
+        self.pending = 0  # Directories queued for removal
+
+    @classmethod
+    def default_root(cls, name):
+        """root on tmpfs if there is one, otherwise in the system temp directory"""
+        return tmpfs_dir(name, need_exec=False) or os.path.join(tempfile.gettempdir(), f"{name}-{os.getuid()}")
+
+    def sweep(self):
+        """Startup cleanup: drop every scratch directory earlier runs left behind"""
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+    def seed_files(self):
+        """Paths of the files every directory is seeded with, SCRATCH_SEED_TOTAL_MAX_BYTES of them at most"""
+        if not self.seed_dir:
+            return []
+        candidates = []
+        for entry in os.scandir(self.seed_dir):
+            if (entry.name.startswith(".") or not entry.is_file()
+                    or os.path.splitext(entry.name)[1] in self.source_extensions):
+                continue
+            if entry.stat().st_size <= SCRATCH_SEED_MAX_BYTES:
+                candidates.append((entry.stat().st_size, entry.name, entry.path))
+        files = []
+        total = 0
+        for size, _, path in sorted(candidates):
+            if total + size > SCRATCH_SEED_TOTAL_MAX_BYTES:
+                break
+            total += size
+            files.append(path)
+        return files
+
+    def make(self, files=None):
+        path = tempfile.mkdtemp(prefix="run-", dir=self.root)
+        for file_path in self.seed_files():
+            shutil.copyfile(file_path, os.path.join(path, os.path.basename(file_path)))
+        for name, content in (files or {}).items():
+            with open(os.path.join(path, os.path.basename(name)), "wb") as f:
+                f.write(content)
+        return path
+
+    async def create(self, files=None):
+        """Make and seed a new scratch directory, returning its path
+
+        files ({name: bytes}) are written into it as well, for runs whose
+        data files come from elsewhere (see worker.py).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.make, files)
+
+    def remove(self, path):
+        """Delete a scratch directory and everything in it, in the background"""
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, shutil.rmtree, path, True)
+        future.add_done_callback(lambda _: setattr(self, "pending", self.pending - 1))
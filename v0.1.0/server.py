@@ -1,15 +1,248 @@
 #!/usr/bin/env python3
 import asyncio
+import base64
+import codecs
 import websockets
 import os
+import hashlib
 import json
-import subprocess
+import re
 import signal
 import sys
 import time
+from collections import OrderedDict, deque
 from pathlib import Path
 
+from artifacts import ArtifactStore, tmpfs_dir
+from broker import Broker, WorkerLost
+from limits import LIMITS
+from process import CORES, OUTPUT_MAX_BYTES, PTY_EOF, cpu_time, is_file
+from runlogs import RUN_LOG_STREAMS, RunLogStore, read_bytes
+from runners import (
+    C_TEMPLATE, CPP_TEMPLATE, RUN_MODES, RUNNERS, JvmRunner, NativeRunner, PythonRunner,
+    cache_put, get_runner, local_includes, register_runner, runner_for_type
+)
+from scheduler import PRIORITY_CLASSES, QueueFull, RunScheduler
+from scratch import ScratchSpace
+
 WORKSPACE_DIR = "workspace"
+ARTIFACTS_ON_TMPFS = False  # Keep build outputs on /dev/shm: faster, but gone after a reboot
+ARTIFACT_DIR = (ARTIFACTS_ON_TMPFS and tmpfs_dir("codeserver-artifacts")) or os.path.join(WORKSPACE_DIR, ".build")
+ARTIFACT_STORE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used build outputs are evicted past this
+INPUT_DIR = os.path.join(WORKSPACE_DIR, ".inputs")  # Datasets stored by upload_input
+INPUT_STORE_MAX_BYTES = 1024 * 1024 * 1024  # Least recently used datasets are evicted past this
+INPUT_ID_RE = re.compile(r"[0-9a-f]{64}")  # sha256 of the dataset
+MESSAGE_MAX_BYTES = 64 * 1024 * 1024  # Largest message accepted, bounds upload_input datasets
+RUN_LOG_DIR = os.path.join(WORKSPACE_DIR, ".logs")  # Output of runs that wrote more than their response carries
+RUN_LOG_INLINE_BYTES = 1024 * 1024  # Output per stream a run_file response carries, longer streams go to the run's log
+RUN_LOG_TTL = 3600  # Seconds after a run that its log can still be read
+RUN_LOG_STORE_MAX_BYTES = 1024 * 1024 * 1024  # Oldest logs are expired early past this
+RUN_LOG_READ_MAX_BYTES = 1024 * 1024  # Most data one get_run_output sends
+RUN_LOG_PAGE_LINES = 1000  # Lines get_run_output sends when not told how many
+LOG_ID_RE = re.compile(r"[0-9a-f]{32}")
+OUTPUT_FRAME_BYTES = 16 * 1024  # Streamed run output is sent once this much has built up...
+OUTPUT_FRAME_LATENCY = 0.05  # ...or once the oldest unsent output is this many seconds old
+SEND_HIGH_WATERMARK = 256 * 1024  # Sends wait (and streamed runs stop being read) past this much unsent data
+SEND_LOW_WATERMARK = 64 * 1024  # ...until the connection's write buffer is down to this
+EVENT_LOOP_CORES = 1  # Cores kept for the event loop and its threads, runs get the rest (0: runs share every core)
+BENCHMARK_EXCLUSIVE_CORES = 1  # Run cores benchmarks with exclusive_cpu can take for themselves, one each
+MAX_CONCURRENT_RUNS = None  # Runs executing at once, later ones queue; None for one per run core
+RUN_LIMITS = "rlimit"  # How runs are held to the limits below: "rlimit" or None; "cgroup" and "auto" (cgroup if possible) move the server into a group of its own
+RUN_MEMORY_LIMIT = None  # Bytes a run may use: memory.max of its cgroup, or RLIMIT_AS of each process; None for no limit
+RUN_CPU_LIMIT = None  # Cores' worth of CPU a run may use at once (cpu.max, cgroups only); None for no limit
+RUN_CPU_TIME_LIMIT = None  # CPU seconds each process of a run may use (RLIMIT_CPU); None for no limit
+RUN_SCHEDULING = "sjf"  # Queue order: "sjf" (shortest expected run first, with aging) or "fifo"
+SCRATCH_ROOT = ScratchSpace.default_root("codeserver-scratch")  # Each run's working directory is created in here
+BROKER_ADDRESS = os.path.join(WORKSPACE_DIR, ".broker.sock")  # Where worker.py processes connect: socket path, "HOST:PORT" or None
+BROKER_TOKEN = None  # Secret workers must register with, required for TCP
+BROKER_RESUBMIT_LIMIT = 2  # Times a run is sent to another node after its worker died, then it runs here
+BROKER_SOURCE_EXTENSIONS = (".py", ".h", ".hpp")  # Code next to a program it may load, sent along with remote runs
+BROKER_SOURCES_MAX_BYTES = 4 * 1024 * 1024  # Runs whose code around them is bigger than this stay here
+RECENT_RUNS_LIMIT = 100  # Number of per-run telemetry records kept for get_metrics
+DIAGNOSTICS_CACHE_SIZE = 1024  # Save-time diagnostics remembered, by content hash
+
+ARTIFACTS = ArtifactStore(ARTIFACT_DIR, ARTIFACT_STORE_MAX_BYTES)
+INPUTS = ArtifactStore(INPUT_DIR, INPUT_STORE_MAX_BYTES)
+RUN_LOGS = RunLogStore(RUN_LOG_DIR, RUN_LOG_TTL, RUN_LOG_STORE_MAX_BYTES, RUN_LOG_INLINE_BYTES)
+
+register_runner(PythonRunner(ARTIFACTS))
+register_runner(NativeRunner(".c", "c", ["gcc"], ARTIFACTS, C_TEMPLATE, syntax_check=True))
+register_runner(NativeRunner(".cpp", "cpp", ["g++", "-std=gnu++17"], ARTIFACTS, CPP_TEMPLATE))
+register_runner(JvmRunner())
+
+CORES.configure(EVENT_LOOP_CORES, BENCHMARK_EXCLUSIVE_CORES)
+LOCAL_SLOTS = MAX_CONCURRENT_RUNS or CORES.run_core_count()
+
+SCRATCH = ScratchSpace(SCRATCH_ROOT, WORKSPACE_DIR, frozenset(RUNNERS))
+SCHEDULER = RunScheduler(LOCAL_SLOTS, RUN_SCHEDULING)
+BROKER = Broker(BROKER_ADDRESS, LOCAL_SLOTS, BROKER_TOKEN, on_change=lambda: SCHEDULER.resize(BROKER.capacity()))
+
+
+def write_input(content):
+    """Write an uploaded dataset to a temp file in the input store, returning (input ID, temp path)
+
+    Runs in an executor; publishing is left to the event loop, which owns the store's index.
+    """
+    temp_path = INPUTS.temp_path()
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    return hashlib.sha256(content).hexdigest(), temp_path
+
+
+def job_sources(file_path):
+    """{path relative to file_path's directory: content} of the code a run of it may load, besides itself
+
+    That's the local headers it includes and every BROKER_SOURCE_EXTENSIONS
+    file under its directory (modules it imports), so a worker can lay
+    them out around the source the same way. None if they can't all be
+    sent: one is outside the directory, or together they're over
+    BROKER_SOURCES_MAX_BYTES.
+    """
+    root = os.path.dirname(os.path.abspath(file_path))
+    paths = {path for path, _ in local_includes(file_path)[1:]}
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        paths.update(os.path.join(dir_path, name) for name in file_names
+                     if os.path.splitext(name)[1] in BROKER_SOURCE_EXTENSIONS and not name.startswith("."))
+    paths.discard(os.path.abspath(file_path))
+    sources = {}
+    total = 0
+    for path in sorted(paths):
+        relative = os.path.relpath(path, root)
+        if relative.startswith(os.pardir + os.sep):
+            return None
+        total += os.path.getsize(path)
+        if total > BROKER_SOURCES_MAX_BYTES:
+            return None
+        with open(path, "rb") as f:
+            sources[relative] = f.read()
+    return sources
+
+
+def remote_job(file_path, input_data, options):
+    """What an execution worker needs to run a file, or None if it has to run here
+
+    That's its source and the code around it it may load (see
+    job_sources), its input and the workspace's data files. Runs in an
+    executor. An uploaded input is read in and sent along.
+    """
+    sources = job_sources(file_path)
+    if sources is None:
+        return None
+    with open(file_path) as f:
+        source = f.read()
+    if is_file(input_data):
+        input_data.seek(0)
+        input_data = input_data.read().decode(errors="replace")
+    files = {}
+    for seed_path in SCRATCH.seed_files():
+        with open(seed_path, "rb") as f:
+            files[os.path.basename(seed_path)] = base64.b64encode(f.read()).decode()
+    return {
+        "filename": os.path.basename(file_path),
+        "source": source,
+        "input": input_data,
+        "sources": {path: base64.b64encode(content).decode() for path, content in sources.items()},
+        "files": files,
+        "options": {key: value for key, value in options.items() if key not in ("action", "input", "input_id")}
+    }
+
+
+def run_usage(response):
+    """(compile usage, execute usage, executions) of a run_file response
+
+    Benchmark runs count every iteration, with their summed usage.
+    """
+    telemetry = response.get("telemetry") or {}
+    if response.get("benchmark"):
+        benchmark = response["benchmark"]
+        return telemetry.get("compile"), benchmark["total"], benchmark["iterations"] + benchmark["warmup"]
+    return telemetry.get("compile"), telemetry.get("execute"), 1
+
+
+class RunProgress:
+    """Sends "run_progress" events for a run_file request that had to queue: its place in line, then its phases"""
+
+    def __init__(self, websocket, filename):
+        self.websocket = websocket
+        self.filename = filename
+        self.queued = False
+
+    async def send(self, phase, **fields):
+        try:
+            await self.websocket.send(json.dumps({
+                "event": "run_progress",
+                "filename": self.filename,
+                "phase": phase,
+                **fields
+            }))
+        except websockets.exceptions.ConnectionClosed:
+            pass  # The response won't reach anyone either
+
+    async def on_queued(self, position, start_in):
+        self.queued = True
+        await self.send("queued", position=position, start_in=start_in)
+
+    async def on_phase(self, phase):
+        if self.queued:
+            await self.send(phase)
+
+
+class Terminal:
+    """The client's end of a pty run: output goes out in "run_output" events, run_input comes in"""
+
+    def __init__(self, websocket, filename):
+        self.websocket = websocket
+        self.filename = filename
+        self.process = None  # PtyProcess while the program runs
+        self.pending = []  # Input that arrived before the program started
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = b""  # Output not sent yet
+        self.flush_timer = None  # Sends buffer once OUTPUT_FRAME_LATENCY has passed
+        self.send_lock = asyncio.Lock()  # Keeps events in order between timed and full-frame flushes
+        self.task = None  # The run_file task
+
+    def attach(self, process):
+        self.process = process
+        if process is not None:
+            for data in self.pending:
+                process.write(data)
+            self.pending.clear()
+
+    def write(self, data):
+        if self.process is not None:
+            self.process.write(data)
+        else:
+            self.pending.append(data)
+
+    async def output(self, chunk):
+        self.buffer += chunk
+        if len(self.buffer) >= OUTPUT_FRAME_BYTES:
+            await self.flush()
+        elif self.flush_timer is None:
+            loop = asyncio.get_running_loop()
+            self.flush_timer = loop.call_later(OUTPUT_FRAME_LATENCY, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """Send whatever output is buffered, waiting for room on the connection"""
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        async with self.send_lock:
+            while self.buffer:
+                frame, self.buffer = self.buffer[:OUTPUT_FRAME_BYTES], self.buffer[OUTPUT_FRAME_BYTES:]
+                text = self.decoder.decode(frame)
+                if not text:
+                    continue  # Only part of a character so far
+                try:
+                    await self.websocket.send(json.dumps({
+                        "event": "run_output",
+                        "filename": self.filename,
+                        "data": text
+                    }))
+                except websockets.exceptions.ConnectionClosed:
+                    self.buffer = b""  # The run is cancelled once the connection handler notices
+
 
 class CodeServer:
     def __init__(self, host="localhost", port=8765):
@@ -17,26 +250,67 @@ class CodeServer:
         self.port = port
         self.active_sessions = {}
         self.file_locks = {}  # Store {filename: (client_id, timestamp)}
+        self.metrics = {
+            "runs": 0,
+            "compiles": 0,
+            "compile_time": {"wall_time": 0.0, "user_time": 0.0, "sys_time": 0.0},
+            "execute_time": {"wall_time": 0.0, "user_time": 0.0, "sys_time": 0.0},
+            "max_rss_kb": 0,
+            "compile_cache_hits": 0
+        }
+        self.recent_runs = deque(maxlen=RECENT_RUNS_LIMIT)
+        self.diagnostics_cache = OrderedDict()  # Store {runner cache key: (tool, diagnostics)}
+        self.diagnostics_tasks = {}  # Store {filename: asyncio.Task} checking its latest save
+        self.client_diagnostics = {}  # Store {client_id: set of its diagnostics tasks still running}
+        self.terminals = {}  # Store {client_id: Terminal} of the client's pty run in progress
         
-        # Ensure workspace directory exists
+        # Ensure the workspace exists and clean up what earlier runs left behind
         Path(WORKSPACE_DIR).mkdir(exist_ok=True)
+        ARTIFACTS.sweep()
+        INPUTS.sweep()
+        RUN_LOGS.sweep()
+        SCRATCH.sweep()
+        self.remove_stray_binaries()
         
+    def remove_stray_binaries(self):
+        """Delete <name>.out binaries older versions compiled into the workspace itself"""
+        for file in os.listdir(WORKSPACE_DIR):
+            file_path = os.path.join(WORKSPACE_DIR, file)
+            if not file.endswith(".out") or not os.path.isfile(file_path):
+                continue
+            with open(file_path, "rb") as f:
+                if f.read(4) != b"\x7fELF":
+                    continue  # Not something we compiled
+            os.remove(file_path)
+            print(f"Removed stray binary {file}")
+            
     async def start(self):
         """Start the WebSocket server"""
         print(f"Server starting on {self.host}:{self.port}")
+        CORES.pin_loop()  # Before the default executor starts its threads, they'd get every core
+        LIMITS.configure(RUN_LIMITS, "codeserver", RUN_MEMORY_LIMIT, RUN_CPU_LIMIT, RUN_CPU_TIME_LIMIT)
         
         # Handle graceful shutdown
         loop = asyncio.get_event_loop()
         if sys.platform != "win32":
             for sig in (signal.SIGINT, signal.SIGTERM):
                 loop.add_signal_handler(sig, lambda: asyncio.create_task(self.shutdown()))
+                
+        # Let runners warm up whatever they keep between runs
+        for runner in RUNNERS.values():
+            await runner.start()
+        await BROKER.start()
             
-        async with websockets.serve(self.handle_client, self.host, self.port, ping_interval=None):
+        async with websockets.serve(self.handle_client, self.host, self.port, ping_interval=None,
+                                    max_size=MESSAGE_MAX_BYTES, write_limit=(SEND_HIGH_WATERMARK, SEND_LOW_WATERMARK)):
             await asyncio.Future()  # Run forever
             
     async def shutdown(self):
         """Gracefully shutdown the server"""
         print("\nShutting down server...")
+        await BROKER.stop()
+        for runner in RUNNERS.values():
+            await runner.stop()
         tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
         [task.cancel() for task in tasks]
         await asyncio.gather(*tasks, return_exceptions=True)
@@ -62,12 +336,24 @@ class CodeServer:
                         await self.save_file(websocket, data, client_id)
                     elif action == "create_file":
                         await self.create_file(websocket, data)
+                    elif action == "run_file" and data.get("pty"):
+                        await self.start_terminal_run(websocket, data, client_id)
                     elif action == "run_file":
-                        await self.run_file(websocket, data)
+                        await self.run_file(websocket, data, client_id)
+                    elif action == "run_input":
+                        await self.run_input(websocket, data, client_id)
+                    elif action == "upload_input":
+                        await self.upload_input(websocket, data)
+                    elif action == "get_run_output":
+                        await self.get_run_output(websocket, data)
                     elif action == "check_lock":
                         await self.check_file_lock(websocket, data, client_id)
                     elif action == "release_lock":
                         await self.release_file_lock(websocket, data, client_id)
+                    elif action == "get_metrics":
+                        await self.get_metrics(websocket)
+                    elif action == "list_interpreters":
+                        await self.list_interpreters(websocket)
                     else:
                         await websocket.send(json.dumps({
                             "status": "error",
@@ -85,6 +371,11 @@ class CodeServer:
         finally:
             if client_id in self.active_sessions:
                 del self.active_sessions[client_id]
+            for task in self.client_diagnostics.pop(client_id, ()):
+                task.cancel()  # Nobody to send the results to
+            terminal = self.terminals.pop(client_id, None)
+            if terminal is not None:
+                terminal.task.cancel()  # Nobody left to type into it
                 
     def release_all_locks(self, client_id):
         """Release all file locks held by a client"""
@@ -94,14 +385,72 @@ class CodeServer:
                 del self.file_locks[filename]
                 print(f"Released lock on {filename} after client disconnect")
                 
+    def record_run(self, filename, response):
+        """Add one run_file response's telemetry to the server metrics"""
+        telemetry = response.get("telemetry") or {}
+        compile_usage, execute_usage, iterations = run_usage(response)
+        if telemetry.get("compile_cached"):
+            self.metrics["compile_cache_hits"] += 1
+            
+        for phase, usage in (("compile", compile_usage), ("execute", execute_usage)):
+            if usage is None:
+                continue
+            totals = self.metrics[f"{phase}_time"]
+            for key in totals:
+                totals[key] += usage[key] or 0.0
+            self.metrics["max_rss_kb"] = max(self.metrics["max_rss_kb"], usage["max_rss_kb"] or 0)
+        if compile_usage is not None:
+            self.metrics["compiles"] += 1
+        if execute_usage is not None:
+            self.metrics["runs"] += iterations
+
+        self.recent_runs.append({
+            "filename": filename,
+            "timestamp": time.time(),
+            "compile": compile_usage,
+            "execute": execute_usage,
+            "exit_code": response.get("exit_code"),
+            "iterations": iterations,
+            "interpreter": telemetry.get("interpreter"),
+            "worker": telemetry.get("worker")
+        })
+
+    async def get_metrics(self, websocket):
+        """Send aggregate run metrics and the most recent per-run telemetry"""
+        await websocket.send(json.dumps({
+            "status": "success",
+            "action": "get_metrics",
+            "metrics": self.metrics,
+            "runners": {ext: runner.stats() for ext, runner in RUNNERS.items() if runner.stats()},
+            "artifacts": ARTIFACTS.stats(),
+            "inputs": INPUTS.stats(),
+            "run_logs": RUN_LOGS.stats(),
+            "scheduler": SCHEDULER.stats(),
+            "broker": BROKER.stats(),
+            "cores": CORES.stats(),
+            "limits": LIMITS.stats(),
+            "recent_runs": list(self.recent_runs)
+        }))
+
+    async def list_interpreters(self, websocket):
+        """List the Python interpreters run_file's "interpreter" option accepts"""
+        runner = get_runner(".py")
+        interpreters, default = await runner.list_interpreters() if runner else ([], None)
+        await websocket.send(json.dumps({
+            "status": "success",
+            "action": "list_interpreters",
+            "interpreters": interpreters,
+            "default": default
+        }))
+
     async def list_files(self, websocket):
         """List all code files in the workspace with lock status"""
         files = []
         for file in os.listdir(WORKSPACE_DIR):
             file_path = os.path.join(WORKSPACE_DIR, file)
-            if os.path.isfile(file_path) and not file.endswith(".out"):
+            if os.path.isfile(file_path):
                 ext = os.path.splitext(file)[1]
-                if ext in [".py", ".c", ".cpp", ""]:
+                if ext in RUNNERS or ext == "":
                     locked = file in self.file_locks
                     files.append(file)
                     
@@ -220,6 +569,7 @@ class CodeServer:
                 "action": "save_file",
                 "message": f"File {filename} saved successfully"
             }))
+            self.start_diagnostics(websocket, filename, file_path)
         except Exception as e:
             await websocket.send(json.dumps({
                 "status": "error",
@@ -227,6 +577,54 @@ class CodeServer:
                 "message": f"Error saving file: {str(e)}"
             }))
             
+    def start_diagnostics(self, websocket, filename, file_path):
+        """Check a saved file in the background, replacing any check of an older save"""
+        runner = get_runner(os.path.splitext(filename)[1])
+        if runner is None:
+            return
+        previous = self.diagnostics_tasks.get(filename)
+        if previous:
+            previous.cancel()
+        task = asyncio.create_task(self.push_diagnostics(websocket, filename, file_path, runner))
+        self.diagnostics_tasks[filename] = task
+        client_tasks = self.client_diagnostics.setdefault(id(websocket), set())
+        client_tasks.add(task)
+        task.add_done_callback(client_tasks.discard)
+        task.add_done_callback(
+            lambda done: self.diagnostics_tasks.get(filename) is done and self.diagnostics_tasks.pop(filename)
+        )
+        
+    async def push_diagnostics(self, websocket, filename, file_path, runner):
+        """Send a "diagnostics" event for a saved file, from the cache if its content was seen before
+
+        Checks take a background-class scheduler slot, so they only use what runs leave idle.
+        """
+        try:
+            key = await runner.cache_key(file_path)
+            cached = key in self.diagnostics_cache
+            if cached:
+                result = self.diagnostics_cache[key]
+                self.diagnostics_cache.move_to_end(key)
+            else:
+                async with SCHEDULER.slot(f"{key} diagnostics", f"{runner.extension} diagnostics",
+                                          id(websocket), priority_class="background"):
+                    result = await runner.diagnostics(file_path)
+                if result is None:
+                    return
+                cache_put(self.diagnostics_cache, key, result, DIAGNOSTICS_CACHE_SIZE)
+            tool, diagnostics = result
+            await websocket.send(json.dumps({
+                "event": "diagnostics",
+                "filename": filename,
+                "tool": tool,
+                "cached": cached,
+                "diagnostics": diagnostics
+            }))
+        except (websockets.exceptions.ConnectionClosed, QueueFull):
+            pass
+        except Exception as e:
+            print(f"Diagnostics for {filename} failed: {e}")
+            
     async def create_file(self, websocket, data):
         """Create a new file"""
         filename = data.get("filename")
@@ -256,12 +654,11 @@ class CodeServer:
             return
             
         try:
-            # Create empty file
+            # Create the file from the runner's template (empty for unknown types)
+            runner = runner_for_type(file_type)
             with open(file_path, "w") as f:
-                if file_type == "c":
-                    f.write('#include <stdio.h>\n\nint main() {\n    printf("Hello, World!\\n");\n    return 0;\n}\n')
-                elif file_type == "py":
-                    f.write('print("Hello, World!")\n')
+                if runner:
+                    f.write(runner.template(filename))
                     
             await websocket.send(json.dumps({
                 "status": "success",
@@ -276,7 +673,85 @@ class CodeServer:
                 "message": f"Error creating file: {str(e)}"
             }))
             
-    async def run_file(self, websocket, data):
+    async def upload_input(self, websocket, data):
+        """Store an input dataset once, by content hash, for run_file's "input_id" option"""
+        content = data.get("data")
+        if not isinstance(content, str):
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "upload_input",
+                "message": "Input data is required"
+            }))
+            return
+            
+        try:
+            loop = asyncio.get_running_loop()
+            input_id, temp_path = await loop.run_in_executor(None, write_input, content.encode())
+            name = f"{input_id}.in"
+            if INPUTS.lookup(name):
+                os.remove(temp_path)  # Already uploaded
+            else:
+                INPUTS.publish(temp_path, name)
+            await websocket.send(json.dumps({
+                "status": "success",
+                "action": "upload_input",
+                "input_id": input_id,
+                "size": INPUTS.entries[name]
+            }))
+        except Exception as e:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "upload_input",
+                "message": f"Error storing input: {str(e)}"
+            }))
+            
+    def open_input(self, input_id):
+        """Open an uploaded dataset for reading, or None if it was never uploaded or has been evicted"""
+        if not isinstance(input_id, str) or not INPUT_ID_RE.fullmatch(input_id):
+            return None
+        path = INPUTS.lookup(f"{input_id}.in")
+        try:
+            return open(path, "rb") if path else None
+        except FileNotFoundError:
+            return None
+            
+    async def start_terminal_run(self, websocket, data, client_id):
+        """Start a pty run_file in the background, so run_input messages keep being read while it runs"""
+        if client_id in self.terminals:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_file",
+                "message": "An interactive run is already in progress"
+            }))
+            return
+            
+        terminal = Terminal(websocket, data.get("filename"))
+        self.terminals[client_id] = terminal
+        terminal.task = asyncio.create_task(self.run_file(websocket, data, client_id, terminal))
+        terminal.task.add_done_callback(
+            lambda _: self.terminals.get(client_id) is terminal and self.terminals.pop(client_id)
+        )
+        
+    async def run_input(self, websocket, data, client_id):
+        """Type input into the client's pty run; "eof": true ends its input
+
+        Not answered unless something is wrong, input is fire-and-forget.
+        """
+        terminal = self.terminals.get(client_id)
+        if terminal is None:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_input",
+                "message": "No interactive run in progress"
+            }))
+            return
+            
+        if isinstance(data.get("data"), str):
+            terminal.write(data["data"].encode())
+        if data.get("eof"):
+            terminal.write(PTY_EOF)
+            
+    async def run_file(self, websocket, data, client_id, terminal=None):
         """Run a code file and stream the output back to the client"""
         filename = data.get("filename")
         input_data = data.get("input", "")
@@ -290,71 +765,197 @@ class CodeServer:
             }))
             return
             
-        try:
-            ext = os.path.splitext(filename)[1]
+        ext = os.path.splitext(filename)[1]
+        runner = get_runner(ext)
+        if runner is None:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_file",
+                "message": f"Unsupported file type: {ext}"
+            }))
+            return
             
-            if ext == ".c":
-                # Compile and run C file
-                output_file = os.path.join(WORKSPACE_DIR, f"{os.path.splitext(filename)[0]}.out")
-                compile_cmd = ["gcc", file_path, "-o", output_file]
-                
-                compile_process = await asyncio.create_subprocess_exec(
-                    *compile_cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                
-                _, stderr = await compile_process.communicate()
-                
-                if compile_process.returncode != 0:
-                    await websocket.send(json.dumps({
-                        "status": "error",
-                        "action": "run_file",
-                        "message": f"Compilation error: {stderr.decode()}"
-                    }))
-                    return
-                    
-                cmd = [output_file]
-            elif ext == ".py":
-                # Run Python file
-                cmd = ["python", file_path]
-            else:
+        modes = [mode for mode in RUN_MODES if data.get(mode)]
+        if len(modes) > 1:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_file",
+                "message": f"{', '.join(modes)} can't be combined"
+            }))
+            return
+        if modes and modes[0] not in runner.modes:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_file",
+                "message": f"{modes[0]} isn't supported for {ext} files"
+            }))
+            return
+        if data.get("priority", PRIORITY_CLASSES[0]) not in PRIORITY_CLASSES:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_file",
+                "message": f"Unknown priority {data['priority']} (one of {', '.join(PRIORITY_CLASSES)})"
+            }))
+            return
+            
+        # An uploaded dataset is handed to the program as its stdin, never read by the server
+        input_file = None
+        if data.get("input_id") is not None:
+            input_file = self.open_input(data["input_id"])
+            if input_file is None:
                 await websocket.send(json.dumps({
                     "status": "error",
                     "action": "run_file",
-                    "message": f"Unsupported file type: {ext}"
+                    "message": f"Unknown input ID {data['input_id']} (never uploaded, or evicted)"
                 }))
                 return
-                
-            # Run the program with input if provided
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdin=asyncio.subprocess.PIPE if input_data else None,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+            input_data = input_file
+            
+        try:
+            # Syntax errors come straight back without starting anything
+            response = await runner.precheck(file_path, data) or await self.schedule_run(
+                runner, file_path, input_data, data, client_id, RunProgress(websocket, filename), terminal
             )
+        except Exception as e:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "run_file",
+                "message": f"Error running file: {str(e)}"
+            }))
+            return
+        finally:
+            if input_file is not None:
+                input_file.close()
             
-            if input_data:
-                stdout, stderr = await process.communicate(input_data.encode())
-            else:
-                stdout, stderr = await process.communicate()
-                
-            result = stdout.decode()
-            error = stderr.decode()
+        self.record_run(filename, response)
+        await websocket.send(json.dumps({"action": "run_file", **response}))
+        
+    async def schedule_run(self, runner, file_path, input_data, data, client_id, progress, terminal=None):
+        """Run a file once the scheduler gives it a slot, keeping output too long for the response in a run log"""
+        mode = next((mode for mode in RUN_MODES if data.get(mode)), "run")
+        build_key = await runner.cache_key(file_path, data)
+        key = f"{build_key} {mode}"
+        priority_class = data.get("priority", PRIORITY_CLASSES[0])
+        async with SCHEDULER.slot(key, f"{runner.extension} {mode}", client_id, priority_class=priority_class,
+                                  on_queued=progress.on_queued) as usage:
+            log = RUN_LOGS.create()
+            try:
+                response = await self.place_run(runner, file_path, input_data, data, build_key, progress, terminal, log)
+            except BaseException:
+                RUN_LOGS.finish(log, keep=False)
+                raise
+            usage["cpu_time"] = cpu_time(*run_usage(response)[:2])
+        output_log = RUN_LOGS.finish(log)
+        if output_log is not None:
+            response["output_log"] = output_log
+        return response
+        
+    async def place_run(self, runner, file_path, input_data, data, build_key, progress, terminal, log):
+        """Run a file in a scratch directory here or on an execution worker, see broker.py for which"""
+        job = None
+        remote = terminal is None
+        for attempt in range(BROKER_RESUBMIT_LIMIT + 2):
+            local = not remote or attempt > BROKER_RESUBMIT_LIMIT
+            with BROKER.placement(None if local else runner.extension, build_key) as worker:
+                if worker is None:
+                    cwd = await SCRATCH.create()
+                    try:
+                        response = await runner.run(file_path, input_data, data, cwd, progress.on_phase, terminal, log)
+                    finally:
+                        SCRATCH.remove(cwd)
+                    BROKER.record_build(None, response)
+                    return response
+                    
+                if job is None:
+                    loop = asyncio.get_running_loop()
+                    job = await loop.run_in_executor(None, remote_job, file_path, input_data, data)
+                    if job is None:
+                        remote = False
+                        continue
+                    await progress.on_phase("running")
+                try:
+                    response = await BROKER.run(worker, job)
+                except WorkerLost as e:
+                    print(f"Resubmitting {job['filename']}: {e}")
+                    continue
+                    
+            cut = response.pop("output_cut", ())  # Streams the worker cut to fit its result in a message
+            if response.get("status") == "success":
+                truncated = (response["telemetry"].get("execute") or {}).get("output_truncated")
+                for field, stream in (("result", "stdout"), ("error", "stderr")):
+                    output = response[field].encode()
+                    response[field] = log.spill(stream, output).decode(errors="replace")
+                    if truncated and len(output) >= OUTPUT_MAX_BYTES or field in cut:
+                        log.stream(stream).complete = False  # The worker already cut this one
+            if response.get("telemetry") is not None:
+                response["telemetry"]["worker"] = worker.name
+            BROKER.record_build(worker, response)
+            return response
+        
+    async def get_run_output(self, websocket, data):
+        """Send part of a run's log: "stream" (stdout or stderr) of "log_id", by byte or line range
+
+        "offset" and "length" ask for bytes, "line" (counting from 0) and
+        "lines" for whole lines; either way at most RUN_LOG_READ_MAX_BYTES
+        come back. Byte ranges can cut a character in two, which is sent
+        as U+FFFD, so ask for the next one from offset + length.
+        """
+        log_id = data.get("log_id")
+        stream = data.get("stream", "stdout")
+        found = None
+        if isinstance(log_id, str) and LOG_ID_RE.fullmatch(log_id) and stream in RUN_LOG_STREAMS:
+            found = RUN_LOGS.lookup(log_id, stream)
+        if found is None:
+            await websocket.send(json.dumps({
+                "status": "error",
+                "action": "get_run_output",
+                "message": f"No {stream} log for run {log_id} (it expired, or that output wasn't logged)"
+            }))
+            return
             
+        path, size = found
+        by_line = "line" in data
+        try:
+            start = int(data.get("line" if by_line else "offset", 0))
+            count = int(data.get("lines", RUN_LOG_PAGE_LINES) if by_line else data.get("length", RUN_LOG_READ_MAX_BYTES))
+        except (TypeError, ValueError):
+            start = count = -1
+        if start < 0 or count < 0:
             await websocket.send(json.dumps({
-                "status": "success",
-                "action": "run_file",
-                "result": result,
-                "error": error,
-                "exit_code": process.returncode
+                "status": "error",
+                "action": "get_run_output",
+                "message": "Ranges are non-negative integers"
             }))
-        except Exception as e:
+            return
+            
+        loop = asyncio.get_running_loop()
+        if by_line:
+            page = await loop.run_in_executor(None, RUN_LOGS.read_lines, log_id, stream, path, size,
+                                              start, count, RUN_LOG_READ_MAX_BYTES)
+        else:
+            chunk = await loop.run_in_executor(None, read_bytes, path, start, min(count, RUN_LOG_READ_MAX_BYTES))
+            page = None if chunk is None else (chunk, min(start, size))
+        if page is None:
             await websocket.send(json.dumps({
                 "status": "error",
-                "action": "run_file",
-                "message": f"Error running file: {str(e)}"
+                "action": "get_run_output",
+                "message": f"The log of run {log_id} has expired"
             }))
+            return
+            
+        response = {
+            "status": "success",
+            "action": "get_run_output",
+            "log_id": log_id,
+            "stream": stream,
+            "size": size,
+            "offset": page[1],
+            "length": len(page[0]),
+            "data": page[0].decode(errors="replace")
+        }
+        if by_line:
+            response.update(line=min(start, page[3]), next_line=page[2], total_lines=page[3])
+        await websocket.send(json.dumps(response))
 
 if __name__ == "__main__":
     server = CodeServer()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Execution worker: runs programs a code server's broker sends it
+
+Usage: worker.py BROKER_ADDRESS [--slots N] [--name NAME] [--token TOKEN]
+
+BROKER_ADDRESS is the server's BROKER_ADDRESS, a Unix socket path or
+HOST:PORT. The worker registers its slots and the file types it can run,
+sends heartbeats and runs what it is sent with the same runners as the
+server, each run in a fresh scratch directory holding the data files
+that came with it. Builds are cached in a store of its own under
+WORKER_DIR/NAME, next to the sources they were built from, so more than
+one worker can share a host as long as their names differ. If the
+connection drops, runs in progress are cancelled (the broker resubmits
+them elsewhere) and the worker reconnects.
+See broker.py for the protocol.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+
+from artifacts import ArtifactStore
+from broker import MessageTooLong, load_per_core, open_connection, read_message, result_message
+from limits import LIMITS
+from process import CORES
+from runners import (
+    C_TEMPLATE, CPP_TEMPLATE, RUNNERS, JvmRunner, NativeRunner, PythonRunner, get_runner, register_runner
+)
+from scratch import ScratchSpace
+
+WORKER_DIR = "workers"  # Each worker's build outputs go in WORKER_DIR/NAME
+WORKER_ARTIFACT_STORE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used build outputs are evicted past this
+WORKER_LOOP_CORES = 1  # Cores kept for the worker's event loop, runs get the rest (0: runs share every core)
+WORKER_EXCLUSIVE_CORES = 1  # Run cores benchmarks with exclusive_cpu can take for themselves, one each
+WORKER_RUN_LIMITS = "rlimit"  # As the server's RUN_LIMITS, and the limits below as its RUN_*_LIMIT
+WORKER_RUN_MEMORY_LIMIT = None
+WORKER_RUN_CPU_LIMIT = None
+WORKER_RUN_CPU_TIME_LIMIT = None
+WORKER_SOURCES_KEPT = 1024  # Sources kept on disk, least recently run dropped first
+WORKER_RECONNECT_DELAY = 1.0  # Seconds before reconnecting to the broker, doubled after every failed attempt...
+WORKER_RECONNECT_MAX_DELAY = 30.0  # ...up to this
+
+
+class Rejected(Exception):
+    """The broker turned the worker away"""
+
+
+class Worker:
+    """One connection to a broker at a time, and the runs it was sent"""
+
+    def __init__(self, address, name, slots, token=None):
+        self.address = address
+        self.name = name
+        self.slots = slots
+        self.token = token
+        self.scratch = ScratchSpace(ScratchSpace.default_root(f"codeserver-worker-{name}"))
+        self.source_root = os.path.abspath(os.path.join(WORKER_DIR, name, "sources"))
+        self.sources_in_use = {}  # Store {source directory: runs using it}
+        self.tasks = {}  # Store {job id: asyncio.Task running it}
+
+    def write_source(self, filename, source, sources):
+        """Path of source saved as filename, in a directory named by its hash
+
+        sources ({relative path: bytes}, the modules and headers next to
+        it on the server) are laid out around it the same way. The same
+        code always lands on the same path, which is part of what native
+        builds are cached by, so a rerun finds its binary. Runs in an
+        executor; drops the least recently used sources past
+        WORKER_SOURCES_KEPT.
+        """
+        digest = hashlib.sha256(f"{filename}\0{source}".encode())
+        for relative, content in sorted(sources.items()):
+            digest.update(b"\0" + relative.encode() + b"\0" + content)
+        source_dir = os.path.join(self.source_root, digest.hexdigest())
+        path = os.path.join(source_dir, filename)
+        if os.path.exists(path):
+            os.utime(source_dir)
+            return path
+        for relative, content in sources.items():
+            target = os.path.normpath(os.path.join(source_dir, relative))
+            if not target.startswith(source_dir + os.sep):
+                raise ValueError(f"source path {relative} is outside the run's directory")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(content)
+        os.makedirs(source_dir, exist_ok=True)
+        # The program itself goes last: once it exists, the directory is complete
+        with open(path + ".tmp", "w") as f:
+            f.write(source)
+        os.replace(path + ".tmp", path)
+        entries = sorted(os.scandir(self.source_root), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:max(0, len(entries) - WORKER_SOURCES_KEPT)]:
+            if entry.path not in self.sources_in_use:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return path
+
+    async def serve(self):
+        """Stay registered with the broker, reconnecting whenever the connection is lost"""
+        delay = WORKER_RECONNECT_DELAY
+        while True:
+            try:
+                reader, writer = await open_connection(self.address)
+            except OSError as e:
+                print(f"Can't reach broker at {self.address} ({e}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WORKER_RECONNECT_MAX_DELAY)
+                continue
+            delay = WORKER_RECONNECT_DELAY
+            try:
+                await self.session(reader, writer)
+            except (ConnectionError, ValueError) as e:
+                print(f"Lost broker at {self.address}: {e}")
+            await asyncio.sleep(delay)
+
+    async def session(self, reader, writer):
+        """Register over a fresh connection and take runs until it closes
+
+        Only extensions whose toolchain is installed here are offered, so
+        the broker never sends this worker a run it can't build.
+        """
+        extensions = sorted([extension for extension, runner in RUNNERS.items() if await runner.available()])
+        writer.write(json.dumps({
+            "type": "register",
+            "name": self.name,
+            "slots": self.slots,
+            "extensions": extensions,
+            "token": self.token
+        }).encode() + b"\n")
+        reply = json.loads(await read_message(reader) or "null")
+        if not isinstance(reply, dict) or reply.get("type") != "registered":
+            writer.close()
+            if isinstance(reply, dict) and reply.get("type") == "rejected":
+                raise Rejected(reply.get("message"))
+            raise ConnectionError("registration not answered")
+        print(f"Registered with {self.address} as worker {reply['worker']}: {self.slots} slots")
+        heartbeat = asyncio.create_task(self.heartbeat(writer, reply["heartbeat_interval"]))
+        try:
+            while True:
+                try:
+                    line = await read_message(reader)
+                except MessageTooLong as e:
+                    print(f"Broker at {self.address}: {e}")
+                    if e.job is not None:
+                        response = {"status": "error", "message": "Run too large to send to a worker"}
+                        writer.write(result_message(e.job, response))
+                    continue
+                if not line:
+                    print(f"Broker at {self.address} closed the connection")
+                    return
+                message = json.loads(line)
+                if message.get("type") == "run":
+                    job_id = message["job"]
+                    self.tasks[job_id] = asyncio.create_task(self.run_job(writer, message))
+                    self.tasks[job_id].add_done_callback(lambda _, job_id=job_id: self.tasks.pop(job_id, None))
+                elif message.get("type") == "cancel" and message.get("job") in self.tasks:
+                    self.tasks[message["job"]].cancel()
+        finally:
+            heartbeat.cancel()
+            for task in list(self.tasks.values()):
+                task.cancel()  # Nobody to send their results to
+            writer.close()
+
+    async def heartbeat(self, writer, interval):
+        while True:
+            writer.write(json.dumps({"type": "heartbeat", "load": load_per_core()}).encode() + b"\n")
+            await asyncio.sleep(interval)
+
+    async def run_job(self, writer, message):
+        """Run one file the broker sent and send back its run_file response"""
+        filename = os.path.basename(message["filename"])
+        runner = get_runner(os.path.splitext(filename)[1])
+        loop = asyncio.get_running_loop()
+        if runner is None:
+            response = {"status": "error", "message": f"Unsupported file type on worker {self.name}"}
+        else:
+            source_dir = cwd = None
+            try:
+                sources = {path: base64.b64decode(data) for path, data in (message.get("sources") or {}).items()}
+                file_path = await loop.run_in_executor(None, self.write_source, filename, message["source"], sources)
+                source_dir = os.path.dirname(file_path)
+                self.sources_in_use[source_dir] = self.sources_in_use.get(source_dir, 0) + 1
+                cwd = await self.scratch.create({
+                    name: base64.b64decode(data) for name, data in (message.get("files") or {}).items()
+                })
+                response = await runner.run(file_path, message.get("input", ""), message.get("options") or {}, cwd)
+            except Exception as e:
+                response = {"status": "error", "message": f"Error running file on worker {self.name}: {e}"}
+            finally:
+                if source_dir is not None:
+                    self.sources_in_use[source_dir] -= 1
+                    if not self.sources_in_use[source_dir]:
+                        del self.sources_in_use[source_dir]
+                if cwd is not None:
+                    self.scratch.remove(cwd)
+        try:
+            writer.write(await loop.run_in_executor(None, result_message, message["job"], response))
+            await writer.drain()
+        except ConnectionError:
+            pass  # The broker resubmits it
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run programs for a code server's broker")
+    parser.add_argument("address", help="the server's BROKER_ADDRESS: a Unix socket path or HOST:PORT")
+    parser.add_argument("--slots", type=int, help="runs to take at once (default: one per core runs get)")
+    parser.add_argument("--name", default=socket.gethostname(), help="unique per host")
+    parser.add_argument("--token", help="the server's BROKER_TOKEN, needed over TCP")
+    args = parser.parse_args()
+    CORES.configure(WORKER_LOOP_CORES, WORKER_EXCLUSIVE_CORES)
+    CORES.pin_loop()
+    LIMITS.configure(WORKER_RUN_LIMITS, f"codeserver-worker-{args.name}", WORKER_RUN_MEMORY_LIMIT, WORKER_RUN_CPU_LIMIT,
+                     WORKER_RUN_CPU_TIME_LIMIT)
+
+    work_dir = os.path.join(WORKER_DIR, args.name)
+    artifacts = ArtifactStore(os.path.join(work_dir, ".build"), WORKER_ARTIFACT_STORE_MAX_BYTES)
+    register_runner(PythonRunner(artifacts))
+    register_runner(NativeRunner(".c", "c", ["gcc"], artifacts, C_TEMPLATE, syntax_check=True))
+    register_runner(NativeRunner(".cpp", "cpp", ["g++", "-std=gnu++17"], artifacts, CPP_TEMPLATE))
+    register_runner(JvmRunner())
+    artifacts.sweep()
+
+    worker = Worker(args.address, args.name, max(1, args.slots or CORES.run_core_count()), args.token)
+    worker.scratch.sweep()
+    for runner in RUNNERS.values():
+        await runner.start()
+    try:
+        await worker.serve()
+    except Rejected as e:
+        print(f"Broker at {args.address} rejected this worker: {e}")
+    finally:
+        for runner in RUNNERS.values():
+            await runner.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Worker stopped")
+        sys.exit(0)